@@ -0,0 +1,97 @@
+"""
+Stand-in for the parts of the Gitea API the mirror uses, for load tests.
+
+Serves deterministic README.md/config.yaml contents for any repository, with
+ETags and 304s like Gitea, optional artificial latency, and counts every
+call so a driver can report Gitea calls per delivery.
+
+    python -m bench.fake_gitea --port 3900 --latency-ms 20
+
+Point GITTEA_URL of the API and the workers at it.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+from collections import Counter
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+import uvicorn
+from src.constants.index import AGENT_CONFIG_FILE, AGENT_README_FILE
+
+app = FastAPI()
+calls: Counter = Counter()
+latency = 0.0
+
+
+def file_content(owner: str, repo: str, path: str, ref: str) -> bytes:
+    if path == AGENT_CONFIG_FILE:
+        version = int(hashlib.sha1(ref.encode()).hexdigest()[:4], 16) % 100
+        return f"name: {repo}\nversion: 1.0.{version}\n".encode()
+    return f"# {owner}/{repo}\n\nBenchmark readme at {ref}.\n".encode() * 20
+
+
+@app.middleware("http")
+async def count_calls(request: Request, call_next):
+    if not request.url.path.startswith("/_"):
+        calls["total"] += 1
+        calls["contents" if "/contents/" in request.url.path else "other"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+    return await call_next(request)
+
+
+@app.get("/_stats")
+async def stats():
+    return dict(calls)
+
+
+@app.post("/_reset")
+async def reset():
+    calls.clear()
+    return {}
+
+
+@app.get("/api/v1/repos/{owner}/{repo}/contents/{path:path}")
+async def get_contents(owner: str, repo: str, path: str, request: Request, ref: str = "main"):
+    if path not in (AGENT_CONFIG_FILE, AGENT_README_FILE):
+        return JSONResponse(status_code=404, content={"message": "not found"})
+    content = file_content(owner, repo, path, ref)
+    etag = '"%s"' % hashlib.sha1(content).hexdigest()
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(
+        headers={"ETag": etag},
+        content={
+            "name": path.rsplit("/", 1)[-1],
+            "path": path,
+            "sha": hashlib.sha1(content).hexdigest(),
+            "type": "file",
+            "size": len(content),
+            "encoding": "base64",
+            "content": base64.b64encode(content).decode(),
+        },
+    )
+
+
+@app.get("/api/v1/repos/{owner}/{repo}")
+async def get_repo(owner: str, repo: str):
+    return {
+        "id": 1,
+        "name": repo,
+        "full_name": f"{owner}/{repo}",
+        "owner": {"login": owner},
+        "default_branch": "main",
+        "updated_at": "2024-01-01T00:00:00Z",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3900)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,100 @@
+"""
+Signed Gitea push payloads for load tests.
+
+Commit counts follow a geometric distribution, so most pushes carry a
+handful of commits and a few carry hundreds, like real traffic. A share of
+commits touch the files the mirror tracks.
+"""
+
+import hashlib
+import hmac
+import json
+import random
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from src.constants.index import AGENT_CONFIG_FILE, AGENT_README_FILE
+
+SOURCE_FILES = [f"src/module_{i}.py" for i in range(20)] + ["requirements.txt"]
+
+
+def sign(body: bytes, secret: str) -> str:
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def commit_count(rng: random.Random, mean: float, cap: int) -> int:
+    """Geometric commit count with the given mean, at least 1"""
+    p = 1.0 / max(mean, 1.0)
+    count = 1
+    while rng.random() > p and count < cap:
+        count += 1
+    return count
+
+
+def make_commit(rng: random.Random, tracked_ratio: float) -> Dict[str, Any]:
+    files = rng.sample(SOURCE_FILES, rng.randint(1, 4))
+    if rng.random() < tracked_ratio:
+        files.append(rng.choice([AGENT_CONFIG_FILE, AGENT_README_FILE]))
+    sha = "%040x" % rng.getrandbits(160)
+    return {
+        "id": sha,
+        "message": f"Update {', '.join(files)}\n\n" + "x" * rng.randint(0, 400),
+        "url": f"http://gitea.local/commit/{sha}",
+        "author": {"name": "Bench", "email": "bench@bench.local", "username": "bench"},
+        "committer": {"name": "Bench", "email": "bench@bench.local", "username": "bench"},
+        "timestamp": "2024-01-01T00:00:00Z",
+        "added": [],
+        "modified": files,
+        "removed": [],
+    }
+
+
+def push_payload(
+    owner: str,
+    repo: str,
+    commits: int,
+    rng: random.Random,
+    tracked_ratio: float = 0.2,
+) -> Dict[str, Any]:
+    commit_list = [make_commit(rng, tracked_ratio) for _ in range(commits)]
+    before = "%040x" % rng.getrandbits(160)
+    return {
+        "ref": "refs/heads/main",
+        "before": before,
+        "after": commit_list[-1]["id"],
+        "compare_url": f"http://gitea.local/{owner}/{repo}/compare/{before[:10]}",
+        "commits": commit_list,
+        "total_commits": commits,
+        "head_commit": commit_list[-1],
+        "repository": {
+            "id": rng.randint(1, 10**6),
+            "name": repo,
+            "full_name": f"{owner}/{repo}",
+            "owner": {"id": 1, "login": owner, "username": owner},
+            "private": False,
+            "default_branch": "main",
+            "html_url": f"http://gitea.local/{owner}/{repo}",
+        },
+        "pusher": {"id": 1, "login": owner, "username": owner},
+        "sender": {"id": 1, "login": owner, "username": owner},
+    }
+
+
+def generate(
+    repos: List[Tuple[str, str]],
+    count: int,
+    secret: str,
+    mean_commits: float = 3.0,
+    max_commits: int = 2000,
+    fixed_commits: Optional[int] = None,
+    seed: int = 0,
+) -> List[Tuple[str, bytes, str]]:
+    """(delivery id, body, signature) for `count` pushes spread over `repos`"""
+    rng = random.Random(seed)
+    deliveries = []
+    for _ in range(count):
+        owner, repo = rng.choice(repos)
+        commits = fixed_commits or commit_count(rng, mean_commits, max_commits)
+        body = json.dumps(push_payload(owner, repo, commits, rng)).encode("utf-8")
+        deliveries.append((str(uuid.uuid4()), body, sign(body, secret)))
+    return deliveries
@@ -0,0 +1,255 @@
+"""
+Load test for webhook ingestion and mirroring.
+
+Seeds benchmark users and agents, posts signed push deliveries to the API
+with bounded concurrency, then waits for the workers to mirror them. Reports
+ingest throughput and latency, end-to-end mirror latency (request sent to
+delivery processed) and Gitea calls per delivery, as counted by the fake
+Gitea server. Everything runs on one machine:
+
+    python -m bench.fake_gitea --port 3900
+    GITTEA_URL=http://127.0.0.1:3900 uvicorn src.main:app
+    GITTEA_URL=http://127.0.0.1:3900 python -m src.worker
+    python -m bench.webhooks --deliveries 2000 --concurrency 32
+
+`--micro` instead times signature checking and JSON parsing in process, for
+growing commit counts.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import statistics
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+import httpx
+import orjson
+from pytz import UTC
+from src.objects.index import Agent, User, WebhookDelivery
+from src.api.v1.webhook.index import extract_fields, verify_webhook_signature
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.utils.date import parse_timestamp
+from bench import payloads
+
+BENCH_PREFIX = "bench-"
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return (
+        f"p50 {pick(0.5) * 1000:.1f}ms  p95 {pick(0.95) * 1000:.1f}ms  "
+        f"p99 {pick(0.99) * 1000:.1f}ms  max {values[-1] * 1000:.1f}ms"
+    )
+
+
+def seed(users: int, agents_per_user: int) -> List[Tuple[str, str]]:
+    """Create benchmark users and agents, returning their (owner, repo) pairs"""
+    db = get_db_session()
+    repos = []
+    try:
+        for i in range(users):
+            username = f"{BENCH_PREFIX}user{i}"
+            user_id = f"{BENCH_PREFIX}{username}"
+            if not db.query(User).filter(User.userId == user_id).first():
+                db.add(User(userId=user_id, username=username, email=f"{username}@bench.local"))
+            for j in range(agents_per_user):
+                agent_id = f"{BENCH_PREFIX}agent-{i}-{j}"
+                if not db.query(Agent).filter(Agent.agentId == agent_id).first():
+                    db.add(
+                        Agent(
+                            agentId=agent_id,
+                            name=f"agent-{j}",
+                            description="benchmark agent",
+                            adminId=user_id,
+                        )
+                    )
+                repos.append((username, f"agent-{j}"))
+        db.commit()
+        return repos
+    finally:
+        db.close()
+
+
+def cleanup(delivery_ids: List[str]):
+    db = get_db_session()
+    try:
+        for start in range(0, len(delivery_ids), 1000):
+            db.query(WebhookDelivery).filter(
+                WebhookDelivery.deliveryId.in_(delivery_ids[start : start + 1000])
+            ).delete(synchronize_session=False)
+        db.query(Agent).filter(Agent.agentId.like(f"{BENCH_PREFIX}%")).delete(
+            synchronize_session=False
+        )
+        db.query(User).filter(User.userId.like(f"{BENCH_PREFIX}%")).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def processed(delivery_ids: List[str]) -> Dict[str, Tuple[str, str]]:
+    """Delivery id -> (status, processedAt) for finished deliveries"""
+    db = get_db_session()
+    try:
+        rows = []
+        for start in range(0, len(delivery_ids), 1000):
+            rows += (
+                db.query(
+                    WebhookDelivery.deliveryId,
+                    WebhookDelivery.status,
+                    WebhookDelivery.processedAt,
+                )
+                .filter(
+                    WebhookDelivery.deliveryId.in_(delivery_ids[start : start + 1000]),
+                    WebhookDelivery.status.in_(["done", "dead"]),
+                )
+                .all()
+            )
+        return {delivery_id: (status, at) for delivery_id, status, at in rows}
+    finally:
+        db.close()
+
+
+async def drive(args):
+    repos = await asyncio.to_thread(seed, args.users, args.agents)
+    deliveries = payloads.generate(
+        repos,
+        args.deliveries,
+        settings.gittea_webhook_secret,
+        mean_commits=args.mean_commits,
+        fixed_commits=args.commits,
+        seed=args.seed,
+    )
+    size = sum(len(body) for _, body, _ in deliveries) / len(deliveries)
+    print(f"{len(deliveries)} deliveries to {len(repos)} repos, mean body {size / 1024:.1f} KiB")
+
+    async with httpx.AsyncClient(timeout=60.0) as gitea:
+        await gitea.post(f"{args.gitea_url}/_reset")
+
+    sent_at: Dict[str, datetime] = {}
+    ingest: List[float] = []
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.api_url, timeout=60.0, limits=limits) as api:
+
+        async def send(delivery_id: str, body: bytes, signature: str):
+            async with semaphore:
+                started = time.perf_counter()
+                sent_at[delivery_id] = datetime.now(UTC)
+                response = await api.post(
+                    "/api/v1/webhooks/gitea/push",
+                    content=body,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-Gitea-Event": "push",
+                        "X-Gitea-Delivery": delivery_id,
+                        "X-Gitea-Signature": signature,
+                    },
+                )
+                ingest.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(*delivery) for delivery in deliveries))
+        elapsed = time.perf_counter() - started
+
+    print(f"ingest: {len(deliveries) / elapsed:.0f} deliveries/s over {elapsed:.2f}s, statuses {statuses}")
+    print(f"ingest latency: {percentiles(ingest)}")
+
+    delivery_ids = [delivery_id for delivery_id, _, _ in deliveries]
+    deadline = time.monotonic() + args.timeout
+    done: Dict[str, Tuple[str, str]] = {}
+    while time.monotonic() < deadline:
+        done = await asyncio.to_thread(processed, delivery_ids)
+        if len(done) == len(delivery_ids):
+            break
+        await asyncio.sleep(0.5)
+
+    mirror = [
+        (parse_timestamp(at) - sent_at[delivery_id]).total_seconds()
+        for delivery_id, (status, at) in done.items()
+        if status == "done" and at
+    ]
+    dead = sum(1 for status, _ in done.values() if status == "dead")
+    print(
+        f"mirrored: {len(done)}/{len(delivery_ids)} finished, {dead} dead, "
+        f"{len(delivery_ids) - len(done)} unfinished after {args.timeout:.0f}s"
+    )
+    print(f"end-to-end mirror latency: {percentiles(mirror)}")
+
+    async with httpx.AsyncClient(timeout=60.0) as gitea:
+        calls = (await gitea.get(f"{args.gitea_url}/_stats")).json()
+    total = calls.get("total", 0)
+    print(f"gitea calls: {total} ({total / len(delivery_ids):.2f} per delivery), {calls}")
+
+    if not args.keep:
+        await asyncio.to_thread(cleanup, delivery_ids)
+
+
+def micro(args):
+    """Time signature checking and parsing per delivery, in process"""
+    rng = random.Random(args.seed)
+    secret = settings.gittea_webhook_secret
+    for commits in (1, 10, 100, 1000, 5000):
+        body = json.dumps(payloads.push_payload("owner", "repo", commits, rng)).encode()
+        signature = payloads.sign(body, secret)
+        rounds = max(3, min(1000, 2_000_000 // len(body)))
+
+        chunks = [body[i : i + 65536] for i in range(0, len(body), 65536)]
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            mac = hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+            for chunk in chunks:
+                mac.update(chunk)
+            verify_webhook_signature(mac, signature)
+        verify = (time.perf_counter() - started) / rounds
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            json.loads(body.decode("utf-8"))
+        parse_json = (time.perf_counter() - started) / rounds
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            extract_fields("push", orjson.loads(body))
+        parse_orjson = (time.perf_counter() - started) / rounds
+
+        print(
+            f"{commits:>5} commits, {len(body) / 1024:>8.1f} KiB: "
+            f"verify {verify * 1e6:>9.1f}us  json {parse_json * 1e6:>9.1f}us  "
+            f"orjson+extract {parse_orjson * 1e6:>9.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--api-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--gitea-url", default="http://127.0.0.1:3900")
+    parser.add_argument("--deliveries", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--agents", type=int, default=5, help="agents per user")
+    parser.add_argument("--mean-commits", type=float, default=3.0)
+    parser.add_argument("--commits", type=int, default=None, help="fixed commits per push")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for mirroring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep seeded rows and deliveries")
+    parser.add_argument("--micro", action="store_true", help="time verification and parsing only")
+    args = parser.parse_args()
+
+    if args.micro:
+        micro(args)
+    else:
+        asyncio.run(drive(args))
@@ -3,6 +3,8 @@ from src.api.v1.auth.index import router as auth_router
 from src.api.v1.contributor.index import router as contributor_router
 from src.api.v1.webhook.index import router as webhook_router
 from src.api.v1.agent.index import router as agent_router
+from src.api.v1.job.index import router as job_router
+from src.api.v1.search.index import router as search_router
 
 __all__ = [
     "user_router",
@@ -10,4 +12,6 @@ __all__ = [
     "contributor_router",
     "webhook_router",
     "agent_router",
+    "job_router",
+    "search_router",
 ]
@@ -1,18 +1,39 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, File, UploadFile
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 from src.objects.index import (
     Agent,
+    AgentDetailSchema,
+    AgentSchema,
+    AgentTag,
+    CompleteImageUploadRequest,
+    CreateAgentRequest,
+    PresignImageRequest,
+    PublicJobSchema,
     PublicAgentSchema,
+    SimilarAgentSchema,
+    UpdateAgentMetadataRequest,
     User,
     UserSchema,
 )
 from sqlalchemy import or_, desc
 from typing import List
 from src.lib.logger import logger
+from src.lib.s3 import parse_blob_key, s3_client, sha256_checksum
+from src.core.config import settings
+from src.constants.index import AGENT_IMAGE_MAX_BYTES, AGENT_IMAGE_TYPES
 from src.db.pg import get_db
-from src.api.v1.auth.utils import manager
+from src.api.v1.auth.utils import AccessLevel, auth_service, manager
+from src.service.agent import agent_service
+from src.service.blob import blob_service
+from src.service.fork import fork_service
+from src.service.image import image_service
+from src.service.provisioning import provisioning_service
+from src.service.usage import usage_service
+from src.service.similarity import similarity_service
+import asyncio
+import uuid
 
 router = APIRouter()
 
@@ -48,16 +69,56 @@ def get_user_agents(username: str, db: Session = Depends(get_db), user: UserSche
         raise HTTPException(status_code=500, detail="Failed to fetch user agents")
 
 
+@router.get("/id/{agent_id}/similar", response_model=List[SimilarAgentSchema])
+def get_similar_agents(
+    agent_id: str,
+    limit: int = Query(8, ge=1, le=50, description="Number of similar agents"),
+    _: Optional[UserSchema] = Depends(manager.optional.READ),
+    db: Session = Depends(get_db),
+):
+    """Get agents similar to this one, precomputed from tags and descriptions"""
+    try:
+        similar = similarity_service.get_similar(db, agent_id, limit)
+        return [
+            SimilarAgentSchema(
+                **PublicAgentSchema.model_validate(agent).model_dump(), score=score
+            )
+            for agent, score in similar
+        ]
+
+    except Exception as e:
+        logger.error(f"Failed to get similar agents: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch similar agents")
+
+
+@router.get("/id/{agent_id}/provisioning")
+def get_agent_provisioning_status(
+    agent_id: str,
+    user: UserSchema = Depends(manager.required),
+    db: Session = Depends(get_db),
+):
+    """Status of an agent's Gitea repository provisioning"""
+    job = provisioning_service.get_status(db, user.userId, agent_id=agent_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No provisioning job found")
+    return JSONResponse(content=PublicJobSchema.model_validate(job).model_dump())
+
+
 @router.get("/{username}/{agent_name}")
-async def get_agent(username: str, agent_name: str, db: Session = Depends(get_db)):
-    """Get specific agent by username and name"""
+def get_agent(
+    username: str,
+    agent_name: str,
+    viewer: Optional[UserSchema] = Depends(manager.optional),
+    db: Session = Depends(get_db),
+):
+    """Get specific agent by username and name, with its rendered README"""
     try:
 
         user = db.query(User).filter(User.username == username).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user = UserSchema(**user)
+        user = UserSchema.model_validate(user)
         agent = (
             db.query(Agent)
             .filter(Agent.adminId == user.userId, Agent.name == agent_name)
@@ -66,9 +127,18 @@ async def get_agent(username: str, agent_name: str, db: Session = Depends(get_db
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
 
-        agent = PublicAgentSchema(**agent)
-        return JSONResponse(content=agent.model_dump())
+        try:
+            auth_service.check_agent_access(viewer, agent.agentId, AccessLevel.READ, db)
+        except HTTPException:
+            # don't reveal that a private agent exists
+            raise HTTPException(status_code=404, detail="Agent not found")
+
+        # the README is rendered when it is mirrored, never on a read
+        agent = AgentDetailSchema.model_validate(agent)
+        return JSONResponse(content=agent.model_dump(mode="json"))
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to get agent: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch agent")
@@ -144,3 +214,314 @@ def get_featured_agents(
     except Exception as e:
         logger.error(f"Failed to get featured agents: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch featured agents")
+
+
+@router.post("/", status_code=202)
+def create_agent(
+    request: CreateAgentRequest,
+    user: UserSchema = Depends(manager.required),
+    db: Session = Depends(get_db),
+):
+    """Create an agent. Its Gitea repository is provisioned in the background;
+    poll the returned job or /id/{agent_id}/provisioning for progress."""
+    try:
+        name_collision = (
+            db.query(Agent)
+            .filter(Agent.adminId == user.userId, Agent.name == request.name)
+            .first()
+        )
+        if name_collision:
+            raise HTTPException(
+                status_code=409, detail="You already have an agent with this name"
+            )
+
+        agent = Agent(
+            agentId=str(uuid.uuid4()),
+            adminId=user.userId,
+            **request.model_dump(mode="json"),
+        )
+        db.add(agent)
+        db.flush()
+        for column, value in agent_service.readme_values(
+            db, agent.agentId, agent.readmeContent
+        ).items():
+            setattr(agent, column, value)
+        job = provisioning_service.enqueue_agent(db, agent.agentId, user.userId)
+        if agent.visibility == "public":
+            similarity_service.enqueue_refresh(db, agent.agentId)
+        db.commit()
+        db.refresh(agent)
+
+        logger.info(f"Agent created: {agent.agentId}, provisioning job {job.jobId}")
+        return JSONResponse(
+            status_code=202,
+            content={
+                "agent": AgentSchema.model_validate(agent).model_dump(),
+                "jobId": job.jobId,
+            },
+        )
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to create agent: {str(e)}. Database was rolled back!")
+        raise HTTPException(status_code=500, detail="Failed to create agent")
+
+
+@router.post("/{agent_id}/fork", status_code=202)
+def fork_agent(
+    agent_id: str,
+    user: UserSchema = Depends(manager.required.READ),
+    db: Session = Depends(get_db),
+):
+    """Fork an agent. The repository is copied in the background; poll the
+    returned job for progress."""
+    try:
+        source = db.query(Agent).filter(Agent.agentId == agent_id).first()
+        if not source:
+            raise HTTPException(status_code=404, detail="Agent not found")
+
+        fork, job = fork_service.create_fork(db, source, user)
+        return JSONResponse(
+            status_code=202,
+            content={
+                "jobId": job.jobId,
+                "forkId": fork.forkId,
+                "forkedAgentId": fork.forkedAgentId,
+                "status": job.status,
+            },
+        )
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to fork agent: {str(e)}. Database was rolled back!")
+        raise HTTPException(status_code=500, detail="Failed to fork agent")
+
+
+@router.post("/{agent_id}/images", status_code=201)
+async def upload_agent_image(
+    agent_id: str,
+    file: UploadFile = File(...),
+    _: UserSchema = Depends(manager.required.WRITE),
+    db: Session = Depends(get_db),
+):
+    """Upload an agent image. Bytes already stored for any agent are not
+    uploaded again."""
+    try:
+        if file.content_type not in AGENT_IMAGE_TYPES:
+            raise HTTPException(status_code=415, detail="Unsupported image type")
+        if not db.query(Agent.agentId).filter(Agent.agentId == agent_id).scalar():
+            raise HTTPException(status_code=404, detail="Agent not found")
+
+        # the key is the hash of the whole body, known once it is streamed
+        staged_key, digest, size = await blob_service.stage(
+            file, file.content_type, AGENT_IMAGE_MAX_BYTES
+        )
+        try:
+            if not size:
+                raise HTTPException(status_code=400, detail="Empty file")
+            usage_service.check_quota(db, agent_id, size)
+
+            blob, uploaded = await blob_service.store_staged(
+                db, staged_key, digest, size, file.content_type
+            )
+            image = image_service.add_image(db, agent_id, blob)
+            db.commit()
+        finally:
+            await asyncio.to_thread(blob_service.discard, staged_key)
+        return JSONResponse(
+            status_code=201,
+            content={
+                "imageKeyId": image.imageKeyId,
+                "imageKey": image.imageKey,
+                "url": s3_client.url(image.imageKey),
+                "duplicate": not uploaded,
+            },
+        )
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to upload agent image: {str(e)}. Database was rolled back!")
+        raise HTTPException(status_code=500, detail="Failed to upload image")
+
+
+@router.post("/{agent_id}/images/presign")
+def presign_agent_image(
+    agent_id: str,
+    request: PresignImageRequest,
+    _: UserSchema = Depends(manager.required.WRITE),
+    db: Session = Depends(get_db),
+):
+    """Issue a presigned URL to upload an agent image straight to S3. Call
+    /images/complete once the upload has finished. If the bytes are already
+    stored, the image is recorded straight away and no upload is needed."""
+    try:
+        if request.contentType not in AGENT_IMAGE_TYPES:
+            raise HTTPException(status_code=415, detail="Unsupported image type")
+        if request.size > AGENT_IMAGE_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="File too large")
+        if not db.query(Agent.agentId).filter(Agent.agentId == agent_id).scalar():
+            raise HTTPException(status_code=404, detail="Agent not found")
+        usage_service.check_quota(db, agent_id, request.size)
+
+        blob = blob_service.find(db, request.sha256)
+        if blob:
+            image = image_service.add_image(db, agent_id, blob)
+            db.commit()
+            return JSONResponse(
+                content={
+                    "imageKeyId": image.imageKeyId,
+                    "imageKey": image.imageKey,
+                    "url": s3_client.url(image.imageKey),
+                    "duplicate": True,
+                }
+            )
+        db.rollback()
+
+        # S3 checks the body against the hash, so the key cannot lie
+        image_key = blob_service.key(request.sha256, request.contentType)
+        expires_in = settings.s3_presign_expiry
+        if request.method == "put":
+            upload = {
+                "url": s3_client.presign_put(
+                    image_key,
+                    request.contentType,
+                    request.size,
+                    expires_in,
+                    sha256=request.sha256,
+                ),
+                "headers": {
+                    "Content-Type": request.contentType,
+                    "Content-Length": str(request.size),
+                    "x-amz-checksum-sha256": sha256_checksum(request.sha256),
+                },
+            }
+        else:
+            upload = s3_client.presign_post(
+                image_key,
+                request.contentType,
+                AGENT_IMAGE_MAX_BYTES,
+                expires_in,
+                sha256=request.sha256,
+            )
+
+        return JSONResponse(
+            content={
+                "imageKey": image_key,
+                "method": request.method.upper(),
+                "expiresIn": expires_in,
+                "duplicate": False,
+                **upload,
+            }
+        )
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to presign agent image upload: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to presign upload")
+
+
+@router.post("/{agent_id}/images/complete", status_code=201)
+def complete_agent_image_upload(
+    agent_id: str,
+    request: CompleteImageUploadRequest,
+    _: UserSchema = Depends(manager.required.WRITE),
+    db: Session = Depends(get_db),
+):
+    """Record an image uploaded with a presigned URL once it is in S3"""
+    try:
+        digest = parse_blob_key(request.imageKey)
+        content_type = next(
+            (
+                content_type
+                for content_type in AGENT_IMAGE_TYPES
+                if digest
+                and request.imageKey == blob_service.key(digest, content_type)
+            ),
+            None,
+        )
+        if not content_type:
+            raise HTTPException(status_code=400, detail="Invalid image key")
+
+        blob = blob_service.find(db, digest)
+        if not blob:
+            size = s3_client.get_file_size(request.imageKey)
+            if size is None:
+                raise HTTPException(status_code=400, detail="Upload not found")
+            if size > AGENT_IMAGE_MAX_BYTES:
+                s3_client.delete_file(request.imageKey)
+                raise HTTPException(status_code=413, detail="File too large")
+            blob = blob_service.register(db, digest, size, content_type)
+        usage_service.check_quota(db, agent_id, blob.size)
+
+        image = image_service.add_image(db, agent_id, blob)
+        db.commit()
+        return JSONResponse(
+            status_code=201,
+            content={
+                "imageKeyId": image.imageKeyId,
+                "imageKey": image.imageKey,
+                "size": blob.size,
+                "url": s3_client.url(image.imageKey),
+            },
+        )
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to complete image upload: {str(e)}. Database was rolled back!")
+        raise HTTPException(status_code=500, detail="Failed to complete upload")
+
+
+@router.patch("/{agent_id}")
+def update_agent(
+    agent_id: str,
+    request: UpdateAgentMetadataRequest,
+    _: UserSchema = Depends(manager.required.WRITE),
+    db: Session = Depends(get_db),
+):
+    """Update an agent's description, visibility and tags"""
+    try:
+        agent = db.query(Agent).filter(Agent.agentId == agent_id).first()
+        if not agent:
+            raise HTTPException(status_code=404, detail="Agent not found")
+
+        updates = request.model_dump(mode="json", exclude_none=True, exclude={"tags"})
+        if updates:
+            db.query(Agent).filter(Agent.agentId == agent_id).update(updates)
+
+        if request.tags is not None:
+            db.query(AgentTag).filter(AgentTag.agentId == agent_id).delete()
+            tags = dict.fromkeys(tag.strip().lower() for tag in request.tags)
+            for tag in filter(None, tags):
+                db.add(AgentTag(tagId=str(uuid.uuid4()), agentId=agent_id, tag=tag))
+
+        # tags, description and visibility all feed the similarity table
+        if request.tags is not None or updates:
+            similarity_service.enqueue_refresh(db, agent_id)
+
+        db.commit()
+        db.refresh(agent)
+        logger.info(f"Agent updated: {agent_id}")
+        return JSONResponse(content=AgentSchema.model_validate(agent).model_dump())
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to update agent: {str(e)}. Database was rolled back!")
+        raise HTTPException(status_code=500, detail="Failed to update agent")
@@ -14,9 +14,12 @@ from src.objects.index import (
     UpdateUserRequest,
 )
 from src.db.pg import get_db
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from src.utils.user import generate_username
+from src.utils.user import USERNAME_ATTEMPTS, generate_username, is_username_conflict
 from src.lib.stytch import client as stytch_client, StytchError
+from src.service.provisioning import provisioning_service
+from src.service.user import user_service
 
 router = APIRouter()
 
@@ -63,31 +66,40 @@ def authenticate(
 
         # find existing user
         user = db.query(User).filter(User.email == email).first()
-        if user:
-            username = user.username
-        else:
-            username = generate_username(email, db)
 
         if not user:
-            # create a new user
-            create_user_data = CreateUserRequest(
-                username=username,
-                email=email,
-                fullName=f"{first_name} {last_name}".strip(),
-                profilePictureUrl=profile_picture_url,
-            )
-
-            user_to_create = User(
-                userId=userId,
-                username=create_user_data.username,
-                email=create_user_data.email,
-                fullName=create_user_data.fullName,
-                profilePictureUrl=create_user_data.profilePictureUrl,
-                created=create_user_data.created,
-                updated=create_user_data.updated,
-            )
-
-            db.add(user_to_create)
+            # create a new user, with a fresh username if a concurrent
+            # sign-up takes the one we picked
+            for attempt in range(USERNAME_ATTEMPTS):
+                create_user_data = CreateUserRequest(
+                    username=generate_username(email, db),
+                    email=email,
+                    fullName=f"{first_name} {last_name}".strip(),
+                    profilePictureUrl=profile_picture_url,
+                )
+
+                user_to_create = User(
+                    userId=userId,
+                    username=create_user_data.username,
+                    email=create_user_data.email,
+                    fullName=create_user_data.fullName,
+                    profilePictureUrl=create_user_data.profilePictureUrl,
+                    created=create_user_data.created,
+                    updated=create_user_data.updated,
+                )
+
+                try:
+                    with db.begin_nested():
+                        db.add(user_to_create)
+                        db.flush()
+                    break
+                except IntegrityError as e:
+                    if not is_username_conflict(e) or attempt == USERNAME_ATTEMPTS - 1:
+                        raise
+                    logger.info(f"Username {create_user_data.username} was taken, retrying")
+
+            # the gitea account is created in the background
+            provisioning_service.enqueue_user(db, user_to_create.userId)
             db.commit()
             db.refresh(user_to_create)
 
@@ -180,6 +192,9 @@ def register(registerRequest: RegisterRequest, db: Session = Depends(get_db)):
         )
 
         db.add(user_to_create)
+        db.flush()
+        # the gitea account is created in the background
+        provisioning_job = provisioning_service.enqueue_user(db, userId)
         db.commit()
         db.refresh(user_to_create)
 
@@ -192,6 +207,7 @@ def register(registerRequest: RegisterRequest, db: Session = Depends(get_db)):
             "userId": userId,
             "username": registerRequest.username,
             "email": registerRequest.email,
+            "provisioningJobId": provisioning_job.jobId,
         }
 
         return JSONResponse(content=response)
@@ -261,6 +277,7 @@ def complete_onboarding(
             raise HTTPException(status_code=404, detail="User not found")
 
         db.commit()
+        user_service.invalidate_profile(user.userId, user.username)
 
         return {"result": result}
 
@@ -139,13 +139,13 @@ class AuthService:
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
 
-        agent = AgentSchema(**agent)
+        agent = AgentSchema.model_validate(agent)
         # admin has all access levels
         if user and agent.adminId == user.userId:
             return
 
         # for public agents, everyone gets read access
-        if agent.visibility == "Public" and required_level == AccessLevel.READ:
+        if agent.visibility == "public" and required_level == AccessLevel.READ:
             return
 
         if not user:
@@ -162,7 +162,7 @@ class AuthService:
         )
         if not contributor:
             raise HTTPException(status_code=403, detail="Not authorized")
-        contributor = ContributorSchema(**contributor)
+        contributor = ContributorSchema.model_validate(contributor)
         contributor_level = contributor.accessLevel
 
         # check access level hierarchy
@@ -15,9 +15,10 @@ from pydantic import BaseModel
 from datetime import datetime
 from pytz import UTC
 import uuid
-from fastapi import BackgroundTasks
 from sqlalchemy.orm import Session
+from src.core.config import settings
 from src.db.pg import get_db
+from src.service.email import email_service
 
 router = APIRouter()
 
@@ -30,7 +31,6 @@ class InviteContributer(BaseModel):
 def invite_contributer(
     agent_id: str,
     payload: InviteContributer,
-    background_tasks: BackgroundTasks,
     sender: UserSchema = Depends(manager.required.ADMIN),
     db: Session = Depends(get_db),
 ):
@@ -80,6 +80,10 @@ def invite_contributer(
                     status_code=400, detail="User already has access to this project"
                 )
 
+            agent = db.query(Agent).filter(Agent.agentId == agent_id).first()
+            if not agent:
+                raise HTTPException(status_code=404, detail="Agent not found")
+
             contributor_info = Contributor(
                 contributorId=str(uuid.uuid4()),
                 userId=existing_user.userId,
@@ -88,29 +92,21 @@ def invite_contributer(
                 agentId=agent_id,
                 invitedBy=sender.userId,
             )
-
             db.add(contributor_info)
-            db.commit()
-            db.refresh(contributor_info)
-            logger.info(f"Contributor invited: {contributor_info.contributorId}")
 
-            # send email to user
-            agent = db.query(Agent).filter(Agent.agentId == agent_id).first()
-            if not agent:
-                raise HTTPException(status_code=404, detail="Agent not found")
-            agent = AgentSchema(**agent)
-
-            """
-            background_tasks.add_task(
-                email_service.user_invited_to_agent,
+            # sent by the email worker once the invite is committed
+            email_service.user_invited_to_repo(
+                db,
                 recipient_email=invite_email,
                 recipient_name=existing_user.fullName or existing_user.username,
-                agent_name=agent.name,
-                agent_link=f"{settings.next_url}/agent/{agent_id}",
+                repo_name=agent.name,
+                repo_link=f"{settings.next_url}/agent/{agent_id}",
                 sender_name=sender.fullName or sender.username,
             )
-            """
-            return {"result": PublicUserSchema(**existing_user.model_dump())}
+            db.commit()
+            logger.info(f"Contributor invited: {contributor_info.contributorId}")
+
+            return {"result": PublicUserSchema.model_validate(existing_user).model_dump()}
 
         elif not existing_user:
             logger.info(f"User not found in database: {invite_email}...")
@@ -118,7 +114,8 @@ def invite_contributer(
             # TODO: send email to user to create an account and invite them to the project
 
     except Exception as e:
-        logger.error(f"Error inviting contributor: {e}")
+        db.rollback()
+        logger.error(f"Error inviting contributor: {e}. Database was rolled back!")
         raise HTTPException(status_code=500, detail=str(e))
 
 
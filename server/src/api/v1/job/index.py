@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from src.objects.index import PublicJobSchema, UserSchema
+from src.service.job import job_service
+from src.lib.logger import logger
+from src.db.pg import get_db
+from src.api.v1.auth.utils import manager
+
+router = APIRouter()
+
+
+@router.get("/{job_id}")
+def get_job_status(
+    job_id: str,
+    user: UserSchema = Depends(manager.required),
+    db: Session = Depends(get_db),
+):
+    """Poll the status of a background job started by the current user"""
+    job = job_service.get_job(db, job_id)
+    if not job or job.userId != user.userId:
+        logger.error(f"Job not found: {job_id}")
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return JSONResponse(content=PublicJobSchema.model_validate(job).model_dump())
@@ -0,0 +1,103 @@
+import json
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+from sqlalchemy import or_, desc, func
+from src.objects.index import Agent, User
+from src.core.config import settings
+from src.lib.cache import TTLCache
+from src.lib.logger import logger
+from src.db.pg import get_db
+
+router = APIRouter()
+
+# popular prefixes are requested on every keystroke by many clients
+suggest_cache = TTLCache(
+    maxsize=settings.suggest_cache_size, ttl=settings.suggest_cache_ttl
+)
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input only matches literally"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def suggest_agents(db: Session, q: str, limit: int) -> list:
+    prefix = f"{escape_like(q)}%"
+    is_prefix = Agent.name.ilike(prefix, escape="\\")
+
+    # both predicates are served by idx_agent_name_trgm
+    rows = (
+        db.query(Agent.agentId, Agent.name, User.username)
+        .join(User, User.userId == Agent.adminId)
+        .filter(Agent.visibility == "public")
+        .filter(or_(is_prefix, Agent.name.op("%")(q)))
+        .order_by(desc(is_prefix), desc(func.similarity(Agent.name, q)), Agent.name)
+        .limit(limit)
+        .all()
+    )
+    return [
+        {"agentId": agent_id, "name": name, "owner": owner}
+        for agent_id, name, owner in rows
+    ]
+
+
+def suggest_users(db: Session, q: str, limit: int) -> list:
+    prefix = f"{escape_like(q)}%"
+    is_prefix = or_(
+        User.username.ilike(prefix, escape="\\"),
+        User.fullName.ilike(prefix, escape="\\"),
+    )
+    score = func.greatest(
+        func.similarity(User.username, q),
+        func.coalesce(func.similarity(User.fullName, q), 0),
+    )
+
+    # served by idx_user_username_trgm and idx_user_fullname_trgm
+    rows = (
+        db.query(User.userId, User.username, User.fullName, User.profilePictureUrl)
+        .filter(or_(is_prefix, User.username.op("%")(q), User.fullName.op("%")(q)))
+        .order_by(desc(is_prefix), desc(score), User.username)
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "userId": user_id,
+            "username": username,
+            "fullName": full_name,
+            "profilePictureUrl": picture,
+        }
+        for user_id, username, full_name, picture in rows
+    ]
+
+
+@router.get("/suggest")
+def suggest(
+    q: str = Query(..., min_length=1, max_length=100, description="Search prefix"),
+    limit: int = Query(8, ge=1, le=20, description="Maximum matches per kind"),
+    db: Session = Depends(get_db),
+):
+    """Autocomplete agent names and users by prefix or fuzzy match"""
+    q = q.strip().lower()
+    if not q:
+        return Response(content=b'{"agents":[],"users":[]}', media_type="application/json")
+
+    cache_key = (q, limit)
+    cached = suggest_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    try:
+        content = json.dumps(
+            {
+                "agents": suggest_agents(db, q, limit),
+                "users": suggest_users(db, q, limit),
+            }
+        ).encode("utf-8")
+        suggest_cache.set(cache_key, content)
+        return Response(content=content, media_type="application/json")
+
+    except Exception as e:
+        logger.error(f"Failed to suggest for '{q}': {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch suggestions")
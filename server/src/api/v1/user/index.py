@@ -1,14 +1,19 @@
-from src.objects.schemas.user import PublicUserSchema
 from src.service.index import *
 from fastapi import APIRouter, Depends
 from fastapi.exceptions import HTTPException
 from src.api.v1.auth.utils import manager
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from src.objects.index import (
+    Agent,
+    PublicJobSchema,
     User,
     UserSchema,
     UpdateUserRequest,
 )
+from src.service.provisioning import provisioning_service
+from src.service.blob import blob_service
+from src.service.teardown import teardown_service
+from src.service.usage import usage_service
 from src.db.pg import get_db
 from sqlalchemy.orm import Session
 from src.lib.logger import logger
@@ -19,14 +24,12 @@ router = APIRouter()
 @router.get("/{userId}")
 def get_user_by_id(userId: str, db: Session = Depends(get_db)):
     try:
-        user = db.query(User).filter(User.userId == userId).first()
-        if not user:
+        content = user_service.get_profile(db, ("userId", userId))
+        if content is None:
             logger.error(f"User not found: {userId}")
             raise HTTPException(status_code=404, detail="User not found")
 
-        user = PublicUserSchema.model_validate(user)
-        logger.info(f"User found by id: {user}")
-        return JSONResponse(content=user.model_dump())
+        return Response(content=content, media_type="application/json")
 
     except Exception as e:
         logger.error(f"Error getting user: {str(e)}")
@@ -36,14 +39,12 @@ def get_user_by_id(userId: str, db: Session = Depends(get_db)):
 @router.get("/username/{username}")
 def get_user_by_username(username: str, db: Session = Depends(get_db)):
     try:
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
+        content = user_service.get_profile(db, ("username", username))
+        if content is None:
             logger.error(f"User not found: {username}")
             raise HTTPException(status_code=404, detail="User not found")
 
-        user = PublicUserSchema.model_validate(user)
-        logger.info(f"User found by username: {user}")
-        return JSONResponse(content=user.model_dump())
+        return Response(content=content, media_type="application/json")
 
     except Exception as e:
         logger.error(f"Error getting user: {str(e)}")
@@ -70,6 +71,7 @@ def update_user(
             .update(request.model_dump(exclude_none=True))
         )
         db.commit()
+        user_service.invalidate_profile(userId, user.username)
         logger.info(f"Users updated:{result}")
 
         return JSONResponse(content=result)
@@ -91,8 +93,18 @@ def delete_user(
         raise HTTPException(status_code=403, detail="Unauthorized")
     try:
 
+        agent_ids = [
+            agent_id
+            for (agent_id,) in db.query(Agent.agentId).filter(Agent.adminId == userId)
+        ]
+        blob_service.release_agents(db, agent_ids)
         db.query(User).filter(User.userId == userId).delete()
+        # their agents' assets are deleted from S3 in the background
+        teardown_service.enqueue(
+            db, [teardown_service.agent_prefix(agent_id) for agent_id in agent_ids]
+        )
         db.commit()
+        user_service.invalidate_profile(userId, user.username)
         logger.info(f"User deleted: {userId}")
         return JSONResponse(content={"result": userId})
 
@@ -118,6 +130,29 @@ def get_api_key(user: UserSchema = Depends(manager.required)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.get("/me/provisioning")
+def get_provisioning_status(
+    user: UserSchema = Depends(manager.required), db: Session = Depends(get_db)
+):
+    """Status of the current user's Gitea account provisioning"""
+    job = provisioning_service.get_status(db, user.userId)
+    if not job:
+        raise HTTPException(status_code=404, detail="No provisioning job found")
+    return JSONResponse(content=PublicJobSchema.model_validate(job).model_dump())
+
+
+@router.get("/me/storage")
+def get_storage_usage(
+    user: UserSchema = Depends(manager.required), db: Session = Depends(get_db)
+):
+    """Bytes stored by the current user, in total and per agent"""
+    try:
+        return JSONResponse(content=usage_service.get_usage(db, user.userId))
+    except Exception as e:
+        logger.error(f"Error getting storage usage: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get storage usage")
+
+
 @router.post("/me/api-key/regenerate")
 def regenerate_api_key(
     user: UserSchema = Depends(manager.required), db: Session = Depends(get_db)
@@ -1,144 +1,164 @@
-from fastapi import APIRouter, HTTPException, Request, BackgroundTasks
-from typing import Dict, Any
-import json
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from typing import Any, Dict
+import asyncio
+import orjson
 import hmac
 import hashlib
 from src.core.config import settings
 from src.lib.logger import logger
-from src.service.agent import AgentService
-from src.lib.gittea import gitea_client
-from src.db.pg import get_db
+from src.service.webhook import webhook_service
 
 router = APIRouter()
 
 
-def verify_webhook_signature(payload: bytes, signature: str, secret: str) -> bool:
-    """Verify Gitea webhook signature"""
+def verify_webhook_signature(mac: "hmac.HMAC", signature: str) -> bool:
+    """Verify a Gitea webhook signature against the HMAC of the streamed body"""
     if not signature.startswith("sha256="):
         return False
 
-    expected_signature = hmac.new(
-        secret.encode("utf-8"), payload, hashlib.sha256
-    ).hexdigest()
-
     received_signature = signature[7:]  # Remove 'sha256=' prefix
-    return hmac.compare_digest(expected_signature, received_signature)
+    return hmac.compare_digest(mac.hexdigest(), received_signature)
+
+
+async def read_signed_body(request: Request, signature: str) -> bytes:
+    """
+    Read the body while feeding it to the HMAC chunk by chunk. Oversized
+    payloads are rejected from Content-Length before anything is read, or as
+    soon as a chunked body passes the limit.
+    """
+    max_bytes = settings.webhook_max_payload_bytes
+    content_length = request.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail="Payload too large")
+
+    mac = hmac.new(
+        settings.gittea_webhook_secret.encode("utf-8"), digestmod=hashlib.sha256
+    )
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail="Payload too large")
+        mac.update(chunk)
+        chunks.append(chunk)
+
+    if not verify_webhook_signature(mac, signature):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    return b"".join(chunks)
+
+
+def _repository_fields(repository: Dict[str, Any]) -> Dict[str, Any]:
+    owner = repository.get("owner") or {}
+    return {
+        "name": repository.get("name"),
+        "full_name": repository.get("full_name"),
+        "default_branch": repository.get("default_branch"),
+        "owner": {"login": owner.get("login")},
+    }
+
+
+def extract_fields(event: str, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only what the mirror reads, so the inbox does not store whole pushes"""
+    fields: Dict[str, Any] = {
+        "repository": _repository_fields(webhook_data.get("repository") or {})
+    }
+    if event == "push":
+        commits = webhook_data.get("commits") or []
+        fields.update(
+            {
+                "ref": webhook_data.get("ref"),
+                "before": webhook_data.get("before"),
+                "after": webhook_data.get("after"),
+                "total_commits": webhook_data.get("total_commits", len(commits)),
+                "commits": [
+                    {
+                        "id": commit.get("id"),
+                        "added": commit.get("added") or [],
+                        "modified": commit.get("modified") or [],
+                        "removed": commit.get("removed") or [],
+                    }
+                    for commit in commits
+                ],
+            }
+        )
+    else:
+        fields["action"] = webhook_data.get("action")
+    return fields
 
 
-@router.post("/gitea/push")
-async def handle_gitea_push(request: Request, background_tasks: BackgroundTasks):
-    """Handle Gitea push webhooks"""
+async def accept_delivery(request: Request, event: str) -> JSONResponse:
+    """Verify a delivery, store it in the inbox and acknowledge it"""
+    signature = request.headers.get("X-Gitea-Signature")
+    if not signature:
+        raise HTTPException(status_code=400, detail="Missing signature")
+
+    payload = await read_signed_body(request, signature)
+
+    # Parse webhook payload straight from bytes
     try:
-        # Get raw payload and signature
-        payload = await request.body()
-        signature = request.headers.get("X-Gitea-Signature")
-
-        if not signature:
-            raise HTTPException(status_code=400, detail="Missing signature")
-
-        # Verify webhook signature
-        if not verify_webhook_signature(
-            payload, signature, settings.gittea_webhook_secret
-        ):
-            raise HTTPException(status_code=403, detail="Invalid signature")
-
-        # Parse webhook payload
-        webhook_data = json.loads(payload.decode("utf-8"))
-
-        # Extract repository information
-        repo_info = webhook_data.get("repository", {})
-        repo_owner = repo_info.get("owner", {}).get("login")
-        repo_name = repo_info.get("name")
-
-        if not repo_owner or not repo_name:
-            raise HTTPException(
-                status_code=400, detail="Missing repository information"
-            )
-
-        # Process push event in background
-        background_tasks.add_task(
-            process_push_event, repo_owner, repo_name, webhook_data
+        webhook_data = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    if not isinstance(webhook_data, dict):
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    webhook_data = extract_fields(event, webhook_data)
+
+    # redeliveries reuse the id; fall back to the payload digest without one
+    delivery_id = (
+        request.headers.get("X-Gitea-Delivery") or hashlib.sha256(payload).hexdigest()
+    )
+
+    # pushes to the same repository are coalesced by the workers
+    repo_info = webhook_data.get("repository") or {}
+    repo_owner = (repo_info.get("owner") or {}).get("login")
+    repo_name = repo_info.get("name")
+    repo_key = f"{repo_owner}/{repo_name}".lower() if repo_owner and repo_name else None
+
+    created = await asyncio.to_thread(
+        webhook_service.record_delivery,
+        delivery_id,
+        event,
+        webhook_data,
+        repo_key,
+        webhook_data.get("ref"),
+    )
+    if not created:
+        logger.info(f"Ignoring redelivered {event} webhook {delivery_id}")
+        return JSONResponse(
+            status_code=200, content={"status": "duplicate", "deliveryId": delivery_id}
         )
 
-        logger.info(f"Received push webhook for {repo_owner}/{repo_name}")
-        return {"status": "success", "message": "Webhook processed"}
+    logger.info(f"Queued {event} webhook {delivery_id}")
+    return JSONResponse(
+        status_code=202, content={"status": "accepted", "deliveryId": delivery_id}
+    )
+
 
+@router.post("/gitea/push")
+async def handle_gitea_push(request: Request):
+    """Handle Gitea push webhooks"""
+    try:
+        return await accept_delivery(request, "push")
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Webhook processing failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Webhook processing failed")
 
 
 @router.post("/gitea/repository")
-async def handle_gitea_repository(request: Request, background_tasks: BackgroundTasks):
+async def handle_gitea_repository(request: Request):
     """Handle Gitea repository events (create/delete)"""
     try:
-        # Get raw payload and signature
-        payload = await request.body()
-        signature = request.headers.get("X-Gitea-Signature")
-
-        if not signature:
-            raise HTTPException(status_code=400, detail="Missing signature")
-
-        # Verify webhook signature
-        if not verify_webhook_signature(
-            payload, signature, settings.gittea_webhook_secret
-        ):
-            raise HTTPException(status_code=403, detail="Invalid signature")
-
-        # Parse webhook payload
-        webhook_data = json.loads(payload.decode("utf-8"))
-
-        action = webhook_data.get("action")
-        repo_info = webhook_data.get("repository", {})
-
-        logger.info(f"Received repository webhook: {action}")
-
-        # Process repository event in background
-        background_tasks.add_task(process_repository_event, action, repo_info)
-
-        return {"status": "success", "message": "Repository webhook processed"}
+        return await accept_delivery(request, "repository")
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Repository webhook processing failed: {str(e)}")
         raise HTTPException(
             status_code=500, detail="Repository webhook processing failed"
         )
-
-
-async def process_push_event(
-    repo_owner: str, repo_name: str, webhook_data: Dict[str, Any]
-):
-    """Process push event in background"""
-    try:
-        agent_service = AgentService()
-
-        # Update agent mirror and metadata
-        await agent_service.update_agent_from_push(repo_owner, repo_name, webhook_data)
-
-        logger.info(f"Successfully processed push event for {repo_owner}/{repo_name}")
-
-    except Exception as e:
-        logger.error(
-            f"Failed to process push event for {repo_owner}/{repo_name}: {str(e)}"
-        )
-
-
-async def process_repository_event(action: str, repo_info: Dict[str, Any]):
-    """Process repository event in background"""
-    try:
-        if action == "created":
-            # Handle new repository creation
-            logger.info(f"New repository created: {repo_info.get('full_name')}")
-
-        elif action == "deleted":
-            # Handle repository deletion
-            repo_name = repo_info.get("name")
-            repo_owner = repo_info.get("owner", {}).get("login")
-
-            if repo_name and repo_owner:
-                agent_service = AgentService()
-                await agent_service.delete_agent_mirror(repo_owner, repo_name)
-                logger.info(f"Repository deleted: {repo_owner}/{repo_name}")
-
-    except Exception as e:
-        logger.error(f"Failed to process repository event: {str(e)}")
@@ -0,0 +1,12 @@
+# files mirrored from an agent's Gitea repository into the agents table
+AGENT_CONFIG_FILE = "config.yaml"
+AGENT_README_FILE = "README.md"
+
+# agent images
+AGENT_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+AGENT_IMAGE_TYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
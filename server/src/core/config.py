@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from src.lib.logger import logger
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv(f".env")
@@ -13,14 +14,86 @@ class Settings(BaseSettings):
     stytch_secret: str
     stytch_project_domain: str
     gmail_app_password: str
+    smtp_pool_size: int = 4
+    smtp_max_messages: int = 100  # per connection, then it is replaced
+    smtp_max_lifetime: float = 300.0
     next_url: str
+    api_url: str = "http://localhost:8000"  # public base url, for gitea webhooks
     s3_bucket_name: str
+    s3_endpoint_url: Optional[str] = None  # local S3-compatible server, e.g. moto
+    s3_part_size: int = 8 * 1024 * 1024
+    s3_upload_concurrency: int = 4
+    s3_presign_expiry: int = 15 * 60
+    s3_teardown_concurrency: int = 8
+    s3_cache_max_bytes: int = 1024 * 1024 * 1024  # downloads, under cache_dir
+    blob_gc_interval: float = 6 * 60 * 60
+    blob_gc_grace: int = 24 * 60 * 60  # how long an unreferenced blob is kept
+    storage_quota_bytes: Optional[int] = None  # per user, unlimited if unset
+    storage_reconcile_interval: float = 24 * 60 * 60
     cloudfront_domain: str
     gittea_url: str
     gittea_admin_token: str
     gittea_webhook_secret: str
+    # Fernet key (Fernet.generate_key()) encrypting users' stored gitea tokens;
+    # provisioning cannot store tokens without it
+    gittea_token_key: Optional[str] = None
+    gittea_timeout: float = 10.0
+    gittea_connect_timeout: float = 5.0
+    gittea_max_connections: int = 20
+    gittea_max_retries: int = 3
+    gittea_cache_memory_bytes: int = 32 * 1024 * 1024  # per process
+    # on disk, per process: processes sharing cache_dir may each fill this much
+    gittea_cache_max_bytes: int = 256 * 1024 * 1024
+    gittea_cache_max_entry_bytes: int = 1024 * 1024
     postgres_database: str
     postgres_connection_url: str
+    cache_dir: str = ".cache"
+
+    # background workers, run by `python -m src.worker` unless enabled here
+    run_workers: bool = False
+    job_poll_interval: float = 1.0
+    job_lease_seconds: int = 900
+    fork_worker_concurrency: int = 4
+    provisioning_worker_concurrency: int = 4
+    image_worker_concurrency: int = 2
+    image_worker_processes: int = 2
+
+    # webhook inbox
+    webhook_worker_concurrency: int = 4
+    webhook_max_attempts: int = 8
+    webhook_retention_days: int = 7
+    webhook_coalesce_window: float = 2.0  # seconds a push waits for followers
+    webhook_max_payload_bytes: int = 10 * 1024 * 1024
+
+    # email outbox
+    email_worker_concurrency: int = 2
+    email_batch_size: int = 20  # messages sent over one connection per claim
+    email_rate_per_second: float = 2.0  # provider limit, across all replicas
+    email_worker_replicas: int = 1  # processes running email workers, sharing that limit
+    email_max_attempts: int = 8
+    email_retention_days: int = 30
+    email_campaign_chunk_size: int = 1000  # users per outbox insert and checkpoint
+
+    # search suggestions
+    suggest_cache_ttl: float = 30.0
+    suggest_cache_size: int = 10000
+
+    # public profiles, served stale for a while as they are refreshed. Edits
+    # only invalidate the process that made them, so other processes may
+    # serve a changed profile for up to ttl + stale seconds.
+    profile_cache_size: int = 10000
+    profile_cache_ttl: float = 30.0
+    profile_cache_stale: float = 30.0
+
+    # gitea reconciliation
+    reconcile_interval: float = 6 * 60 * 60
+    reconcile_concurrency: int = 8
+    reconcile_page_size: int = 50
+
+    # similar agents
+    similar_agents_top_k: int = 20
+    similar_agents_tag_weight: float = 0.7
+    similar_agents_rebuild_interval: float = 6 * 60 * 60
 
     class Config:
         env_file = f".env"
@@ -6,6 +6,10 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from typing import List, Callable
 from src.db.pg import engine, SessionLocal
+from src.core.config import settings
+from src.service.worker import create_worker_pools
+from src.lib.gittea import async_gitea_client
+from src.service.email import email_service
 from sqlalchemy import text
 
 
@@ -103,6 +107,7 @@ async def lifespan(app: FastAPI):
     """
     graceful_exit = GracefulExit()
     app.state.graceful_exit = graceful_exit
+    worker_pools = []
 
     def cleanup_databases():
         try:
@@ -123,6 +128,13 @@ async def lifespan(app: FastAPI):
             raise Exception("Failed to connect to PostgreSQL")
 
         logging.info("SUCCESS: CONNECTED TO ALL DATABASES")
+
+        if settings.run_workers:
+            worker_pools = create_worker_pools()
+            for pool in worker_pools:
+                for task in pool.start():
+                    graceful_exit.register_background_task(task)
+
         yield
 
     except Exception as e:
@@ -131,4 +143,8 @@ async def lifespan(app: FastAPI):
         raise e
 
     finally:
+        await asyncio.gather(*(pool.stop() for pool in worker_pools))
+        await email_service.async_pool.close()
+        email_service.pool.close()
+        await async_gitea_client.aclose()
         cleanup_databases()
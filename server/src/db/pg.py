@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
@@ -18,6 +18,43 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+@event.listens_for(Base.metadata, "before_create")
+def create_extensions(target, connection, **kw):
+    """Extensions the models' indexes depend on"""
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+# columns and indexes added to tables after they were first created.
+# create_all only creates missing tables, so these run on every start and
+# must be idempotent.
+SCHEMA_UPGRADES = [
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS "giteaUserId" INTEGER',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS "giteaToken" VARCHAR(500)',
+    'ALTER TABLE agents ADD COLUMN IF NOT EXISTS "readmeHtml" VARCHAR',
+    'ALTER TABLE agents ADD COLUMN IF NOT EXISTS "readmeHash" VARCHAR(64)',
+    'ALTER TABLE image_keys ADD COLUMN IF NOT EXISTS "variants" JSONB',
+    'ALTER TABLE image_keys ADD COLUMN IF NOT EXISTS "derivedAt" VARCHAR',
+    'ALTER TABLE image_keys ADD COLUMN IF NOT EXISTS "blobHash" VARCHAR(64) '
+    'REFERENCES blobs ("blobHash")',
+    'CREATE INDEX IF NOT EXISTS idx_image_key_blob ON image_keys ("blobHash")',
+    'ALTER TABLE agents ADD COLUMN IF NOT EXISTS "storageBytes" BIGINT NOT NULL DEFAULT 0',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS "storageBytes" BIGINT NOT NULL DEFAULT 0',
+    "CREATE INDEX IF NOT EXISTS idx_agent_name_trgm ON agents USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_user_username_trgm ON users USING gin (username gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS idx_user_fullname_trgm ON users USING gin ("fullName" gin_trgm_ops)',
+    "CREATE INDEX IF NOT EXISTS idx_user_username_prefix ON users (username text_pattern_ops)",
+]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def upgrade_schema(target, connection, **kw):
+    """Bring tables created by an older version up to the models"""
+    # the API and the workers may start at once
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_upgrade'))"))
+    for statement in SCHEMA_UPGRADES:
+        connection.execute(text(statement))
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after `ttl` seconds.
+    Once `maxsize` entries are stored, the least recently used one is evicted.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    Thread-safe LRU cache of byte values stored as files under `directory`.
+
+    Files are named by the SHA-256 of their key and written atomically, so a
+    crash never leaves a torn entry behind. Once the files add up to more than
+    `max_bytes`, the least recently used ones are deleted, though never the
+    newest one. Recency survives restarts through file modification times.
+    Deleting a file does not disturb readers that already opened it. Only
+    files this instance wrote or found when it loaded count towards
+    `max_bytes`, so the bound is per process when several share `directory`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # path -> size
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # caller holds the lock
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.startswith("."):
+                    # temporary file of an interrupted write
+                    os.unlink(path)
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._total += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._index) > 1:
+            path, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the cached file for `key`, marked as recently used, if any"""
+        path = self.path(key)
+        with self._lock:
+            self._load()
+            if path not in self._index:
+                return None
+            self._index.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._index.pop(path, 0)
+            return None
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted between lookup and read
+            return None
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        self.write(key, lambda f: f.write(value))
+
+    def write(self, key: str, writer: Callable[[BinaryIO], Any]) -> str:
+        """Store whatever `writer` writes to the file it is handed, so large
+        values never have to be held in memory. Returns the cached path."""
+        path = self.path(key)
+        with self._lock:
+            self._load()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._total += size - self._index.pop(path, 0)
+            self._index[path] = size
+            self._evict()
+        return path
+
+    def delete(self, key: str):
+        path = self.path(key)
+        with self._lock:
+            self._load()
+            self._total -= self._index.pop(path, 0)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function, callers arriving while it runs wait and share its result or
+    exception instead of running it again.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
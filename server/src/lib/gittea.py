@@ -1,15 +1,90 @@
+import asyncio
+import os
+import random
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
 import requests
 import secrets
 import json
-from typing import Optional, Dict, Any, List
+import threading
+from collections import OrderedDict
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from src.core.config import settings
+from src.lib.cache import DiskCache
 from src.lib.logger import logger
 
+# methods that are safe to send again after a timeout or a 5xx
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+COMMIT_SHA_PATTERN = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+
+_call_counter: ContextVar[Optional[List[int]]] = ContextVar(
+    "gitea_call_counter", default=None
+)
+
+
+@contextmanager
+def count_gitea_calls():
+    """Count the async Gitea requests sent by this task and the tasks it spawns"""
+    counter = [0]
+    token = _call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _call_counter.reset(token)
+
+
+def _user_data(username: str, email: str, full_name: str) -> Dict[str, Any]:
+    return {
+        "username": username,
+        "email": email,
+        "password": secrets.token_urlsafe(32),
+        "full_name": full_name,
+        "must_change_password": False,
+        "send_notify": False,
+    }
+
+
+def _repo_data(repo_name: str, description: str, private: bool) -> Dict[str, Any]:
+    return {
+        "name": repo_name,
+        "description": description,
+        "private": private,
+        "auto_init": True,
+        "readme": "Default",
+        "license": "MIT",
+    }
+
+
+def _token_data(token_name: str) -> Dict[str, Any]:
+    return {
+        "name": token_name,
+        "scopes": ["write:repository", "read:user"],
+    }
+
+
+def _webhook_data(webhook_url: str) -> Dict[str, Any]:
+    return {
+        "type": "gitea",
+        "config": {
+            "url": webhook_url,
+            "content_type": "json",
+            "secret": settings.gittea_webhook_secret,
+        },
+        "events": ["push", "repository"],
+        "active": True,
+    }
+
 
 class GitteaClient:
     def __init__(self):
         self.base_url = settings.gittea_url
         self.admin_token = settings.gittea_admin_token
+        self.timeout = (settings.gittea_connect_timeout, settings.gittea_timeout)
         self.session = requests.Session()
         self.session.headers.update(
             {
@@ -17,10 +92,23 @@ class GitteaClient:
                 "Content-Type": "application/json",
             }
         )
+        retry = Retry(
+            total=settings.gittea_max_retries,
+            backoff_factor=0.5,
+            status_forcelist=sorted(RETRY_STATUSES),
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry, pool_maxsize=settings.gittea_max_connections
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
         """Make authenticated request to Gitea API"""
         url = f"{self.base_url}/api/v1{endpoint}"
+        kwargs.setdefault("timeout", self.timeout)
 
         try:
             response = self.session.request(method, url, **kwargs)
@@ -34,67 +122,38 @@ class GitteaClient:
         self, username: str, email: str, full_name: str = ""
     ) -> Dict[str, Any]:
         """Create Gitea user account"""
-        password = secrets.token_urlsafe(32)
-
-        user_data = {
-            "username": username,
-            "email": email,
-            "password": password,
-            "full_name": full_name,
-            "must_change_password": False,
-            "send_notify": False,
-        }
-
         logger.info(f"Creating Gitea user: {username}")
-        return self._make_request("POST", "/admin/users", json=user_data)
+        return self._make_request(
+            "POST", "/admin/users", json=_user_data(username, email, full_name)
+        )
 
     def create_repo(
         self, owner: str, repo_name: str, description: str = "", private: bool = False
     ) -> Dict[str, Any]:
         """Create repository for agent"""
-        repo_data = {
-            "name": repo_name,
-            "description": description,
-            "private": private,
-            "auto_init": True,
-            "readme": "Default",
-            "license": "MIT",
-        }
-
         logger.info(f"Creating repository: {owner}/{repo_name}")
 
-        # use user's token if available, otherwise admin creates it
-        endpoint = f"/user/repos"
-        return self._make_request("POST", endpoint, json=repo_data)
+        # /user/repos would create it under the admin account
+        return self._make_request(
+            "POST",
+            f"/admin/users/{owner}/repos",
+            json=_repo_data(repo_name, description, private),
+        )
 
     def create_access_token(
         self, username: str, token_name: str = "modaic-api"
     ) -> Dict[str, Any]:
         """Generate API token for user"""
-        token_data = {
-            "name": f"{token_name}-{secrets.token_hex(8)}",
-            "scopes": ["write:repository", "read:user"],
-        }
-
         logger.info(f"Creating access token for user: {username}")
-        return self._make_request("POST", f"/users/{username}/tokens", json=token_data)
+        return self._make_request(
+            "POST", f"/users/{username}/tokens", json=_token_data(token_name)
+        )
 
     def setup_webhook(self, owner: str, repo: str, webhook_url: str) -> Dict[str, Any]:
         """Set up push webhooks"""
-        webhook_data = {
-            "type": "gitea",
-            "config": {
-                "url": webhook_url,
-                "content_type": "json",
-                "secret": settings.gittea_webhook_secret,
-            },
-            "events": ["push", "repository"],
-            "active": True,
-        }
-
         logger.info(f"Setting up webhook for {owner}/{repo}")
         return self._make_request(
-            "POST", f"/repos/{owner}/{repo}/hooks", json=webhook_data
+            "POST", f"/repos/{owner}/{repo}/hooks", json=_webhook_data(webhook_url)
         )
 
     def get_repo_contents(
@@ -109,10 +168,32 @@ class GitteaClient:
             logger.warning(f"File not found: {owner}/{repo}/{filepath}")
             return None
 
-    def get_user_repos(self, username: str) -> List[Dict[str, Any]]:
-        """Get user's repositories"""
+    def fork_repo(
+        self, owner: str, repo: str, new_owner: str, new_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Fork a repository into another user's namespace"""
+        fork_data = {"name": new_name or repo}
+
+        logger.info(f"Forking repository {owner}/{repo} to {new_owner}")
+        # the admin token acts on behalf of the new owner
+        return self._make_request(
+            "POST",
+            f"/repos/{owner}/{repo}/forks",
+            json=fork_data,
+            headers={"Sudo": new_owner},
+            timeout=(settings.gittea_connect_timeout, max(settings.gittea_timeout, 300.0)),
+        )
+
+    def get_user_repos(
+        self, username: str, page: int = 1, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        """Get one page of a user's repositories"""
         try:
-            return self._make_request("GET", f"/users/{username}/repos")
+            return self._make_request(
+                "GET",
+                f"/users/{username}/repos",
+                params={"page": page, "limit": limit},
+            )
         except requests.exceptions.RequestException:
             return []
 
@@ -133,4 +214,358 @@ class GitteaClient:
             return None
 
 
+class ResponseCache:
+    """
+    Two-tier cache of Gitea GET responses: an in-memory LRU in front of a
+    size-bounded LRU on disk. Entries are `{"etag": ..., "body": ...}`, where
+    a None body records a 404. Responses larger than `max_entry_bytes` are
+    not cached.
+
+    Both tiers are bounded by the JSON size of their entries. The memory
+    tier is per process. So is the disk bound: processes sharing a cache
+    directory each evict only what they know of, and together may hold up
+    to `max_bytes` each.
+    """
+
+    def __init__(
+        self, directory: str, memory_bytes: int, max_bytes: int, max_entry_bytes: int
+    ):
+        # key -> (entry, JSON size)
+        self.memory: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self.memory_bytes = memory_bytes
+        self._memory_total = 0
+        self._lock = threading.Lock()
+        self.disk = DiskCache(directory, max_bytes)
+        self.max_entry_bytes = max_entry_bytes
+
+    def _remember(self, key: str, entry: Dict[str, Any], size: int):
+        with self._lock:
+            self._forget(key)
+            self.memory[key] = (entry, size)
+            self._memory_total += size
+            while self._memory_total > self.memory_bytes and self.memory:
+                _, (_, evicted) = self.memory.popitem(last=False)
+                self._memory_total -= evicted
+
+    def _forget(self, key: str):
+        # caller holds the lock
+        cached = self.memory.pop(key, None)
+        if cached is not None:
+            self._memory_total -= cached[1]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cached = self.memory.get(key)
+            if cached is not None:
+                self.memory.move_to_end(key)
+                return cached[0]
+
+        raw = self.disk.get(key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        self._remember(key, entry, len(raw))
+        return entry
+
+    def set(self, key: str, etag: Optional[str], body: Any):
+        entry = {"etag": etag, "body": body}
+        raw = json.dumps(entry).encode("utf-8")
+        if len(raw) > self.max_entry_bytes:
+            self.delete(key)
+            return
+        self._remember(key, entry, len(raw))
+        self.disk.set(key, raw)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._forget(key)
+        self.disk.delete(key)
+
+
+class AsyncGitteaClient:
+    """
+    Non-blocking Gitea client for code running on the event loop.
+
+    Requests share a bounded httpx connection pool, carry a timeout, and pass
+    through a semaphore so a slow Gitea queues callers instead of piling up
+    connections. Idempotent requests are retried with jittered exponential
+    backoff on transport errors and on 429/5xx gateway responses.
+
+    Repository reads go through a `ResponseCache`. Reads at a commit SHA are
+    immutable and served without asking Gitea again; everything else is
+    revalidated with If-None-Match, so an unchanged file costs a 304 instead
+    of its full base64 body.
+    """
+
+    def __init__(self):
+        self.base_url = settings.gittea_url
+        self.admin_token = settings.gittea_admin_token
+        self.max_retries = settings.gittea_max_retries
+        self.timeout = httpx.Timeout(
+            settings.gittea_timeout, connect=settings.gittea_connect_timeout
+        )
+        self.limits = httpx.Limits(
+            max_connections=settings.gittea_max_connections,
+            max_keepalive_connections=settings.gittea_max_connections,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.request_count = 0
+        self.cache = ResponseCache(
+            os.path.join(settings.cache_dir, "gitea"),
+            memory_bytes=settings.gittea_cache_memory_bytes,
+            max_bytes=settings.gittea_cache_max_bytes,
+            max_entry_bytes=settings.gittea_cache_max_entry_bytes,
+        )
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # created on first use so both belong to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=f"{self.base_url}/api/v1",
+                headers={
+                    "Authorization": f"token {self.admin_token}",
+                    "Content-Type": "application/json",
+                },
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+            self._semaphore = asyncio.Semaphore(settings.gittea_max_connections)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("Retry-After") if response else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), 30.0)
+        # full jitter
+        return random.uniform(0, min(0.5 * 2**attempt, 10.0))
+
+    async def _send(
+        self, method: str, endpoint: str, timeout: Optional[float] = None, **kwargs
+    ) -> httpx.Response:
+        """Send a request, retrying idempotent ones. Raises httpx.HTTPError."""
+        client = self._get_client()
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        for attempt in range(retries + 1):
+            response = None
+            try:
+                self.request_count += 1
+                counter = _call_counter.get()
+                if counter is not None:
+                    counter[0] += 1
+                async with self._semaphore:
+                    response = await client.request(method, endpoint, **kwargs)
+                if response.status_code == 304:
+                    return response
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"Gitea {method} {endpoint} failed ({e}), retrying")
+
+            await asyncio.sleep(self._backoff(attempt, response))
+
+    async def _make_request(
+        self, method: str, endpoint: str, timeout: Optional[float] = None, **kwargs
+    ) -> Dict[str, Any]:
+        """Make authenticated request to Gitea API"""
+        try:
+            response = await self._send(method, endpoint, timeout=timeout, **kwargs)
+            return response.json() if response.content else {}
+        except httpx.HTTPError as e:
+            logger.error(f"Gitea API request failed: {e}")
+            raise
+
+    async def _get_cached(
+        self,
+        key: str,
+        endpoint: str,
+        immutable: bool = False,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """GET through the response cache. None means Gitea answered 404."""
+        entry = await asyncio.to_thread(self.cache.get, key)
+        if entry is not None and immutable:
+            return entry["body"]
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        try:
+            response = await self._send("GET", endpoint, params=params, headers=headers)
+        except httpx.HTTPError as e:
+            if not (
+                isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404
+            ):
+                logger.error(f"Gitea API request failed: {e}")
+                raise
+            if immutable:
+                await asyncio.to_thread(self.cache.set, key, None, None)
+            elif entry is not None:
+                await asyncio.to_thread(self.cache.delete, key)
+            return None
+
+        if response.status_code == 304 and entry is not None:
+            return entry["body"]
+        body = response.json()
+        etag = response.headers.get("ETag")
+        # mutable responses without a validator cannot be revalidated
+        if immutable or etag:
+            await asyncio.to_thread(self.cache.set, key, etag, body)
+        return body
+
+    async def create_user(
+        self, username: str, email: str, full_name: str = ""
+    ) -> Dict[str, Any]:
+        """Create Gitea user account"""
+        logger.info(f"Creating Gitea user: {username}")
+        return await self._make_request(
+            "POST", "/admin/users", json=_user_data(username, email, full_name)
+        )
+
+    async def create_repo(
+        self, owner: str, repo_name: str, description: str = "", private: bool = False
+    ) -> Dict[str, Any]:
+        """Create repository for agent"""
+        logger.info(f"Creating repository: {owner}/{repo_name}")
+        return await self._make_request(
+            "POST",
+            f"/admin/users/{owner}/repos",
+            json=_repo_data(repo_name, description, private),
+        )
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get a Gitea user, None if it does not exist"""
+        try:
+            return await self._make_request("GET", f"/users/{username}")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            return None
+
+    async def create_access_token(
+        self, username: str, token_name: str = "modaic-api"
+    ) -> Dict[str, Any]:
+        """Generate API token for user"""
+        logger.info(f"Creating access token for user: {username}")
+        return await self._make_request(
+            "POST", f"/users/{username}/tokens", json=_token_data(token_name)
+        )
+
+    async def list_access_tokens(self, username: str) -> List[Dict[str, Any]]:
+        """List a user's API tokens, without their secrets"""
+        return await self._make_request(
+            "GET", f"/users/{username}/tokens", params={"limit": 50}
+        )
+
+    async def delete_access_token(self, username: str, token_id: int):
+        """Delete one of a user's API tokens"""
+        logger.info(f"Deleting access token {token_id} of user: {username}")
+        await self._make_request("DELETE", f"/users/{username}/tokens/{token_id}")
+
+    async def setup_webhook(
+        self, owner: str, repo: str, webhook_url: str
+    ) -> Dict[str, Any]:
+        """Set up push webhooks"""
+        logger.info(f"Setting up webhook for {owner}/{repo}")
+        return await self._make_request(
+            "POST", f"/repos/{owner}/{repo}/hooks", json=_webhook_data(webhook_url)
+        )
+
+    async def list_webhooks(self, owner: str, repo: str) -> List[Dict[str, Any]]:
+        """List the webhooks of a repository"""
+        return await self._make_request("GET", f"/repos/{owner}/{repo}/hooks")
+
+    async def get_repo_contents(
+        self, owner: str, repo: str, filepath: str, ref: str = "main"
+    ) -> Optional[Dict[str, Any]]:
+        """Get file contents from repository, None if the file does not exist.
+        Other failures raise so callers never mistake an outage for a deletion."""
+        contents = await self._get_cached(
+            f"contents:{owner.lower()}/{repo.lower()}:{filepath}@{ref}",
+            f"/repos/{owner}/{repo}/contents/{filepath}",
+            immutable=bool(COMMIT_SHA_PATTERN.match(ref)),
+            params={"ref": ref},
+        )
+        if contents is None:
+            logger.warning(f"File not found: {owner}/{repo}/{filepath}")
+        return contents
+
+    async def fork_repo(
+        self, owner: str, repo: str, new_owner: str, new_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Fork a repository into another user's namespace"""
+        logger.info(f"Forking repository {owner}/{repo} to {new_owner}")
+        # forks of large repositories take a while to answer
+        return await self._make_request(
+            "POST",
+            f"/repos/{owner}/{repo}/forks",
+            timeout=max(settings.gittea_timeout, 300.0),
+            json={"name": new_name or repo},
+            headers={"Sudo": new_owner},
+        )
+
+    async def get_user_repos(
+        self, username: str, page: int = 1, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        """Get one page of a user's repositories"""
+        try:
+            return await self._make_request(
+                "GET",
+                f"/users/{username}/repos",
+                params={"page": page, "limit": limit},
+            )
+        except httpx.HTTPError:
+            return []
+
+    async def iter_user_repos(
+        self, username: str, limit: int = 50
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every repository of a user, one page at a time"""
+        page = 1
+        while True:
+            repos = await self._make_request(
+                "GET",
+                f"/users/{username}/repos",
+                params={"page": page, "limit": limit},
+            )
+            for repo in repos:
+                yield repo
+            if len(repos) < limit:
+                return
+            page += 1
+
+    async def list_users(self, page: int = 1, limit: int = 50) -> List[Dict[str, Any]]:
+        """Get one page of all Gitea users (admin only)"""
+        return await self._make_request(
+            "GET", "/admin/users", params={"page": page, "limit": limit}
+        )
+
+    async def delete_repo(self, owner: str, repo: str) -> bool:
+        """Delete repository"""
+        try:
+            await self._make_request("DELETE", f"/repos/{owner}/{repo}")
+            logger.info(f"Deleted repository: {owner}/{repo}")
+            return True
+        except httpx.HTTPError:
+            return False
+
+    async def get_repo_info(self, owner: str, repo: str) -> Optional[Dict[str, Any]]:
+        """Get repository information, None if the repository does not exist"""
+        return await self._get_cached(
+            f"repo:{owner.lower()}/{repo.lower()}", f"/repos/{owner}/{repo}"
+        )
+
+
 gitea_client = GitteaClient()
+async_gitea_client = AsyncGitteaClient()
@@ -1,30 +1,279 @@
+import asyncio
+import base64
+import os
+import re
+import shutil
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
 from src.core.config import settings
+from src.lib.cache import DiskCache, SingleFlight
 from src.lib.logger import logger
-from fastapi import HTTPException
+from fastapi import HTTPException, UploadFile
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 rejects smaller parts, except the last one
+BLOB_KEY_PATTERN = re.compile(r"blobs/([0-9a-f]{2})/(\1[0-9a-f]{62})(\.[a-z0-9]+)?")
+
+
+def blob_key(digest: str, extension: str = "") -> str:
+    """Key of a content-addressed blob, fanned out by the first byte of its hash"""
+    return f"blobs/{digest[:2]}/{digest}{extension}"
+
+
+def parse_blob_key(file_key: str) -> Optional[str]:
+    """The hash a blob key addresses, or None for any other key"""
+    match = BLOB_KEY_PATTERN.fullmatch(file_key)
+    return match.group(2) if match else None
+
+
+def sha256_checksum(digest: str) -> str:
+    """A hex SHA-256 in the base64 form S3 checks request bodies against"""
+    return base64.b64encode(bytes.fromhex(digest)).decode()
+
+
+async def _read_chunks(
+    stream: Union[UploadFile, AsyncIterator[bytes]], chunk_size: int
+) -> AsyncIterator[bytes]:
+    if hasattr(stream, "read"):
+        while True:
+            chunk = await stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in stream:
+            yield chunk
 
 
 class S3Client:
     def __init__(
         self, bucket_name: str = settings.s3_bucket_name, region_name: str = "us-east-1"
     ):
-        client = boto3.resource("s3")
+        # endpoint_url points at a local S3-compatible server (moto, MinIO) in tests
+        client = boto3.resource(
+            "s3",
+            region_name=region_name,
+            endpoint_url=settings.s3_endpoint_url,
+            config=Config(max_pool_connections=max(10, settings.s3_upload_concurrency * 2)),
+        )
         self.bucket = client.Bucket(bucket_name)
         self.bucket_name = settings.s3_bucket_name
+        self.client = client.meta.client
+        # downloads, keyed by object key and ETag so a changed object misses
+        self.cache = DiskCache(
+            os.path.join(settings.cache_dir, "s3"), settings.s3_cache_max_bytes
+        )
+        self._downloads = SingleFlight()
+
+    def url(self, file_key: str) -> str:
+        return f"https://{settings.cloudfront_domain}/{file_key}"
 
     def upload_file(self, path_to_file: str, file_key: str):
         try:
             self.bucket.upload_file(path_to_file, file_key)
             logger.info(f"File {file_key} uploaded successfully to {self.bucket_name}")
-            return f"https://{settings.cloudfront_domain}/{file_key}"
+            return self.url(file_key)
         except ClientError as e:
             logger.error(f"Error uploading file: {e}")
             raise HTTPException(status_code=500, detail=f"Error uploading file {e}")
 
+    async def upload_stream(
+        self,
+        stream: Union[UploadFile, AsyncIterator[bytes]],
+        file_key: str,
+        content_type: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> str:
+        """
+        Upload an async byte stream without touching disk. Parts of
+        `s3_part_size` are uploaded in parallel, at most `s3_upload_concurrency`
+        at once; reading waits for a free slot, so memory stays bounded by
+        about (concurrency + 1) parts. Streams smaller than one part become a
+        single PUT. `on_chunk` sees every chunk read, to hash the stream say.
+        Returns the CloudFront URL.
+        """
+        part_size = max(settings.s3_part_size, MIN_PART_SIZE)
+        extra = {"ContentType": content_type} if content_type else {}
+        slots = asyncio.Semaphore(settings.s3_upload_concurrency)
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        uploads = []
+
+        async def upload_part(number: int, body: bytes):
+            try:
+                response = await asyncio.to_thread(
+                    self.client.upload_part,
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=body,
+                )
+                return {"PartNumber": number, "ETag": response["ETag"]}
+            finally:
+                slots.release()
+
+        async def start_part(body: bytes):
+            nonlocal upload_id
+            for task in uploads:
+                # stop reading as soon as a part has failed
+                if task.done() and task.exception():
+                    raise task.exception()
+            if upload_id is None:
+                response = await asyncio.to_thread(
+                    self.client.create_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    **extra,
+                )
+                upload_id = response["UploadId"]
+            await slots.acquire()
+            uploads.append(asyncio.create_task(upload_part(len(uploads) + 1, body)))
+
+        try:
+            async for chunk in _read_chunks(stream, 1024 * 1024):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise HTTPException(status_code=413, detail="File too large")
+                if on_chunk:
+                    on_chunk(chunk)
+                buffer += chunk
+                while len(buffer) >= part_size:
+                    await start_part(bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+
+            if upload_id is None:
+                await asyncio.to_thread(
+                    self.client.put_object,
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    Body=bytes(buffer),
+                    **extra,
+                )
+            else:
+                if buffer:
+                    await start_part(bytes(buffer))
+                parts = await asyncio.gather(*uploads)
+                await asyncio.to_thread(
+                    self.client.complete_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+        except BaseException as e:
+            for task in uploads:
+                task.cancel()
+            await asyncio.gather(*uploads, return_exceptions=True)
+            if upload_id is not None:
+                # parts of an unfinished upload are billed until aborted
+                await asyncio.to_thread(
+                    self.client.abort_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_key,
+                    UploadId=upload_id,
+                )
+            if isinstance(e, ClientError):
+                logger.error(f"Error uploading file: {e}")
+                raise HTTPException(status_code=500, detail=f"Error uploading file {e}")
+            raise
+
+        logger.info(f"Streamed {size} bytes to {file_key} in {self.bucket_name}")
+        return self.url(file_key)
+
+    def presign_put(
+        self,
+        file_key: str,
+        content_type: str,
+        size: int,
+        expires_in: int,
+        sha256: Optional[str] = None,
+    ) -> str:
+        """URL for a single PUT of exactly `size` bytes of `content_type`. With
+        `sha256`, S3 also rejects a body whose hash does not match."""
+        params = {
+            "Bucket": self.bucket_name,
+            "Key": file_key,
+            "ContentType": content_type,
+            "ContentLength": size,
+        }
+        if sha256:
+            params["ChecksumSHA256"] = sha256_checksum(sha256)
+        return self.client.generate_presigned_url(
+            "put_object", Params=params, ExpiresIn=expires_in
+        )
+
+    def presign_post(
+        self,
+        file_key: str,
+        content_type: str,
+        max_bytes: int,
+        expires_in: int,
+        sha256: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """URL and form fields for a browser POST of up to `max_bytes` bytes.
+        With `sha256`, S3 also rejects a body whose hash does not match."""
+        fields = {"Content-Type": content_type}
+        if sha256:
+            fields["x-amz-checksum-algorithm"] = "SHA256"
+            fields["x-amz-checksum-sha256"] = sha256_checksum(sha256)
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=file_key,
+            Fields=fields,
+            Conditions=[
+                *({name: value} for name, value in fields.items()),
+                ["content-length-range", 1, max_bytes],
+            ],
+            ExpiresIn=expires_in,
+        )
+
+    def put_bytes(
+        self,
+        file_key: str,
+        body: bytes,
+        content_type: str,
+        cache_control: Optional[str] = None,
+        sha256: Optional[str] = None,
+    ) -> str:
+        extra = {"CacheControl": cache_control} if cache_control else {}
+        if sha256:
+            extra["ChecksumSHA256"] = sha256_checksum(sha256)
+        self.client.put_object(
+            Bucket=self.bucket_name,
+            Key=file_key,
+            Body=body,
+            ContentType=content_type,
+            **extra,
+        )
+        return self.url(file_key)
+
+    def copy_object(
+        self,
+        source_key: str,
+        file_key: str,
+        content_type: str,
+        cache_control: Optional[str] = None,
+    ) -> str:
+        """Copy an object within the bucket, server side, replacing its metadata"""
+        extra = {"CacheControl": cache_control} if cache_control else {}
+        self.client.copy_object(
+            Bucket=self.bucket_name,
+            Key=file_key,
+            CopySource={"Bucket": self.bucket_name, "Key": source_key},
+            MetadataDirective="REPLACE",
+            ContentType=content_type,
+            **extra,
+        )
+        return self.url(file_key)
+
     def get_file_size(self, file_key: str):
         try:
-            response = self.bucket.head_object(Key=file_key)
+            # the Bucket resource has no head_object, the client does
+            response = self.client.head_object(Bucket=self.bucket_name, Key=file_key)
             return response["ContentLength"]
         except ClientError as e:
             if e.response["Error"]["Code"] == "404":
@@ -33,7 +282,7 @@ class S3Client:
 
     def delete_file(self, file_key: str):
         try:
-            self.bucket.delete_object(Key=file_key)
+            self.client.delete_object(Bucket=self.bucket_name, Key=file_key)
             logger.info(f"Deleted file {file_key}")
             return True
         except ClientError as e:
@@ -41,9 +290,46 @@ class S3Client:
                 return None
             raise
 
+    def _fetch(self, file_key: str, etag: Optional[str], cache_key: str) -> str:
+        def write(f):
+            params = {"Bucket": self.bucket_name, "Key": file_key}
+            if etag:
+                # fail rather than cache other bytes under this version
+                params["IfMatch"] = etag
+            body = self.client.get_object(**params)["Body"]
+            shutil.copyfileobj(body, f, 1024 * 1024)
+
+        path = self.cache.write(cache_key, write)
+        logger.info(f"Cached {file_key} from {self.bucket_name}")
+        return path
+
+    def cached_path(self, file_key: str) -> str:
+        """
+        Path of a local copy of the object, downloaded into the cache unless
+        its current version is there already. Concurrent calls for the same
+        version share one download. Read the file or memory-map it straight
+        away: it may be evicted later, though not from under an open handle.
+        """
+        # a blob key always holds the same bytes, so skip asking for the ETag
+        etag = None
+        if not parse_blob_key(file_key):
+            response = self.client.head_object(Bucket=self.bucket_name, Key=file_key)
+            etag = response["ETag"]
+        cache_key = f"{file_key}\n{etag or ''}"
+
+        path = self.cache.lookup(cache_key)
+        if path:
+            return path
+        return self._downloads.do(
+            cache_key,
+            # a download may have finished between the lookup and here
+            lambda: self.cache.lookup(cache_key)
+            or self._fetch(file_key, etag, cache_key),
+        )
+
     def download_file(self, file_key: str, path_to_download_to: str):
         try:
-            self.bucket.download_file(file_key, path_to_download_to)
+            shutil.copyfile(self.cached_path(file_key), path_to_download_to)
             logger.info(
                 f"File {file_key} downloaded successfully to {path_to_download_to}"
             )
@@ -51,28 +337,51 @@ class S3Client:
             logger.error(f"Error downloading file: {e}")
             raise HTTPException(status_code=500, detail=f"Error downloading file {e}")
 
+    def list_objects(
+        self, prefix: str, start_after: Optional[str] = None, limit: int = 1000
+    ) -> List[Tuple[str, int]]:
+        """One page of (key, size) under `prefix`, in key order, after `start_after`"""
+        params = {"Bucket": self.bucket_name, "Prefix": prefix, "MaxKeys": limit}
+        if start_after:
+            params["StartAfter"] = start_after
+        response = self.client.list_objects_v2(**params)
+        return [(obj["Key"], obj["Size"]) for obj in response.get("Contents", [])]
+
+    def list_keys(
+        self, prefix: str, start_after: Optional[str] = None, limit: int = 1000
+    ) -> List[str]:
+        """One page of keys under `prefix`, in key order, after `start_after`"""
+        return [key for key, _ in self.list_objects(prefix, start_after, limit)]
+
+    def delete_keys(self, keys: List[str]) -> List[str]:
+        """Delete up to 1000 keys in one request, returning the keys that failed"""
+        response = self.client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+        errors = response.get("Errors", [])
+        for error in errors[:5]:
+            logger.error(f"Failed to delete {error['Key']}: {error.get('Message')}")
+        return [error["Key"] for error in errors]
+
     def delete_directory(self, path: str):
         # make sure the prefix ends with '/' if it's meant to be a directory
         if not path.endswith("/"):
             path += "/"
 
-        # list all objects with the directory prefix
-        paginator = self.bucket.get_paginator("list_objects_v2")
-        pages = paginator.paginate(Prefix=path)
+        # the Bucket resource has no paginator, the client does
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket=self.bucket_name, Prefix=path)
 
-        # collect all object keys to delete
-        objects_to_delete = []
+        # delete each page as it is listed (at most 1000 keys per page)
+        deleted = 0
         for page in pages:
-            if "Contents" in page:
-                for obj in page["Contents"]:
-                    objects_to_delete.append({"Key": obj["Key"]})
-
-        # delete objects in batches (max 1000 per batch)
-        if objects_to_delete:
-            for i in range(0, len(objects_to_delete), 1000):
-                batch = objects_to_delete[i : i + 1000]
-                self.bucket.delete_objects(Delete={"Objects": batch})
-            logger.info(f"Deleted {len(objects_to_delete)} objects from {path}")
+            keys = [obj["Key"] for obj in page.get("Contents", [])]
+            if keys:
+                deleted += len(keys) - len(self.delete_keys(keys))
+
+        if deleted:
+            logger.info(f"Deleted {deleted} objects from {path}")
         else:
             logger.info(f"No objects found with prefix {path}")
 
@@ -0,0 +1,282 @@
+import asyncio
+import smtplib
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import aiosmtplib
+from src.lib.logger import logger
+
+
+class _Connection:
+    __slots__ = ("smtp", "created", "last_used", "messages")
+
+    def __init__(self, smtp: Any):
+        self.smtp = smtp
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.messages = 0
+
+
+class _PoolBase:
+    """
+    Bookkeeping shared by the sync and async pools.
+
+    At most `size` connections are open at once. Idle ones are reused most
+    recently used first; one idle for longer than `check_after` seconds is
+    sent a NOOP before it is handed out, and replaced if that fails. A
+    connection is retired after `max_messages` messages or `max_lifetime`
+    seconds, before the server drops it on its own.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        size: int = 4,
+        timeout: float = 30.0,
+        check_after: float = 5.0,
+        max_messages: int = 100,
+        max_lifetime: float = 300.0,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_messages = max_messages
+        self.max_lifetime = max_lifetime
+        self._idle: List[_Connection] = []
+
+    def _expired(self, conn: _Connection) -> bool:
+        return (
+            conn.messages >= self.max_messages
+            or time.monotonic() - conn.created > self.max_lifetime
+        )
+
+    def _needs_check(self, conn: _Connection) -> bool:
+        return time.monotonic() - conn.last_used > self.check_after
+
+
+class SMTPPool(_PoolBase):
+    """Thread-safe pool of authenticated SMTP connections"""
+
+    # errors after which a connection cannot be trusted with another message
+    BROKEN = (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _connect(self) -> _Connection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.starttls()
+            smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        logger.info(f"Opened SMTP connection to {self.host}")
+        return _Connection(smtp)
+
+    def _close(self, conn: _Connection):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    def _healthy(self, conn: _Connection) -> bool:
+        try:
+            return conn.smtp.noop()[0] == 250
+        except self.BROKEN:
+            return False
+
+    def _acquire(self) -> _Connection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._expired(conn) or (
+                self._needs_check(conn) and not self._healthy(conn)
+            ):
+                self._close(conn)
+                continue
+            return conn
+
+    def _release(self, conn: _Connection):
+        conn.last_used = time.monotonic()
+        if self._expired(conn):
+            self._close(conn)
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    @contextmanager
+    def _borrow(self) -> Iterator[_Connection]:
+        with self._slots:
+            conn = self._acquire()
+            try:
+                yield conn
+            except self.BROKEN:
+                self._close(conn)
+                raise
+            except BaseException:
+                self._release(conn)
+                raise
+            self._release(conn)
+
+    def send(self, from_addr: str, to_addrs: Sequence[str], message: str):
+        """Send one message, reconnecting once if the connection was dropped"""
+        for attempt in range(2):
+            try:
+                with self._borrow() as conn:
+                    conn.smtp.sendmail(from_addr, list(to_addrs), message)
+                    conn.messages += 1
+                    return
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+                logger.warning(f"SMTP connection to {self.host} dropped, reconnecting")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+
+class AsyncSMTPPool(_PoolBase):
+    """The same pool on aiosmtplib, for code running on the event loop.
+    Connections belong to the loop they were opened on."""
+
+    BROKEN = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPResponseException, OSError)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # created on first use, on the loop that uses it
+        self._slots: Optional[asyncio.BoundedSemaphore] = None
+
+    async def _connect(self) -> _Connection:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, timeout=self.timeout, start_tls=True
+        )
+        await smtp.connect()
+        try:
+            await smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        logger.info(f"Opened async SMTP connection to {self.host}")
+        return _Connection(smtp)
+
+    async def _close(self, conn: _Connection):
+        try:
+            await conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    async def _healthy(self, conn: _Connection) -> bool:
+        try:
+            return (await conn.smtp.noop()).code == 250
+        except self.BROKEN:
+            return False
+
+    async def _acquire(self) -> _Connection:
+        while self._idle:
+            conn = self._idle.pop()
+            if self._expired(conn) or (
+                self._needs_check(conn) and not await self._healthy(conn)
+            ):
+                await self._close(conn)
+                continue
+            return conn
+        return await self._connect()
+
+    async def _release(self, conn: _Connection):
+        conn.last_used = time.monotonic()
+        if self._expired(conn):
+            await self._close(conn)
+            return
+        self._idle.append(conn)
+
+    @asynccontextmanager
+    async def _borrow(self) -> AsyncIterator[_Connection]:
+        if self._slots is None:
+            self._slots = asyncio.BoundedSemaphore(self.size)
+        async with self._slots:
+            conn = await self._acquire()
+            try:
+                yield conn
+            except self.BROKEN:
+                await self._close(conn)
+                raise
+            except BaseException:
+                await self._release(conn)
+                raise
+            await self._release(conn)
+
+    async def send(self, from_addr: str, to_addrs: Sequence[str], message: str):
+        """Send one message, reconnecting once if the connection was dropped"""
+        for attempt in range(2):
+            try:
+                async with self._borrow() as conn:
+                    await conn.smtp.sendmail(from_addr, list(to_addrs), message)
+                    conn.messages += 1
+                    return
+            except aiosmtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+                logger.warning(f"SMTP connection to {self.host} dropped, reconnecting")
+
+    async def send_many(
+        self,
+        from_addr: str,
+        messages: Sequence[Tuple[Sequence[str], str]],
+        before_each: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> List[Optional[Exception]]:
+        """
+        Send (recipients, message) pairs over one borrowed connection, calling
+        `before_each` (a rate limiter, say) before every message. Returns the
+        error of each attempted message, or None if it was sent. An error
+        that breaks the connection, or any unexpected one, ends the batch, so
+        the result can be shorter than `messages`: the rest were not
+        attempted. Nothing is raised, so the caller always learns what was
+        sent.
+        """
+        results: List[Optional[Exception]] = []
+        try:
+            async with self._borrow() as conn:
+                for to_addrs, message in messages:
+                    if before_each:
+                        await before_each()
+                    try:
+                        await conn.smtp.sendmail(from_addr, list(to_addrs), message)
+                        conn.messages += 1
+                        results.append(None)
+                    except aiosmtplib.SMTPRecipientsRefused as e:
+                        # the transaction failed, the connection is fine
+                        results.append(e)
+        except Exception as e:
+            results.append(e)
+        return results
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._close(conn)
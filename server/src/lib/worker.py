@@ -0,0 +1,151 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+from src.lib.logger import logger
+
+
+def backoff_delay(attempts: int, base: float = 5.0, cap: float = 600.0) -> float:
+    """Seconds to wait before retry number `attempts`: exponential, jittered"""
+    return min(base * 2**attempts, cap) * random.uniform(0.5, 1.5)
+
+
+class RateLimiter:
+    """
+    Async token bucket: on average at most `rate` acquisitions per second,
+    with bursts of up to `burst`. Shared by every worker of a process.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                current = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (current - self._updated) * self.rate
+                )
+                self._updated = current
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Spend the bucket for `seconds`, e.g. after the provider pushed back"""
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class WorkerPool:
+    """
+    Run a fixed number of workers that claim items from a queue and process them.
+
+    `claim` is a blocking callable (usually a database query) that returns the
+    next item or None when the queue is empty; it runs in a thread so the event
+    loop is never blocked. `process` is awaited for every claimed item. The
+    number of workers bounds how many items are processed at the same time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        claim: Callable[[], Optional[Any]],
+        process: Callable[[Any], Awaitable[None]],
+        concurrency: int = 1,
+        poll_interval: float = 1.0,
+    ):
+        self.name = name
+        self.claim = claim
+        self.process = process
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.tasks: List[asyncio.Task] = []
+        self._stopping: Optional[asyncio.Event] = None
+
+    def start(self) -> List[asyncio.Task]:
+        """Start the workers on the running event loop"""
+        self._stopping = asyncio.Event()
+        self.tasks = [
+            asyncio.create_task(self._run(i), name=f"{self.name}-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(f"Started worker pool {self.name} ({self.concurrency} workers)")
+        return self.tasks
+
+    async def stop(self, timeout: float = 30.0):
+        """Let in-flight items finish, then stop the workers"""
+        if self._stopping is None:
+            return
+        self._stopping.set()
+        done, pending = await asyncio.wait(self.tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        logger.info(f"Stopped worker pool {self.name}")
+
+    async def _run(self, index: int):
+        while not self._stopping.is_set():
+            try:
+                item = await asyncio.to_thread(self.claim)
+            except Exception as e:
+                logger.error(f"{self.name}-{index} failed to claim work: {e}")
+                item = None
+
+            if item is None:
+                try:
+                    await asyncio.wait_for(
+                        self._stopping.wait(), timeout=self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.process(item)
+            except Exception as e:
+                # process is expected to record its own failures
+                logger.error(f"{self.name}-{index} failed to process work: {e}")
+
+
+class PeriodicTask:
+    """Await `func` every `interval` seconds until stopped"""
+
+    def __init__(
+        self, name: str, func: Callable[[], Awaitable[None]], interval: float
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.tasks: List[asyncio.Task] = []
+        self._stopping: Optional[asyncio.Event] = None
+
+    def start(self) -> List[asyncio.Task]:
+        self._stopping = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._run(), name=self.name)]
+        logger.info(f"Scheduled {self.name} every {self.interval}s")
+        return self.tasks
+
+    async def stop(self, timeout: float = 30.0):
+        if self._stopping is None:
+            return
+        self._stopping.set()
+        done, pending = await asyncio.wait(self.tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.func()
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
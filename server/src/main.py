@@ -10,6 +10,8 @@ from src.api.index import (
     contributor_router,
     webhook_router,
     agent_router,
+    job_router,
+    search_router,
 )
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -52,6 +54,8 @@ app.include_router(auth_router, prefix="/api/v1/auth")
 app.include_router(contributor_router, prefix="/api/v1/contributor")
 app.include_router(webhook_router, prefix="/api/v1/webhooks")
 app.include_router(agent_router, prefix="/api/v1/agents")
+app.include_router(job_router, prefix="/api/v1/jobs")
+app.include_router(search_router, prefix="/api/v1/search")
 
 
 @app.get("/")
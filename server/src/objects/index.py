@@ -1,9 +1,17 @@
 from src.objects.schemas.user import *
 from src.objects.schemas.contributor import *
 from src.objects.schemas.agent import *
+from src.objects.schemas.job import *
+from src.objects.schemas.webhook import *
+from src.objects.schemas.blob import *
+from src.objects.schemas.email import *
 from src.objects.models.user import *
 from src.objects.models.contributor import *
 from src.objects.models.agent import *
+from src.objects.models.job import *
+from src.objects.models.webhook import *
+from src.objects.models.blob import *
+from src.objects.models.email import *
 
 user_schemas = [
     "UserSchema",
@@ -26,6 +34,7 @@ agent_schemas = [
     "AgentSchema",
     "CreateAgentRequest",
     "UpdateAgentRequest",
+    "UpdateAgentMetadataRequest",
     "PublicAgentSchema",
     "AgentResponse",
     "DeleteAgentRequest",
@@ -35,16 +44,44 @@ agent_schemas = [
     "ForkRequest",
     "ForkSchema",
     "ImageKeySchema",
+    "PresignImageRequest",
+    "CompleteImageUploadRequest",
     "AgentTagSchema",
+    "SimilarAgentSchema",
+    "AgentDetailSchema",
 ]
 
-agent_models = ["Agent", "Star", "Fork", "ImageKey", "AgentTag"]
+agent_models = ["Agent", "Star", "Fork", "ImageKey", "AgentTag", "SimilarAgent"]
+
+job_schemas = ["JobSchema", "PublicJobSchema", "JobStatusEnum"]
+
+job_models = ["Job"]
+
+webhook_schemas = ["WebhookDeliverySchema", "DeliveryStatusEnum"]
+
+webhook_models = ["WebhookDelivery"]
+
+blob_schemas = ["BlobSchema"]
+
+blob_models = ["Blob"]
+
+email_schemas = ["EmailOutboxSchema", "OutboxStatusEnum"]
+
+email_models = ["EmailOutbox"]
 
 __all__ = (
     user_schemas
     + contributor_schemas
     + agent_schemas
+    + job_schemas
+    + webhook_schemas
+    + blob_schemas
+    + email_schemas
     + user_models
     + contributor_models
     + agent_models
+    + job_models
+    + webhook_models
+    + blob_models
+    + email_models
 )
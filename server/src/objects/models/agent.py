@@ -1,14 +1,18 @@
 from sqlalchemy import (
     Column,
     String,
+    Float,
+    BigInteger,
     ForeignKey,
     CheckConstraint,
     Index,
     UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from src.db.pg import Base
 from src.utils.date import now
+from src.utils.image import cloudfront_url, srcset
 from sqlalchemy.ext.hybrid import hybrid_property
 
 
@@ -21,8 +25,11 @@ class Agent(Base):
     adminId = Column(String(100), ForeignKey("users.userId"), nullable=False)
     configYaml = Column(String(50000), nullable=False, default="")
     readmeContent = Column(String(50000), nullable=False, default="")
+    readmeHtml = Column(String, nullable=True)  # sanitised rendering of readmeContent
+    readmeHash = Column(String(64), nullable=True)  # what readmeHtml was rendered from
     version = Column(String(20), nullable=False, default="1.0.0")
     lastMirrored = Column(String, nullable=True)
+    storageBytes = Column(BigInteger, nullable=False, default=0)  # see UsageService
     created = Column(String, nullable=False, default=now)
     updated = Column(String, nullable=False, default=now, onupdate=now)
     visibility = Column(String(20), nullable=False, default="private")
@@ -67,6 +74,22 @@ class Agent(Base):
     def tags(self):
         return [tag.tag for tag in self.agent_tags]
 
+    @hybrid_property
+    def cover_image(self):
+        return min(self.image_keys, key=lambda image: image.created, default=None)
+
+    @hybrid_property
+    def image_url(self):
+        cover = self.cover_image
+        return cloudfront_url(cover.imageKey) if cover else None
+
+    @hybrid_property
+    def image_srcset(self):
+        cover = self.cover_image
+        if not cover or not cover.variants:
+            return None
+        return srcset(cover.imageKey, cover.variants)
+
     __table_args__ = (
         CheckConstraint("visibility IN ('private', 'public')", name="check_visibility"),
         CheckConstraint(
@@ -75,6 +98,13 @@ class Agent(Base):
         Index("idx_agent_admin_visibility", "adminId", "visibility"),
         Index("idx_agent_created", "created"),
         Index("idx_agent_visibility_created", "visibility", "created"),
+        # trigram index serving both prefix (ILIKE 'q%') and fuzzy (%) matches
+        Index(
+            "idx_agent_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
     )
 
     def __repr__(self):
@@ -148,6 +178,11 @@ class ImageKey(Base):
         String(100), ForeignKey("agents.agentId", ondelete="CASCADE"), nullable=False
     )
     imageKey = Column(String(500), nullable=False)
+    # the content-addressed blob holding the bytes, if any
+    blobHash = Column(String(64), ForeignKey("blobs.blobHash"), nullable=True)
+    # size of the original and the resized variants, once derived
+    variants = Column(JSONB, nullable=True)
+    derivedAt = Column(String, nullable=True)
     created = Column(String, nullable=False, default=now)
 
     # relationships
@@ -156,6 +191,7 @@ class ImageKey(Base):
     # constraints
     __table_args__ = (
         Index("idx_image_key_agent", "agentId"),
+        Index("idx_image_key_blob", "blobHash"),
         UniqueConstraint("agentId", "imageKey", name="unique_agent_image_key"),
     )
 
@@ -186,3 +222,26 @@ class AgentTag(Base):
 
     def __repr__(self):
         return f"<AgentTag(tagId='{self.tagId}', agentId='{self.agentId}', tag='{self.tag}')>"
+
+
+class SimilarAgent(Base):
+    __tablename__ = "similar_agents"
+
+    agentId = Column(
+        String(100), ForeignKey("agents.agentId", ondelete="CASCADE"), primary_key=True
+    )
+    similarAgentId = Column(
+        String(100), ForeignKey("agents.agentId", ondelete="CASCADE"), primary_key=True
+    )
+    score = Column(Float, nullable=False)
+    computed = Column(String, nullable=False, default=now)
+
+    # constraints
+    __table_args__ = (
+        Index("idx_similar_agent_score", "agentId", score.desc()),
+        Index("idx_similar_agent_target", "similarAgentId"),
+        CheckConstraint('"agentId" <> "similarAgentId"', name="check_not_self_similar"),
+    )
+
+    def __repr__(self):
+        return f"<SimilarAgent(agentId='{self.agentId}', similarAgentId='{self.similarAgentId}', score={self.score})>"
@@ -0,0 +1,27 @@
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    BigInteger,
+    Index,
+)
+from src.db.pg import Base
+from src.utils.date import now
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    blobHash = Column(String(64), primary_key=True)  # sha256 of the bytes
+    blobKey = Column(String(500), nullable=False, unique=True)
+    size = Column(BigInteger, nullable=False)
+    contentType = Column(String(100), nullable=False)
+    # image_keys rows pointing at this blob; collected once it stays at 0
+    refCount = Column(Integer, nullable=False, default=0)
+    created = Column(String, nullable=False, default=now)
+    updated = Column(String, nullable=False, default=now, onupdate=now)
+
+    __table_args__ = (Index("idx_blob_unreferenced", "refCount", "updated"),)
+
+    def __repr__(self):
+        return f"<Blob(blobHash='{self.blobHash}', refCount={self.refCount})>"
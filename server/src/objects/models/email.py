@@ -0,0 +1,47 @@
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    CheckConstraint,
+    Index,
+    UniqueConstraint,
+)
+from src.db.pg import Base
+from src.utils.date import now
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    outboxId = Column(String(100), primary_key=True)
+    recipient = Column(String(255), nullable=False)
+    recipientName = Column(String(255), nullable=True)
+    subject = Column(String(500), nullable=False)
+    body = Column(String, nullable=False)
+    bodyType = Column(String(10), nullable=False, default="plain")
+    campaignId = Column(String(100), nullable=True)  # set by bulk campaigns
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    nextAttemptAt = Column(String, nullable=False, default=now)
+    leaseExpires = Column(String, nullable=True)
+    lastError = Column(String(2000), nullable=True)
+    sentAt = Column(String, nullable=True)
+    created = Column(String, nullable=False, default=now)
+    updated = Column(String, nullable=False, default=now, onupdate=now)
+
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('pending', 'sending', 'sent', 'dead')",
+            name="check_email_outbox_status",
+        ),
+        CheckConstraint(
+            "\"bodyType\" IN ('plain', 'html')", name="check_email_outbox_body_type"
+        ),
+        Index("idx_email_outbox_claim", "status", "nextAttemptAt"),
+        Index("idx_email_outbox_created", "created"),
+        # a resumed campaign never queues the same recipient twice
+        UniqueConstraint("campaignId", "recipient", name="unique_campaign_recipient"),
+    )
+
+    def __repr__(self):
+        return f"<EmailOutbox(outboxId='{self.outboxId}', status='{self.status}')>"
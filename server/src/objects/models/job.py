@@ -0,0 +1,46 @@
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    ForeignKey,
+    CheckConstraint,
+    Index,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from src.db.pg import Base
+from src.utils.date import now
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    jobId = Column(String(100), primary_key=True)
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")
+    payload = Column(JSONB, nullable=False, default=dict)
+    result = Column(JSONB, nullable=True)
+    checkpoint = Column(JSONB, nullable=True)  # progress of resumable jobs
+    error = Column(String(2000), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    maxAttempts = Column(Integer, nullable=False, default=3)
+    userId = Column(
+        String(100), ForeignKey("users.userId", ondelete="CASCADE"), nullable=True
+    )  # requester, used to authorize status polling
+    runAt = Column(String, nullable=False, default=now)
+    leaseExpires = Column(String, nullable=True)  # reclaimable after a worker dies
+    startedAt = Column(String, nullable=True)
+    finishedAt = Column(String, nullable=True)
+    created = Column(String, nullable=False, default=now)
+    updated = Column(String, nullable=False, default=now, onupdate=now)
+
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('queued', 'running', 'succeeded', 'failed')",
+            name="check_job_status",
+        ),
+        Index("idx_job_claim", "kind", "status", "runAt"),
+        Index("idx_job_user", "userId"),
+    )
+
+    def __repr__(self):
+        return f"<Job(jobId='{self.jobId}', kind='{self.kind}', status='{self.status}')>"
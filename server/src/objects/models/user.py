@@ -2,6 +2,7 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    BigInteger,
     CheckConstraint,
     Index,
 )
@@ -30,6 +31,13 @@ class User(Base):
     xUrl = Column(String(500), nullable=True)
     websiteUrl = Column(String(500), nullable=True)
 
+    # gitea account, filled in by provisioning
+    giteaUserId = Column(Integer, nullable=True)
+    giteaToken = Column(String(500), nullable=True)
+
+    # bytes stored across their agents, see UsageService
+    storageBytes = Column(BigInteger, nullable=False, default=0)
+
     # relationships
     owned_agents = relationship(
         "Agent", back_populates="owner", cascade="all, delete-orphan"
@@ -122,6 +130,25 @@ class User(Base):
         Index("idx_user_created", "created"),
         Index("idx_user_updated", "updated"),
         Index("idx_user_fullname", "fullName"),
+        # LIKE 'prefix%' scans, whatever the database collation
+        Index(
+            "idx_user_username_prefix",
+            "username",
+            postgresql_ops={"username": "text_pattern_ops"},
+        ),
+        # trigram indexes for search suggestions
+        Index(
+            "idx_user_username_trgm",
+            "username",
+            postgresql_using="gin",
+            postgresql_ops={"username": "gin_trgm_ops"},
+        ),
+        Index(
+            "idx_user_fullname_trgm",
+            "fullName",
+            postgresql_using="gin",
+            postgresql_ops={"fullName": "gin_trgm_ops"},
+        ),
     )
 
     def __repr__(self):
@@ -0,0 +1,42 @@
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    CheckConstraint,
+    Index,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from src.db.pg import Base
+from src.utils.date import now
+
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+
+    deliveryId = Column(String(100), primary_key=True)  # X-Gitea-Delivery
+    event = Column(String(50), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    repoKey = Column(String(255), nullable=True)  # "owner/repo", for coalescing
+    ref = Column(String(255), nullable=True)
+    coalescedInto = Column(String(100), nullable=True)  # delivery that mirrored it
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    nextAttemptAt = Column(String, nullable=False, default=now)
+    leaseExpires = Column(String, nullable=True)
+    lastError = Column(String(2000), nullable=True)
+    processedAt = Column(String, nullable=True)
+    created = Column(String, nullable=False, default=now)
+    updated = Column(String, nullable=False, default=now, onupdate=now)
+
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('pending', 'processing', 'done', 'dead')",
+            name="check_webhook_delivery_status",
+        ),
+        Index("idx_webhook_delivery_claim", "status", "nextAttemptAt"),
+        Index("idx_webhook_delivery_created", "created"),
+        Index("idx_webhook_delivery_repo", "repoKey", "status"),
+    )
+
+    def __repr__(self):
+        return f"<WebhookDelivery(deliveryId='{self.deliveryId}', event='{self.event}', status='{self.status}')>"
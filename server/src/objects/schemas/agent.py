@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import Any, Dict, Literal, Optional
 from enum import Enum
 
 from src.utils.date import now
@@ -51,6 +51,15 @@ class UpdateAgentRequest(BaseModel):
     model_config = ConfigDict(exclude_unset=True)
 
 
+class UpdateAgentMetadataRequest(BaseModel):
+    description: Optional[str] = Field(None, max_length=2000)
+    visibility: Optional[VisibilityEnum] = None
+    tags: Optional[list[str]] = Field(None, max_items=20)
+
+    # name, config and readme live in the gitea repo and are not editable here
+    model_config = ConfigDict(extra="forbid")
+
+
 class PublicAgentSchema(BaseModel):
     agentId: str
     name: str
@@ -62,6 +71,9 @@ class PublicAgentSchema(BaseModel):
     stars_count: int
     forks_count: int
     forkedFrom: Optional[str] = None
+    image_url: Optional[str] = None
+    # content type -> srcset of resized variants of the cover image
+    image_srcset: Optional[Dict[str, str]] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -114,11 +126,25 @@ class ImageKeySchema(BaseModel):
     imageKeyId: str
     agentId: str
     imageKey: str = Field(..., min_length=1, max_length=500)
+    blobHash: Optional[str] = None
+    variants: Optional[Dict[str, Any]] = None
+    derivedAt: Optional[str] = None
     created: str = Field(default_factory=now)
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class PresignImageRequest(BaseModel):
+    contentType: str
+    size: int = Field(..., gt=0)
+    sha256: str = Field(..., pattern=r"^[0-9a-f]{64}$")  # hex digest of the bytes
+    method: Literal["post", "put"] = "post"
+
+
+class CompleteImageUploadRequest(BaseModel):
+    imageKey: str = Field(..., min_length=1, max_length=500)
+
+
 class AgentTagSchema(BaseModel):
     tagId: str
     agentId: str
@@ -126,3 +152,17 @@ class AgentTagSchema(BaseModel):
     created: str = Field(default_factory=now)
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class SimilarAgentSchema(PublicAgentSchema):
+    score: float
+
+
+class AgentDetailSchema(PublicAgentSchema):
+    """Agent page, with the README pre-rendered to sanitised HTML."""
+
+    version: str
+    readmeContent: str = ""
+    readmeHtml: Optional[str] = None
+    readmeHash: Optional[str] = None
+    lastMirrored: Optional[str] = None
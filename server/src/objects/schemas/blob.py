@@ -0,0 +1,14 @@
+from pydantic import BaseModel, ConfigDict, Field
+from src.utils.date import now
+
+
+class BlobSchema(BaseModel):
+    blobHash: str = Field(..., min_length=64, max_length=64)
+    blobKey: str
+    size: int
+    contentType: str
+    refCount: int = 0
+    created: str = Field(default_factory=now)
+    updated: str = Field(default_factory=now)
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,28 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
+from enum import Enum
+
+
+class OutboxStatusEnum(str, Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    DEAD = "dead"  # gave up after the last retry
+
+
+class EmailOutboxSchema(BaseModel):
+    outboxId: str
+    recipient: str
+    recipientName: Optional[str] = None
+    subject: str
+    body: str
+    bodyType: str = "plain"
+    campaignId: Optional[str] = None
+    status: OutboxStatusEnum
+    attempts: int = 0
+    nextAttemptAt: str
+    lastError: Optional[str] = None
+    sentAt: Optional[str] = None
+    created: str
+
+    model_config = ConfigDict(from_attributes=True, use_enum_values=True)
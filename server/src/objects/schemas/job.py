@@ -0,0 +1,46 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Dict, Optional
+from enum import Enum
+
+
+class JobStatusEnum(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class JobSchema(BaseModel):
+    jobId: str
+    kind: str
+    status: JobStatusEnum
+    payload: Dict[str, Any] = {}
+    result: Optional[Dict[str, Any]] = None
+    checkpoint: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    maxAttempts: int = 3
+    userId: Optional[str] = None
+    runAt: str
+    startedAt: Optional[str] = None
+    finishedAt: Optional[str] = None
+    created: str
+    updated: str
+
+    model_config = ConfigDict(from_attributes=True, use_enum_values=True)
+
+
+class PublicJobSchema(BaseModel):
+    """Job status as reported to the requester."""
+
+    jobId: str
+    kind: str
+    status: JobStatusEnum
+    result: Optional[Dict[str, Any]] = None
+    checkpoint: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int
+    created: str
+    updated: str
+
+    model_config = ConfigDict(from_attributes=True, use_enum_values=True)
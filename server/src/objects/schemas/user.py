@@ -22,6 +22,7 @@ class UserSchema(BaseModel):
     linkedinUrl: Optional[str] = Field(None, max_length=500)
     xUrl: Optional[str] = Field(None, max_length=500)
     websiteUrl: Optional[str] = Field(None, max_length=500)
+    giteaUserId: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -0,0 +1,26 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Dict, Optional
+from enum import Enum
+
+
+class DeliveryStatusEnum(str, Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    DEAD = "dead"  # gave up after the last retry
+
+
+class WebhookDeliverySchema(BaseModel):
+    deliveryId: str
+    event: str
+    payload: Dict[str, Any]
+    repoKey: Optional[str] = None
+    ref: Optional[str] = None
+    status: DeliveryStatusEnum
+    attempts: int = 0
+    nextAttemptAt: str
+    lastError: Optional[str] = None
+    processedAt: Optional[str] = None
+    created: str
+
+    model_config = ConfigDict(from_attributes=True, use_enum_values=True)
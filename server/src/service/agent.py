@@ -1,10 +1,227 @@
-from src.objects.index import AgentSchema, Agent
-from src.lib.gittea import gitea_client
+import asyncio
+import base64
+import re
+import yaml
+from typing import Any, Dict, Iterable, Optional
+from sqlalchemy.orm import Session
+from src.objects.index import AgentSchema, Agent, Fork, ImageKey, User
+from src.constants.index import AGENT_CONFIG_FILE, AGENT_README_FILE
+from src.db.pg import get_db_session
+from src.lib.gittea import async_gitea_client
 from src.lib.logger import logger
+from src.service.blob import blob_service
+from src.service.teardown import teardown_service
+from src.service.usage import usage_service
 from src.utils.date import now
+from src.utils.readme import image_names, readme_hash, render_readme
+
+TRACKED_FILES = (AGENT_CONFIG_FILE, AGENT_README_FILE)
+EMPTY_SHA = "0" * 40
+VERSION_PATTERN = re.compile(r"^\d+\.\d+\.\d+$")
+
+
+def parse_version(config_yaml: Optional[str]) -> Optional[str]:
+    """Read the semantic version declared in an agent config, if any"""
+    if not config_yaml:
+        return None
+    try:
+        config = yaml.safe_load(config_yaml)
+    except yaml.YAMLError:
+        return None
+    version = str(config.get("version", "")) if isinstance(config, dict) else ""
+    return version if VERSION_PATTERN.match(version) else None
+
+
+def changed_files(commits: Iterable[Dict[str, Any]]) -> Dict[str, bool]:
+    """
+    Map every path touched by the pushed commits to whether it still exists
+    at the head. Commits are oldest first, so later operations win.
+    """
+    files: Dict[str, bool] = {}
+    for commit in commits:
+        for path in commit.get("added") or []:
+            files[path] = True
+        for path in commit.get("modified") or []:
+            files[path] = True
+        for path in commit.get("removed") or []:
+            files[path] = False
+    return files
 
 
 class AgentService:
 
     def __init__(self):
         pass
+
+    async def _read_repo_file(
+        self, owner: str, repo: str, filepath: str, ref: str
+    ) -> Optional[str]:
+        """Fetch and decode a text file from Gitea, None if it does not exist"""
+        contents = await async_gitea_client.get_repo_contents(owner, repo, filepath, ref)
+        if not contents or contents.get("content") is None:
+            return None
+        return base64.b64decode(contents["content"]).decode("utf-8", errors="replace")
+
+    def _agent_id_for_repo(self, db: Session, owner: str, repo: str) -> Optional[str]:
+        """Agents are mirrored from the repository {owner username}/{agent name}"""
+        return (
+            db.query(Agent.agentId)
+            .join(User, User.userId == Agent.adminId)
+            .filter(User.username == owner.lower(), Agent.name == repo)
+            .scalar()
+        )
+
+    def _find_agent_id(self, owner: str, repo: str) -> Optional[str]:
+        db = get_db_session()
+        try:
+            return self._agent_id_for_repo(db, owner, repo)
+        finally:
+            db.close()
+
+    def readme_values(self, db: Session, agent_id: str, readme: str) -> Dict[str, Any]:
+        """Rendered README columns for new README content, empty if unchanged"""
+        images = image_names(
+            [
+                image_key
+                for (image_key,) in db.query(ImageKey.imageKey).filter(
+                    ImageKey.agentId == agent_id
+                )
+            ]
+        )
+        digest = readme_hash(readme, images)
+        current = db.query(Agent.readmeHash).filter(Agent.agentId == agent_id).scalar()
+        if current == digest:
+            return {}
+        return {
+            "readmeHtml": render_readme(readme, agent_id, images),
+            "readmeHash": digest,
+        }
+
+    def _update_agent(self, agent_id: str, values: Dict[str, Any]) -> int:
+        db = get_db_session()
+        try:
+            if "readmeContent" in values:
+                values = {
+                    **values,
+                    **self.readme_values(db, agent_id, values["readmeContent"]),
+                }
+            result = db.query(Agent).filter(Agent.agentId == agent_id).update(values)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _fetch_tracked(
+        self, owner: str, repo: str, paths: Iterable[str], ref: str
+    ) -> Dict[str, Any]:
+        """Fetch the given tracked files and turn them into agent column values"""
+        paths = list(paths)
+        contents = await asyncio.gather(
+            *(self._read_repo_file(owner, repo, path, ref) for path in paths)
+        )
+        return self._tracked_values(dict(zip(paths, contents)))
+
+    def _tracked_values(self, files: Dict[str, Optional[str]]) -> Dict[str, Any]:
+        """Agent column values for tracked files; None means the file is gone"""
+        values: Dict[str, Any] = {}
+        if AGENT_CONFIG_FILE in files:
+            config_yaml = files[AGENT_CONFIG_FILE] or ""
+            values["configYaml"] = config_yaml[:50000]
+            version = parse_version(config_yaml)
+            if version:
+                values["version"] = version
+        if AGENT_README_FILE in files:
+            values["readmeContent"] = (files[AGENT_README_FILE] or "")[:50000]
+        return values
+
+    async def mirror_agent(
+        self, agent_id: str, owner: str, repo: str, ref: str = "main"
+    ) -> Dict[str, Any]:
+        """Copy the tracked files of a repository into its agent row"""
+        values = await self._fetch_tracked(owner, repo, TRACKED_FILES, ref)
+        values["lastMirrored"] = now()
+        await asyncio.to_thread(self._update_agent, agent_id, values)
+        logger.info(f"Mirrored {owner}/{repo}@{ref} into agent {agent_id}")
+
+        return {"agentId": agent_id, "ref": ref, "lastMirrored": values["lastMirrored"]}
+
+    async def update_agent_from_push(
+        self, repo_owner: str, repo_name: str, webhook_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Mirror a push incrementally. Only tracked files touched by the pushed
+        commits are fetched, at the pushed head, and everything is written in
+        a single UPDATE. Pushes that touch no tracked file never reach Gitea.
+        """
+        repository = webhook_data.get("repository") or {}
+        default_branch = repository.get("default_branch") or "main"
+        ref = webhook_data.get("ref", "")
+        head = webhook_data.get("after") or ""
+
+        if ref != f"refs/heads/{default_branch}" or head in ("", EMPTY_SHA):
+            logger.info(f"Ignoring push to {ref} of {repo_owner}/{repo_name}")
+            return {"mirrored": False, "fetched": 0}
+
+        agent_id = await asyncio.to_thread(self._find_agent_id, repo_owner, repo_name)
+        if not agent_id:
+            logger.warning(f"No agent for pushed repository {repo_owner}/{repo_name}")
+            return {"mirrored": False, "fetched": 0}
+
+        commits = webhook_data.get("commits") or []
+        total_commits = webhook_data.get("total_commits", len(commits))
+        if not commits or total_commits > len(commits):
+            # the payload does not list every change, so assume all were touched
+            touched = {path: True for path in TRACKED_FILES}
+        else:
+            files = changed_files(commits)
+            touched = {path: files[path] for path in TRACKED_FILES if path in files}
+
+        values: Dict[str, Any] = {"lastMirrored": now()}
+        to_fetch = [path for path, exists in touched.items() if exists]
+        values.update(
+            self._tracked_values(
+                {path: None for path, exists in touched.items() if not exists}
+            )
+        )
+        if to_fetch:
+            values.update(await self._fetch_tracked(repo_owner, repo_name, to_fetch, head))
+
+        await asyncio.to_thread(self._update_agent, agent_id, values)
+        logger.info(
+            f"Mirrored push {head[:8]} of {repo_owner}/{repo_name}: "
+            f"{len(touched)} tracked file(s) changed, {len(to_fetch)} fetched"
+        )
+        return {"mirrored": True, "agentId": agent_id, "fetched": len(to_fetch)}
+
+    def _delete_agent(self, owner: str, repo: str) -> bool:
+        db = get_db_session()
+        try:
+            agent_id = self._agent_id_for_repo(db, owner, repo)
+            if not agent_id:
+                return False
+            # forks of other agents point at this one without cascading
+            db.query(Fork).filter(Fork.forkedAgentId == agent_id).delete()
+            blob_service.release_agents(db, [agent_id])
+            usage_service.remove_agent(db, agent_id)
+            db.query(Agent).filter(Agent.agentId == agent_id).delete()
+            teardown_service.enqueue(db, [teardown_service.agent_prefix(agent_id)])
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def delete_agent_mirror(self, repo_owner: str, repo_name: str) -> bool:
+        """Remove the agent mirrored from a repository that was deleted on Gitea"""
+        deleted = await asyncio.to_thread(self._delete_agent, repo_owner, repo_name)
+        if deleted:
+            logger.info(f"Deleted agent mirror of {repo_owner}/{repo_name}")
+        return deleted
+
+
+agent_service = AgentService()
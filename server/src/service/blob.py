@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from fastapi import UploadFile
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.objects.index import Blob, ImageKey, Job, JobSchema
+from src.constants.index import AGENT_IMAGE_TYPES
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.logger import logger
+from src.lib.s3 import blob_key, parse_blob_key, s3_client
+from src.service.job import job_service
+from src.utils.date import now, from_now
+from src.utils.image import derivative_prefix
+
+BLOB_GC_JOB = "blob_gc"
+GC_BATCH_SIZE = 100  # blobs per batch, each with a handful of variants
+DELETE_BATCH_SIZE = 1000  # the most DeleteObjects accepts
+# advisory lock space of blob hashes, apart from the single-key locks
+BLOB_LOCK_SPACE = 43
+
+# uploads are streamed here while they are hashed, then copied to their blob
+STAGING_PREFIX = "uploads/"
+
+# the bytes behind a blob key never change
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class BlobService:
+    """
+    Content-addressed storage for uploaded bytes.
+
+    A blob lives at `blobs/{hash[:2]}/{hash}{ext}`, keyed by the SHA-256 of
+    its bytes, so an image uploaded twice or copied into a fork is stored
+    and cached once. `refCount` counts the image_keys rows pointing at a
+    blob and changes in the same transaction as those rows. Blobs that stay
+    unreferenced for `blob_gc_grace` seconds are collected in batches.
+    """
+
+    def __init__(self):
+        job_service.register(BLOB_GC_JOB, self.run_gc_job)
+
+    def key(self, digest: str, content_type: str) -> str:
+        return blob_key(digest, AGENT_IMAGE_TYPES.get(content_type, ""))
+
+    def _lock_hash(self, db: Session, digest: str, shared: bool):
+        lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+        db.execute(select(lock(BLOB_LOCK_SPACE, func.hashtext(digest))))
+
+    def find(self, db: Session, digest: str) -> Optional[Blob]:
+        """The blob with this hash, locked until the caller's transaction ends
+        so it cannot be collected before the caller references it"""
+        # also held while there is no row yet: the collector waits for it
+        # before deleting objects, so it never deletes bytes being uploaded
+        self._lock_hash(db, digest, shared=True)
+        # FOR KEY SHARE blocks the collector's FOR UPDATE, but not the
+        # refCount updates of other uploads of the same bytes
+        return (
+            db.query(Blob)
+            .filter(Blob.blobHash == digest)
+            .with_for_update(read=True, key_share=True)
+            .first()
+        )
+
+    def register(
+        self, db: Session, digest: str, size: int, content_type: str
+    ) -> Blob:
+        """Record a blob whose bytes are in S3, in the caller's transaction"""
+        db.execute(
+            insert(Blob)
+            .values(
+                blobHash=digest,
+                blobKey=self.key(digest, content_type),
+                size=size,
+                contentType=content_type,
+                refCount=0,
+                created=now(),
+                updated=now(),
+            )
+            .on_conflict_do_nothing(index_elements=["blobHash"])
+        )
+        return self.find(db, digest)
+
+    async def stage(
+        self,
+        stream: Union[UploadFile, AsyncIterator[bytes]],
+        content_type: str,
+        max_bytes: int,
+    ) -> Tuple[str, str, int]:
+        """Stream an upload to a temporary key, hashing it on the way, so it is
+        never held in memory. Returns the key, the hash and the size. Pass the
+        key to `discard` once done with it."""
+        staged_key = f"{STAGING_PREFIX}{uuid.uuid4().hex}"
+        hasher = hashlib.sha256()
+        size = 0
+
+        def consume(chunk: bytes):
+            nonlocal size
+            hasher.update(chunk)
+            size += len(chunk)
+
+        await s3_client.upload_stream(
+            stream, staged_key, content_type, max_bytes, on_chunk=consume
+        )
+        return staged_key, hasher.hexdigest(), size
+
+    async def store_staged(
+        self, db: Session, staged_key: str, digest: str, size: int, content_type: str
+    ) -> Tuple[Blob, bool]:
+        """Store a staged upload as a blob, unless a blob with the same hash
+        exists. Returns the blob and whether its bytes were new."""
+        blob = self.find(db, digest)
+        if blob:
+            logger.info(f"Blob {digest[:12]} already stored, skipped copy")
+            return blob, False
+
+        await asyncio.to_thread(
+            s3_client.copy_object,
+            staged_key,
+            self.key(digest, content_type),
+            content_type,
+            BLOB_CACHE_CONTROL,
+        )
+        return self.register(db, digest, size, content_type), True
+
+    def discard(self, staged_key: str):
+        s3_client.delete_file(staged_key)
+
+    def acquire(self, db: Session, digest: str, count: int = 1):
+        """Count new references to a blob, in the caller's transaction"""
+        db.query(Blob).filter(Blob.blobHash == digest).update(
+            {"refCount": Blob.refCount + count, "updated": now()},
+            synchronize_session=False,
+        )
+
+    def release_agents(self, db: Session, agent_ids: List[str]):
+        """Drop the references of agents about to be deleted. Their image_keys
+        rows go with the agents by cascade, so call this first."""
+        if not agent_ids:
+            return
+        counts = (
+            db.query(ImageKey.blobHash, func.count(ImageKey.imageKeyId))
+            .filter(ImageKey.agentId.in_(agent_ids), ImageKey.blobHash.isnot(None))
+            .group_by(ImageKey.blobHash)
+            .all()
+        )
+        for digest, count in counts:
+            db.query(Blob).filter(Blob.blobHash == digest).update(
+                {"refCount": func.greatest(Blob.refCount - count, 0), "updated": now()},
+                synchronize_session=False,
+            )
+
+    def _enqueue_gc(self):
+        db = get_db_session()
+        try:
+            job_service.enqueue_once(
+                db, BLOB_GC_JOB, {}, include_running=True, max_attempts=10
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def schedule_gc(self):
+        await asyncio.to_thread(self._enqueue_gc)
+
+    def _claim_garbage(
+        self, job_id: str, progress: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Delete a batch of unreferenced blob rows and, in the same transaction,
+        checkpoint their keys as pending. Rows go first: once they are gone
+        no upload can deduplicate against bytes that are about to be deleted,
+        and a crash leaves the keys in the checkpoint rather than leaking them.
+        """
+        db = get_db_session()
+        try:
+            # the counter is the fast filter, the reference check the safe one
+            referenced = (
+                db.query(ImageKey.imageKeyId)
+                .filter(ImageKey.blobHash == Blob.blobHash)
+                .exists()
+            )
+            blobs = (
+                db.query(Blob)
+                .filter(
+                    Blob.refCount <= 0,
+                    Blob.updated < from_now(-settings.blob_gc_grace),
+                    ~referenced,
+                )
+                .order_by(Blob.updated)
+                .limit(GC_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not blobs:
+                db.rollback()
+                return None
+
+            db.query(Blob).filter(
+                Blob.blobHash.in_([blob.blobHash for blob in blobs])
+            ).delete(synchronize_session=False)
+            progress = {
+                **progress,
+                "pending": [blob.blobKey for blob in blobs],
+                "blobs": progress["blobs"] + len(blobs),
+            }
+            db.query(Job).filter(Job.jobId == job_id).update(
+                {
+                    "checkpoint": progress,
+                    "leaseExpires": from_now(settings.job_lease_seconds),
+                }
+            )
+            db.commit()
+            return progress
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _lock_unregistered(self, db: Session, blob_keys: List[str]) -> List[str]:
+        """Lock the hashes of pending keys against uploads and return the keys
+        that still have no row. The others were uploaded again since they
+        were claimed, and their objects belong to the new row."""
+        keys = []
+        for key in sorted(blob_keys):
+            digest = parse_blob_key(key)
+            if digest:
+                self._lock_hash(db, digest, shared=False)
+                if db.query(Blob.blobHash).filter(Blob.blobHash == digest).first():
+                    continue
+            keys.append(key)
+        skipped = len(blob_keys) - len(keys)
+        if skipped:
+            logger.info(f"Kept {skipped} blob(s) uploaded again before collection")
+        return keys
+
+    async def _delete_pending(self, blob_keys: List[str]) -> Tuple[int, List[str]]:
+        """Delete pending blobs whose hashes were not registered again, holding
+        their locks so no upload of the same bytes can start meanwhile"""
+        db = get_db_session()
+        try:
+            keys = await asyncio.to_thread(self._lock_unregistered, db, blob_keys)
+            result = await self._delete_objects(keys) if keys else (0, [])
+            # ends the transaction, letting waiting uploads go ahead
+            await asyncio.to_thread(db.rollback)
+            return result
+        finally:
+            db.close()
+
+    async def _delete_objects(self, blob_keys: List[str]) -> Tuple[int, List[str]]:
+        """Delete blobs and their variants. Returns the number of objects
+        deleted and the blob keys that still have objects left."""
+        slots = asyncio.Semaphore(settings.s3_teardown_concurrency)
+
+        async def list_variants(key: str) -> List[str]:
+            async with slots:
+                return await asyncio.to_thread(
+                    s3_client.list_keys, derivative_prefix(key)
+                )
+
+        variants = await asyncio.gather(*(list_variants(key) for key in blob_keys))
+        owner = {key: key for key in blob_keys}
+        for key, derived in zip(blob_keys, variants):
+            owner.update((derived_key, key) for derived_key in derived)
+
+        keys = list(owner)
+        batches = [
+            keys[i : i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(
+            *(asyncio.to_thread(s3_client.delete_keys, batch) for batch in batches)
+        )
+        failed = [key for result in results for key in result]
+        return len(keys) - len(failed), sorted({owner[key] for key in failed})
+
+    async def run_gc_job(self, job: JobSchema) -> Dict[str, Any]:
+        progress = dict(
+            job.checkpoint or {"pending": [], "blobs": 0, "objects": 0}
+        )
+        while True:
+            if progress["pending"]:
+                deleted, failed = await self._delete_pending(progress["pending"])
+                progress["objects"] += deleted
+                progress["pending"] = failed
+                await asyncio.to_thread(job_service.save_checkpoint, job.jobId, progress)
+                if failed:
+                    # the rows are gone, so only the checkpoint can retry them
+                    raise RuntimeError(f"Failed to delete {len(failed)} blob(s) from S3")
+
+            claimed = await asyncio.to_thread(self._claim_garbage, job.jobId, progress)
+            if not claimed:
+                break
+            progress = claimed
+
+        if progress["blobs"]:
+            logger.info(
+                f"Collected {progress['blobs']} unreferenced blob(s), "
+                f"{progress['objects']} object(s)"
+            )
+        return progress
+
+
+blob_service = BlobService()
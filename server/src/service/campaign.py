@@ -0,0 +1,157 @@
+import asyncio
+import uuid
+from string import Template
+from typing import Any, Dict, List, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.objects.index import EmailOutbox, Job, JobSchema, User
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.logger import logger
+from src.service.email import WEEKLY_UPDATE_BODY, WEEKLY_UPDATE_SUBJECT, first_name
+from src.service.job import job_service
+from src.utils.date import now, from_now
+
+CAMPAIGN_JOB = "email_campaign"
+
+# campaign name -> (subject, precompiled plain text body)
+CAMPAIGNS: Dict[str, Tuple[str, Template]] = {
+    "weekly_update": (WEEKLY_UPDATE_SUBJECT, WEEKLY_UPDATE_BODY),
+}
+
+
+class CampaignService:
+    """
+    Fans a campaign out to every user through the email outbox.
+
+    Users are streamed in userId order from a server-side cursor, so the
+    table is never loaded at once. Every chunk of outbox rows is inserted in
+    the same transaction as the job checkpoint recording the last userId
+    queued, so a crashed run resumes after it and nobody is queued twice.
+    The email worker then sends the rows at its usual rate.
+    """
+
+    def __init__(self):
+        job_service.register(CAMPAIGN_JOB, self.run_campaign_job)
+
+    def start(self, db: Session, campaign: str) -> Job:
+        """Queue a run of a campaign in the caller's transaction"""
+        if campaign not in CAMPAIGNS:
+            raise ValueError(f"Unknown campaign: {campaign}")
+        return job_service.enqueue(
+            db,
+            CAMPAIGN_JOB,
+            {"campaign": campaign, "campaignId": str(uuid.uuid4())},
+            max_attempts=5,
+        )
+
+    def _queue_chunk(
+        self, job_id: str, campaign_id: str, rows: List[Dict[str, Any]], progress: Dict[str, Any]
+    ):
+        db = get_db_session()
+        try:
+            db.execute(
+                insert(EmailOutbox)
+                .values(rows)
+                .on_conflict_do_nothing(constraint="unique_campaign_recipient")
+            )
+            db.query(Job).filter(Job.jobId == job_id).update(
+                {
+                    "checkpoint": progress,
+                    "leaseExpires": from_now(settings.job_lease_seconds),
+                }
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _fan_out(self, job: JobSchema) -> Dict[str, Any]:
+        subject, body = CAMPAIGNS[job.payload["campaign"]]
+        campaign_id = job.payload["campaignId"]
+        chunk_size = settings.email_campaign_chunk_size
+        progress = dict(job.checkpoint or {"afterUserId": None, "queued": 0})
+        if progress["afterUserId"]:
+            logger.info(f"Resuming campaign {campaign_id} after {progress['afterUserId']}")
+
+        db = get_db_session()
+        try:
+            users = db.query(User.userId, User.email, User.username, User.fullName)
+            if progress["afterUserId"]:
+                users = users.filter(User.userId > progress["afterUserId"])
+
+            rows: List[Dict[str, Any]] = []
+            timestamp = now()
+            for user_id, email, username, full_name in users.order_by(
+                User.userId
+            ).yield_per(chunk_size):
+                name = full_name or username
+                rows.append(
+                    {
+                        "outboxId": str(uuid.uuid4()),
+                        "recipient": email,
+                        "recipientName": name,
+                        "subject": subject,
+                        "body": body.safe_substitute(name=first_name(name)),
+                        "bodyType": "plain",
+                        "campaignId": campaign_id,
+                        "status": "pending",
+                        "attempts": 0,
+                        "nextAttemptAt": timestamp,
+                        "created": timestamp,
+                        "updated": timestamp,
+                    }
+                )
+                if len(rows) >= chunk_size:
+                    progress = {
+                        "afterUserId": user_id,
+                        "queued": progress["queued"] + len(rows),
+                    }
+                    self._queue_chunk(job.jobId, campaign_id, rows, progress)
+                    rows = []
+                    timestamp = now()
+
+            if rows:
+                progress = {
+                    "afterUserId": user_id,
+                    "queued": progress["queued"] + len(rows),
+                }
+                self._queue_chunk(job.jobId, campaign_id, rows, progress)
+        finally:
+            db.close()
+
+        logger.info(f"Campaign {campaign_id} queued {progress['queued']} email(s)")
+        return {"campaignId": campaign_id, **progress}
+
+    async def run_campaign_job(self, job: JobSchema) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._fan_out, job)
+
+    def _start(self, campaign: str):
+        db = get_db_session()
+        try:
+            self.start(db, campaign)
+            db.commit()
+        finally:
+            db.close()
+
+    async def run_now(self, campaign: str) -> bool:
+        """Queue a campaign and run it inline, with any unfinished earlier run,
+        even one waiting to be retried. Returns False if a worker claimed it
+        first."""
+        await asyncio.to_thread(self._start, campaign)
+        ran = False
+        while True:
+            job = await asyncio.to_thread(
+                job_service.claim_next, [CAMPAIGN_JOB], include_scheduled=True
+            )
+            if not job:
+                if not ran:
+                    logger.info(f"Campaign {campaign} was picked up by a worker")
+                return ran
+            await job_service.run(job)
+            ran = True
+
+
+campaign_service = CampaignService()
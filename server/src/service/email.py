@@ -1,12 +1,65 @@
+import asyncio
+import html
+import uuid
+from string import Template
+from typing import Any, Dict, List, Optional
+import aiosmtplib
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from src.objects.index import EmailOutbox, EmailOutboxSchema
+from src.db.pg import get_db_session
 from src.lib.logger import logger
+from src.lib.smtp import AsyncSMTPPool, SMTPPool
+from src.lib.worker import RateLimiter, backoff_delay
 from src.core.config import settings
-import smtplib
+from src.utils.date import now, from_now
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
 
 
+# compiled once, rendered per recipient here and by CampaignService
+WEEKLY_UPDATE_SUBJECT = "Modaic Weekly Update"
+WEEKLY_UPDATE_BODY = Template(
+    """\
+Hey ${name},
+
+Here’s what’s new this week:
+- Bug fixes
+- Performance improvements
+- New features coming soon!
+
+Thank you for being part of Modaic.
+
+Cheers,
+The Modaic Team"""
+)
+
+
+def first_name(name: str) -> str:
+    return name.split()[0] if name.strip() else name
+
+
+def _permanent(error: Exception) -> bool:
+    """Whether the server rejected the message itself, so a retry cannot help"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= refused.code < 600 for refused in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPDataError):
+        return 500 <= error.code < 600
+    return False
+
+
 class EmailService:
+    """
+    Emails are not sent by the request that triggers them. `enqueue` adds a
+    row to `email_outbox` in the caller's transaction, so an email goes out
+    if and only if the change that triggered it commits. Workers claim
+    batches with `SELECT ... FOR UPDATE SKIP LOCKED`, send each batch over one
+    pooled connection, and retry failures with backoff until
+    `email_max_attempts`. Each of the `email_worker_replicas` processes sends
+    at most its share of `email_rate_per_second`.
+    """
+
     def __init__(self):
         self.support_email = "support@modaic.dev"
         self.personal_email = "farouk@modaic.dev"
@@ -14,54 +67,278 @@ class EmailService:
         self.smtp_server = "smtp.gmail.com"
         self.smtp_port = 587
 
-    def send_email(
+        # authenticated connections are kept open and reused across sends
+        pool_options = dict(
+            host=self.smtp_server,
+            port=self.smtp_port,
+            username=self.sender_email,
+            password=settings.gmail_app_password,
+            size=settings.smtp_pool_size,
+            max_messages=settings.smtp_max_messages,
+            max_lifetime=settings.smtp_max_lifetime,
+        )
+        self.pool = SMTPPool(**pool_options)
+        self.async_pool = AsyncSMTPPool(**pool_options)
+        # every replica running email workers takes an equal share of the
+        # provider's limit
+        rate = settings.email_rate_per_second / max(1, settings.email_worker_replicas)
+        self.limiter = RateLimiter(rate, burst=max(1, int(rate)))
+
+    def _plain_message(
         self, recipient_email: str, recipient_name: str, subject: str, body: str
-    ):
-        """
-        Sends an email using the configured SMTP server. Defaults to the personal email of the sender.
-        """
-
+    ) -> str:
         msg = MIMEMultipart()
         msg["From"] = formataddr(("Modaic", self.sender_email))
         msg["To"] = recipient_email
         msg["Subject"] = subject
 
-        body = body.format(name=recipient_name.split()[0])
         msg.attach(MIMEText(body, "plain"))
+        return msg.as_string()
 
-        with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-            server.starttls()
-            server.login(self.sender_email, settings.gmail_app_password)
-            server.sendmail(self.sender_email, recipient_email, msg.as_string())
+    def _html_message(self, recipient_email: str, subject: str, html_body: str) -> str:
+        msg = MIMEMultipart("alternative")
+        msg["From"] = formataddr(("Modaic", self.sender_email))
+        msg["To"] = recipient_email
+        msg["Subject"] = subject
+
+        msg.attach(MIMEText(html_body, "html"))
+        return msg.as_string()
 
+    def send_email(
+        self, recipient_email: str, recipient_name: str, subject: str, body: str
+    ):
+        """
+        Sends an email using the configured SMTP server. Defaults to the personal email of the sender.
+        """
+        body = body.format(name=first_name(recipient_name))
+        message = self._plain_message(recipient_email, recipient_name, subject, body)
+        self.pool.send(self.sender_email, [recipient_email], message)
         logger.info(f"Email sent to {recipient_name} <{recipient_email}>")
 
     def send_email_html(self, recipient_email: str, subject: str, html_body: str):
         """
         Sends an HTML email using the configured SMTP server.
         """
-        msg = MIMEMultipart("alternative")
-        msg["From"] = formataddr(("Modaic", self.sender_email))
-        msg["To"] = recipient_email
-        msg["Subject"] = subject
-
-        msg.attach(MIMEText(html_body, "html"))
+        message = self._html_message(recipient_email, subject, html_body)
+        self.pool.send(self.sender_email, [recipient_email], message)
+        logger.info(f"HTML email sent to <{recipient_email}>")
 
-        with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-            server.starttls()
-            server.login(self.sender_email, settings.gmail_app_password)
-            server.sendmail(self.sender_email, recipient_email, msg.as_string())
+    async def send_email_async(
+        self, recipient_email: str, recipient_name: str, subject: str, body: str
+    ):
+        """
+        Like send_email, without blocking a thread.
+        """
+        body = body.format(name=first_name(recipient_name))
+        message = self._plain_message(recipient_email, recipient_name, subject, body)
+        await self.async_pool.send(self.sender_email, [recipient_email], message)
+        logger.info(f"Email sent to {recipient_name} <{recipient_email}>")
 
+    async def send_email_html_async(
+        self, recipient_email: str, subject: str, html_body: str
+    ):
+        """
+        Like send_email_html, without blocking a thread.
+        """
+        message = self._html_message(recipient_email, subject, html_body)
+        await self.async_pool.send(self.sender_email, [recipient_email], message)
         logger.info(f"HTML email sent to <{recipient_email}>")
 
-    def account_creation(self, recipient_email: str, recipient_name: str):
+    def enqueue(
+        self,
+        db: Session,
+        recipient_email: str,
+        subject: str,
+        body: str,
+        body_type: str = "plain",
+        recipient_name: Optional[str] = None,
+    ) -> EmailOutbox:
+        """Add an email to the outbox. The caller commits, so it is only sent
+        once the change that triggered it is."""
+        email = EmailOutbox(
+            outboxId=str(uuid.uuid4()),
+            recipient=recipient_email,
+            recipientName=recipient_name,
+            subject=subject,
+            body=body,
+            bodyType=body_type,
+            status="pending",
+            attempts=0,
+            nextAttemptAt=now(),
+        )
+        db.add(email)
+        return email
+
+    def claim_batch(self) -> Optional[List[EmailOutboxSchema]]:
+        """Claim up to `email_batch_size` due emails, oldest first"""
+        db = get_db_session()
+        try:
+            timestamp = now()
+            batch = (
+                db.query(EmailOutbox)
+                .filter(
+                    or_(
+                        and_(
+                            EmailOutbox.status == "pending",
+                            EmailOutbox.nextAttemptAt <= timestamp,
+                        ),
+                        # a worker died while sending it
+                        and_(
+                            EmailOutbox.status == "sending",
+                            EmailOutbox.leaseExpires <= timestamp,
+                        ),
+                    )
+                )
+                .order_by(EmailOutbox.nextAttemptAt)
+                .limit(settings.email_batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not batch:
+                db.rollback()
+                return None
+
+            lease = from_now(settings.job_lease_seconds)
+            claimed = []
+            for email in batch:
+                if email.attempts >= settings.email_max_attempts:
+                    # its workers kept dying before recording an outcome
+                    logger.error(f"Email {email.outboxId} dead after {email.attempts} attempt(s)")
+                    email.status = "dead"
+                    email.lastError = "Lease expired on every attempt"
+                    email.leaseExpires = None
+                    continue
+                email.status = "sending"
+                email.attempts += 1
+                email.leaseExpires = lease
+                claimed.append(EmailOutboxSchema.model_validate(email))
+            db.commit()
+            return claimed or None
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _update(self, outbox_ids: List[str], values: Dict[str, Any]):
+        db = get_db_session()
+        try:
+            db.query(EmailOutbox).filter(EmailOutbox.outboxId.in_(outbox_ids)).update(
+                values, synchronize_session=False
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def mark_sent(self, outbox_ids: List[str]):
+        self._update(
+            outbox_ids,
+            {"status": "sent", "sentAt": now(), "lastError": None, "leaseExpires": None},
+        )
+
+    def mark_failed(self, email: EmailOutboxSchema, error: str, permanent: bool):
+        if permanent or email.attempts >= settings.email_max_attempts:
+            logger.error(f"Email {email.outboxId} dead after {email.attempts} attempt(s)")
+            values = {"status": "dead"}
+        else:
+            values = {
+                "status": "pending",
+                "nextAttemptAt": from_now(backoff_delay(email.attempts)),
+            }
+        values.update({"lastError": error[:2000], "leaseExpires": None})
+        self._update([email.outboxId], values)
+
+    def release(self, outbox_ids: List[str]):
+        """Put back emails that were claimed but never attempted"""
+        self._update(
+            outbox_ids,
+            {
+                "status": "pending",
+                "attempts": EmailOutbox.attempts - 1,
+                "leaseExpires": None,
+            },
+        )
+
+    def _render(self, email: EmailOutboxSchema) -> str:
+        # outbox bodies are final text, never formatted again
+        if email.bodyType == "html":
+            return self._html_message(email.recipient, email.subject, email.body)
+        return self._plain_message(
+            email.recipient, email.recipientName or email.recipient, email.subject, email.body
+        )
+
+    async def process(self, batch: List[EmailOutboxSchema]):
+        """Send a claimed batch over one pooled connection and record the outcome"""
+        ready, messages = [], []
+        for email in batch:
+            try:
+                messages.append(([email.recipient], self._render(email)))
+                ready.append(email)
+            except Exception as e:
+                # it will never render, so don't let it hold up the batch
+                logger.error(f"Failed to render email {email.outboxId}: {str(e)}")
+                await asyncio.to_thread(self.mark_failed, email, str(e), True)
+        if not ready:
+            return
+
+        results = await self.async_pool.send_many(
+            self.sender_email, messages, before_each=self.limiter.acquire
+        )
+
+        sent = [email.outboxId for email, error in zip(ready, results) if error is None]
+        if sent:
+            await asyncio.to_thread(self.mark_sent, sent)
+        for email, error in zip(ready, results):
+            if error is None:
+                continue
+            logger.error(f"Failed to send email {email.outboxId}: {error}")
+            code = getattr(error, "code", None)
+            if code in (421, 450, 451, 452, 454):
+                # the provider is pushing back, slow every worker down
+                self.limiter.pause(backoff_delay(1))
+            await asyncio.to_thread(self.mark_failed, email, str(error), _permanent(error))
+
+        unsent = [email.outboxId for email in ready[len(results) :]]
+        if unsent:
+            await asyncio.to_thread(self.release, unsent)
+        logger.info(f"Sent {len(sent)} of {len(batch)} email(s) from the outbox")
+
+    def purge_sent(self) -> int:
+        """Drop sent emails past retention. Dead ones are kept for inspection."""
+        db = get_db_session()
+        try:
+            cutoff = from_now(-settings.email_retention_days * 24 * 60 * 60)
+            deleted = (
+                db.query(EmailOutbox)
+                .filter(EmailOutbox.status == "sent", EmailOutbox.created < cutoff)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            if deleted:
+                logger.info(f"Purged {deleted} sent emails from the outbox")
+            return deleted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def schedule_purge(self):
+        await asyncio.to_thread(self.purge_sent)
+
+    def account_creation(
+        self, db: Session, recipient_email: str, recipient_name: str
+    ):
         """
-        Sends an account creation email to the user.
+        Queues an account creation email to the user.
         """
 
         subject = "Welcome to Modaic!"
         body = f"""\
-Hey {recipient_name.split()[0]},
+Hey {first_name(recipient_name)},
 
 Thanks for signing up for Modaic! We're excited to have you on board.
 
@@ -70,15 +347,19 @@ If you have any questions or need assistance, feel free to reach out to us at {s
 Best,
 The Modaic Team"""
 
-        self.send_email(recipient_email, recipient_name, subject, body)
+        return self.enqueue(
+            db, recipient_email, subject, body, recipient_name=recipient_name
+        )
 
-    def user_upgraded_to_pro(self, recipient_email: str, recipient_name: str):
+    def user_upgraded_to_pro(
+        self, db: Session, recipient_email: str, recipient_name: str
+    ):
         """
-        Sends an email to the user when they upgrade to Pro.
+        Queues an email to the user when they upgrade to Pro.
         """
         subject = "You've Upgraded to Modaic Pro!"
         body = f"""\
-Hey {recipient_name.split()[0]},
+Hey {first_name(recipient_name)},
 
 Congratulations! Your account has been upgraded to Modaic Pro. Enjoy all the new features and enhanced capabilities.
 
@@ -87,10 +368,13 @@ If you have any questions, reach out to us at {self.support_email}.
 Best,
 The Modaic Team"""
 
-        self.send_email(recipient_email, recipient_name, subject, body)
+        return self.enqueue(
+            db, recipient_email, subject, body, recipient_name=recipient_name
+        )
 
     def user_invited_to_repo(
         self,
+        db: Session,
         recipient_email: str,
         recipient_name: str,
         repo_name: str,
@@ -98,83 +382,80 @@ The Modaic Team"""
         sender_name: str,
     ):
         """
-        Sends an HTML email to the user when they are invited to a repo, including the invitation link.
+        Queues an HTML email to the user when they are invited to a repo, including the invitation link.
         """
         subject = f"You've Been Invited to Join '{repo_name}' on Modaic!"
+        # names are user controlled, never let them into the markup
         html_body = f"""\
         <html>
           <body>
-            <p>Hey {recipient_name.split()[0]},</p>
-            <p>You've been invited to join the repository '<b>{repo_name}</b>' on Modaic by <b>{sender_name}</b>! Start syncing memories with ease.<br>
+            <p>Hey {html.escape(first_name(recipient_name))},</p>
+            <p>You've been invited to join the repository '<b>{html.escape(repo_name)}</b>' on Modaic by <b>{html.escape(sender_name)}</b>! Start syncing memories with ease.<br>
             Click the invitation link below to get started:</p>
-            <p><a href="{repo_link}?src=invite">Accept the Invite.</a></p>
+            <p><a href="{html.escape(repo_link)}?src=invite">Accept the Invite.</a></p>
             <p>If you have any questions, let us know at {self.support_email}.</p>
             <p>Cheers,<br>The Modaic Team</p>
           </body>
         </html>
         """
-        self.send_email_html(recipient_email, subject, html_body)
+        return self.enqueue(db, recipient_email, subject, html_body, body_type="html")
 
     def non_existing_user_invited_to_repo(
         self,
+        db: Session,
         recipient_email: str,
         repo_name: str,
         repo_link: str,
         sender_name: str,
     ):
         """
-        Sends an HTML email to the user when they are invited to a repo, including the invitation link.
+        Queues an HTML email to the user when they are invited to a repo, including the invitation link.
         """
         subject = f"You've Been Invited to Join '{repo_name}' on Modaic!"
         html_body = f"""\
         <html>
           <body>
             <p>Hey there,</p>
-            <p>You've been invited to join the repo '<b>{repo_name}</b>' on Modaic by <b>{sender_name}</b>! Start syncing memories with ease.<br>
+            <p>You've been invited to join the repo '<b>{html.escape(repo_name)}</b>' on Modaic by <b>{html.escape(sender_name)}</b>! Start syncing memories with ease.<br>
             Click the invitation link below to get started:</p>
             <p>Create an account <a href="{settings.next_url}/auth">here</a></p>
-            <p>Accept the invite <a href="{repo_link}?src=newuserinvite">here</a></p>
+            <p>Accept the invite <a href="{html.escape(repo_link)}?src=newuserinvite">here</a></p>
             <p>If you have any questions, let us know at {self.support_email}.</p>
             <p>Cheers,<br>The Modaic Team</p>
           </body>
         </html>
         """
-        self.send_email_html(recipient_email, subject, html_body)
+        return self.enqueue(db, recipient_email, subject, html_body, body_type="html")
 
-    def onboarding_message(self, recipient_email: str, recipient_name: str):
+    def onboarding_message(
+        self, db: Session, recipient_email: str, recipient_name: str
+    ):
         """
-        Sends a personalized onboarding message.
+        Queues a personalized onboarding message.
         """
         subject = "Welcome to Modaic!"
         body = f"""\
-Welcome to Modaic, {recipient_name.split()[0]}!
+Welcome to Modaic, {first_name(recipient_name)}!
 
 We're excited to have you on board. Let us know if you need any help getting started.
 
 Best,
 The Modaic Team"""
 
-        self.send_email(recipient_email, recipient_name, subject, body)
+        return self.enqueue(
+            db, recipient_email, subject, body, recipient_name=recipient_name
+        )
 
-    def weekly_update(self, recipient_email: str, recipient_name: str):
+    def weekly_update(
+        self, db: Session, recipient_email: str, recipient_name: str
+    ):
         """
-        Sends a weekly update email with bug fixes and improvements.
+        Queues a weekly update email with bug fixes and improvements.
         """
-        subject = "Modaic Weekly Update"
-        body = f"""\
-Hey {recipient_name.split()[0]},
-
-Here’s what’s new this week:
-- Bug fixes
-- Performance improvements
-- New features coming soon!
-
-Thank you for being part of Modaic.
-
-Cheers,
-The Modaic Team"""
-
-        self.send_email(recipient_email, recipient_name, subject, body)
+        body = WEEKLY_UPDATE_BODY.substitute(name=first_name(recipient_name))
+        return self.enqueue(
+            db, recipient_email, WEEKLY_UPDATE_SUBJECT, body, recipient_name=recipient_name
+        )
 
 
 email_service = EmailService()
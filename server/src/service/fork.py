@@ -0,0 +1,176 @@
+import asyncio
+import uuid
+from typing import Any, Dict, Tuple
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from src.objects.index import (
+    Agent,
+    AgentTag,
+    Fork,
+    Job,
+    JobSchema,
+    User,
+    UserSchema,
+)
+from src.db.pg import get_db_session
+from src.lib.gittea import async_gitea_client
+from src.lib.logger import logger
+from src.service.agent import agent_service
+from src.service.blob import blob_service
+from src.service.image import image_service
+from src.service.job import job_service
+from src.service.similarity import similarity_service
+from src.service.usage import usage_service
+
+FORK_JOB = "fork"
+
+
+class ForkService:
+    """
+    Forks run in two phases. The request creates the Fork and a placeholder
+    Agent row and queues a job; a worker then copies the repository on Gitea
+    and mirrors its metadata into the placeholder.
+    """
+
+    def __init__(self):
+        job_service.register(FORK_JOB, self.run_fork_job, on_failure=self.abandon_fork)
+
+    def create_fork(
+        self, db: Session, source: Agent, user: UserSchema
+    ) -> Tuple[Fork, Job]:
+        """Create the Fork, its placeholder Agent and the fork job in one transaction"""
+        if source.adminId == user.userId:
+            raise HTTPException(status_code=400, detail="You cannot fork your own agent")
+
+        existing_fork = (
+            db.query(Fork)
+            .filter(Fork.userId == user.userId, Fork.agentId == source.agentId)
+            .first()
+        )
+        if existing_fork:
+            raise HTTPException(status_code=409, detail="Agent already forked")
+
+        name_collision = (
+            db.query(Agent)
+            .filter(Agent.adminId == user.userId, Agent.name == source.name)
+            .first()
+        )
+        if name_collision:
+            raise HTTPException(
+                status_code=409, detail="You already have an agent with this name"
+            )
+
+        source_owner = db.query(User).filter(User.userId == source.adminId).first()
+
+        forked_agent = Agent(
+            agentId=str(uuid.uuid4()),
+            name=source.name,
+            description=source.description,
+            adminId=user.userId,
+            version=source.version,
+            visibility=source.visibility,
+        )
+        db.add(forked_agent)
+        db.flush()
+
+        for tag in source.tags:
+            db.add(AgentTag(tagId=str(uuid.uuid4()), agentId=forked_agent.agentId, tag=tag))
+        # images are content-addressed, a fork only adds references
+        image_service.copy_images(db, source.agentId, forked_agent.agentId)
+
+        fork = Fork(
+            forkId=str(uuid.uuid4()),
+            userId=user.userId,
+            agentId=source.agentId,
+            forkedAgentId=forked_agent.agentId,
+        )
+        db.add(fork)
+
+        job = job_service.enqueue(
+            db,
+            FORK_JOB,
+            {
+                "forkId": fork.forkId,
+                "agentId": source.agentId,
+                "forkedAgentId": forked_agent.agentId,
+                "sourceOwner": source_owner.username,
+                "sourceRepo": source.name,
+                "owner": user.username,
+                "repo": forked_agent.name,
+            },
+            user_id=user.userId,
+        )
+        if forked_agent.visibility == "public":
+            similarity_service.enqueue_refresh(db, forked_agent.agentId)
+        db.commit()
+
+        logger.info(f"Queued fork {fork.forkId} of {source.agentId} as job {job.jobId}")
+        return fork, job
+
+    async def run_fork_job(self, job: JobSchema) -> Dict[str, Any]:
+        """Copy the repository on Gitea and mirror it into the placeholder agent"""
+        payload = job.payload
+        owner, repo = payload["owner"], payload["repo"]
+
+        # a previous attempt may have forked the repository before failing
+        repo_info = await async_gitea_client.get_repo_info(owner, repo)
+        if not repo_info:
+            repo_info = await async_gitea_client.fork_repo(
+                payload["sourceOwner"],
+                payload["sourceRepo"],
+                owner,
+                repo,
+            )
+
+        mirrored = await agent_service.mirror_agent(
+            payload["forkedAgentId"],
+            owner,
+            repo,
+            ref=repo_info.get("default_branch") or "main",
+        )
+
+        return {
+            "forkId": payload["forkId"],
+            "forkedAgentId": payload["forkedAgentId"],
+            "repo": f"{owner}/{repo}",
+            "lastMirrored": mirrored["lastMirrored"],
+        }
+
+    async def abandon_fork(self, job: JobSchema, error: str):
+        """Remove the placeholder rows and any repository an attempt forked
+        once a fork has run out of retries"""
+        payload = job.payload
+        await asyncio.to_thread(self._delete_placeholder, payload)
+
+        owner, repo = payload["owner"], payload["repo"]
+        repo_info = await async_gitea_client.get_repo_info(owner, repo)
+        if not repo_info:
+            return
+        # never delete a same-named repository that is not this fork
+        parent = (repo_info.get("parent") or {}).get("full_name") or ""
+        source = f"{payload['sourceOwner']}/{payload['sourceRepo']}"
+        if not repo_info.get("fork") or parent.lower() != source.lower():
+            logger.warning(f"Kept {owner}/{repo}, it is not a fork of {source}")
+            return
+        if not await async_gitea_client.delete_repo(owner, repo):
+            logger.error(f"Failed to delete {owner}/{repo} of failed fork {payload['forkId']}")
+
+    def _delete_placeholder(self, payload: Dict[str, Any]):
+        db = get_db_session()
+        try:
+            db.query(Fork).filter(Fork.forkId == payload["forkId"]).delete()
+            blob_service.release_agents(db, [payload["forkedAgentId"]])
+            usage_service.remove_agent(db, payload["forkedAgentId"])
+            db.query(Agent).filter(Agent.agentId == payload["forkedAgentId"]).delete()
+            # so every process's similarity model drops it
+            similarity_service.enqueue_refresh(db, payload["forkedAgentId"])
+            db.commit()
+            logger.info(f"Removed placeholder for failed fork {payload['forkId']}")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+fork_service = ForkService()
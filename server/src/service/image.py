@@ -0,0 +1,171 @@
+import asyncio
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+from sqlalchemy.orm import Session
+from src.objects.index import Blob, ImageKey, JobSchema
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.logger import logger
+from src.lib.s3 import s3_client
+from src.service.blob import blob_service
+from src.service.job import job_service
+from src.service.usage import usage_service
+from src.utils.date import now
+from src.utils.image import DERIVATIVE_FORMATS, derivative_key, render_derivatives
+
+DERIVATIVES_JOB = "image_derivatives"
+
+# variants live at deterministic keys and never change once written
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ImageService:
+    """
+    Agent images are content-addressed blobs, see BlobService. Images from
+    before that live under `agents/{agentId}/images/`.
+
+    Every recorded image queues a job that renders resized WebP/AVIF
+    variants in a process pool, so resizing never holds the GIL of a worker
+    or request process, and stores them next to the original. Images of the
+    same blob share their variants.
+    """
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        job_service.register(DERIVATIVES_JOB, self.run_derivatives_job)
+
+    def add_image(self, db: Session, agent_id: str, blob: Blob) -> ImageKey:
+        """Reference a blob from an agent in the caller's transaction. Adding
+        the same blob twice returns the existing row."""
+        existing = (
+            db.query(ImageKey)
+            .filter(ImageKey.agentId == agent_id, ImageKey.imageKey == blob.blobKey)
+            .first()
+        )
+        if existing:
+            return existing
+        image = ImageKey(
+            imageKeyId=str(uuid.uuid4()),
+            agentId=agent_id,
+            imageKey=blob.blobKey,
+            blobHash=blob.blobHash,
+        )
+        db.add(image)
+        blob_service.acquire(db, blob.blobHash)
+        usage_service.add(db, agent_id, blob.size)
+        job_service.enqueue(db, DERIVATIVES_JOB, {"imageKeyId": image.imageKeyId})
+        logger.info(f"Added image {blob.blobKey} to agent {agent_id}")
+        return image
+
+    def copy_images(self, db: Session, source_id: str, target_id: str) -> int:
+        """Reference the blob-backed images of one agent from another, with
+        their variants, in the caller's transaction. No bytes are copied."""
+        images = (
+            db.query(ImageKey, Blob.size)
+            .join(Blob, Blob.blobHash == ImageKey.blobHash)
+            .filter(ImageKey.agentId == source_id)
+            .all()
+        )
+        for source, _ in images:
+            image = ImageKey(
+                imageKeyId=str(uuid.uuid4()),
+                agentId=target_id,
+                imageKey=source.imageKey,
+                blobHash=source.blobHash,
+                variants=source.variants,
+                derivedAt=source.derivedAt,
+            )
+            db.add(image)
+            blob_service.acquire(db, source.blobHash)
+            if not source.variants:
+                job_service.enqueue(db, DERIVATIVES_JOB, {"imageKeyId": image.imageKeyId})
+        usage_service.add(db, target_id, sum(size for _, size in images))
+        return len(images)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.image_worker_processes
+            )
+        return self._executor
+
+    def _get_image(self, image_key_id: str) -> Optional[ImageKey]:
+        db = get_db_session()
+        try:
+            image = db.query(ImageKey).filter(ImageKey.imageKeyId == image_key_id).first()
+            if image:
+                db.expunge(image)
+            return image
+        finally:
+            db.close()
+
+    def _shared_variants(self, image: ImageKey) -> Optional[Dict[str, Any]]:
+        """Variants already rendered for another image of the same blob"""
+        if not image.blobHash:
+            return None
+        db = get_db_session()
+        try:
+            return (
+                db.query(ImageKey.variants)
+                .filter(
+                    ImageKey.blobHash == image.blobHash,
+                    ImageKey.variants.isnot(None),
+                )
+                .limit(1)
+                .scalar()
+            )
+        finally:
+            db.close()
+
+    def _save_variants(self, image_key_id: str, variants: Dict[str, Any]):
+        db = get_db_session()
+        try:
+            db.query(ImageKey).filter(ImageKey.imageKeyId == image_key_id).update(
+                {"variants": variants, "derivedAt": now()}
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def run_derivatives_job(self, job: JobSchema) -> Dict[str, Any]:
+        image_key_id = job.payload["imageKeyId"]
+        image = await asyncio.to_thread(self._get_image, image_key_id)
+        if not image:
+            # deleted before its variants were rendered
+            return {"imageKeyId": image_key_id, "variants": 0}
+
+        # variant keys derive from the blob key, so they are already in place
+        shared = await asyncio.to_thread(self._shared_variants, image)
+        if shared:
+            await asyncio.to_thread(self._save_variants, image_key_id, shared)
+            return {"imageKeyId": image_key_id, "variants": 0, "shared": True}
+
+        path = await asyncio.to_thread(s3_client.cached_path, image.imageKey)
+        loop = asyncio.get_running_loop()
+        variants, outputs = await loop.run_in_executor(
+            self._get_executor(), render_derivatives, path
+        )
+
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    s3_client.put_bytes,
+                    derivative_key(image.imageKey, width, image_format),
+                    body,
+                    DERIVATIVE_FORMATS[image_format],
+                    DERIVATIVE_CACHE_CONTROL,
+                )
+                for width, image_format, body in outputs
+            )
+        )
+        # only advertised once every variant is in place
+        await asyncio.to_thread(self._save_variants, image_key_id, variants)
+        logger.info(f"Rendered {len(outputs)} variants of {image.imageKey}")
+        return {"imageKeyId": image_key_id, "variants": len(outputs)}
+
+
+image_service = ImageService()
@@ -0,0 +1,223 @@
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from src.objects.index import Job, JobSchema
+from src.db.pg import get_db_session
+from src.core.config import settings
+from src.lib.logger import logger
+from src.lib.worker import WorkerPool, backoff_delay
+from src.utils.date import now, from_now
+
+JobHandler = Callable[[JobSchema], Awaitable[Optional[Dict[str, Any]]]]
+FailureHandler = Callable[[JobSchema, str], Awaitable[None]]
+
+
+class JobService:
+    """
+    Postgres-backed job queue.
+
+    Jobs are claimed with `SELECT ... FOR UPDATE SKIP LOCKED` so any number of
+    workers, in any number of processes, can drain the same table without
+    handing out a job twice.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, JobHandler] = {}
+        self.failure_handlers: Dict[str, FailureHandler] = {}
+
+    def register(
+        self,
+        kind: str,
+        handler: JobHandler,
+        on_failure: Optional[FailureHandler] = None,
+    ):
+        """Register the coroutine that runs jobs of `kind`"""
+        self.handlers[kind] = handler
+        if on_failure:
+            self.failure_handlers[kind] = on_failure
+
+    def enqueue(
+        self,
+        db: Session,
+        kind: str,
+        payload: Dict[str, Any],
+        user_id: Optional[str] = None,
+        max_attempts: int = 3,
+    ) -> Job:
+        """Add a job to the session. The caller commits, so the job is only
+        visible to workers once the change that triggered it is."""
+        job = Job(
+            jobId=str(uuid.uuid4()),
+            kind=kind,
+            status="queued",
+            payload=payload,
+            userId=user_id,
+            maxAttempts=max_attempts,
+            attempts=0,
+            runAt=now(),
+        )
+        db.add(job)
+        return job
+
+    def enqueue_once(
+        self,
+        db: Session,
+        kind: str,
+        payload: Dict[str, Any],
+        include_running: bool = False,
+        **kwargs,
+    ) -> Optional[Job]:
+        """Enqueue unless an identical job is already waiting (or running)"""
+        statuses = ["queued", "running"] if include_running else ["queued"]
+        pending = (
+            db.query(Job)
+            .filter(Job.kind == kind, Job.status.in_(statuses), Job.payload == payload)
+            .first()
+        )
+        if pending:
+            return None
+        return self.enqueue(db, kind, payload, **kwargs)
+
+    def get_job(self, db: Session, job_id: str) -> Optional[Job]:
+        return db.query(Job).filter(Job.jobId == job_id).first()
+
+    def claim_next(
+        self, kinds: List[str], include_scheduled: bool = False
+    ) -> Optional[JobSchema]:
+        """Claim the oldest runnable job of the given kinds, if any. With
+        `include_scheduled`, queued jobs waiting for their runAt count too."""
+        db = get_db_session()
+        try:
+            timestamp = now()
+            queued = Job.status == "queued"
+            if not include_scheduled:
+                queued = and_(queued, Job.runAt <= timestamp)
+            job = (
+                db.query(Job)
+                .filter(
+                    Job.kind.in_(kinds),
+                    or_(
+                        queued,
+                        # a worker died while holding the job
+                        and_(Job.status == "running", Job.leaseExpires <= timestamp),
+                    ),
+                )
+                .order_by(Job.runAt)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not job:
+                db.rollback()
+                return None
+
+            job.status = "running"
+            job.attempts += 1
+            job.startedAt = timestamp
+            job.leaseExpires = from_now(settings.job_lease_seconds)
+            db.commit()
+            return JobSchema.model_validate(job)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _finish(self, job_id: str, values: Dict[str, Any]):
+        db = get_db_session()
+        try:
+            db.query(Job).filter(Job.jobId == job_id).update(values)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def save_checkpoint(self, job_id: str, checkpoint: Dict[str, Any]):
+        """Persist progress so a retried or reclaimed job resumes from here.
+        Also renews the lease, so a job that checkpoints is never reclaimed."""
+        self._finish(
+            job_id,
+            {"checkpoint": checkpoint, "leaseExpires": from_now(settings.job_lease_seconds)},
+        )
+
+    def complete(self, job_id: str, result: Optional[Dict[str, Any]] = None):
+        self._finish(
+            job_id,
+            {
+                "status": "succeeded",
+                "result": result,
+                "error": None,
+                "leaseExpires": None,
+                "finishedAt": now(),
+            },
+        )
+
+    def fail(self, job: JobSchema, error: str) -> bool:
+        """Record a failed attempt. Returns True if the job will be retried."""
+        if job.attempts < job.maxAttempts:
+            delay = backoff_delay(job.attempts)
+            self._finish(
+                job.jobId,
+                {
+                    "status": "queued",
+                    "error": error[:2000],
+                    "leaseExpires": None,
+                    "runAt": from_now(delay),
+                },
+            )
+            return True
+
+        self._finish(
+            job.jobId,
+            {
+                "status": "failed",
+                "error": error[:2000],
+                "leaseExpires": None,
+                "finishedAt": now(),
+            },
+        )
+        return False
+
+    async def run(self, job: JobSchema):
+        """Run a claimed job and record the outcome"""
+        handler = self.handlers.get(job.kind)
+        if not handler:
+            logger.error(f"No handler registered for job kind {job.kind}")
+            await asyncio.to_thread(self.fail, job, f"Unknown job kind: {job.kind}")
+            return
+
+        try:
+            if job.attempts > job.maxAttempts:
+                # reclaimed after its lease expired on every attempt: its
+                # workers keep dying, so fail it instead of running it again
+                raise RuntimeError(f"Lease expired on all {job.maxAttempts} attempt(s)")
+            result = await handler(job)
+            await asyncio.to_thread(self.complete, job.jobId, result)
+            logger.info(f"Job {job.kind}:{job.jobId} succeeded")
+        except Exception as e:
+            logger.error(f"Job {job.kind}:{job.jobId} failed: {e}")
+            retrying = await asyncio.to_thread(self.fail, job, str(e))
+            on_failure = self.failure_handlers.get(job.kind)
+            if not retrying and on_failure:
+                try:
+                    await on_failure(job, str(e))
+                except Exception as cleanup_error:
+                    logger.error(
+                        f"Failure handler for {job.kind}:{job.jobId} failed: {cleanup_error}"
+                    )
+
+    def create_pool(self, name: str, kinds: List[str], concurrency: int) -> WorkerPool:
+        """Create a worker pool that only runs jobs of the given kinds"""
+        return WorkerPool(
+            name=name,
+            claim=lambda: self.claim_next(kinds),
+            process=self.run,
+            concurrency=concurrency,
+            poll_interval=settings.job_poll_interval,
+        )
+
+
+job_service = JobService()
@@ -0,0 +1,222 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from sqlalchemy.orm import Session
+from src.objects.index import Agent, Job, JobSchema, User
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.gittea import async_gitea_client
+from src.lib.logger import logger
+from src.service.job import job_service
+from src.service.user import user_service
+
+PROVISION_USER_JOB = "provision_user"
+PROVISION_AGENT_JOB = "provision_agent"
+
+# the one API token the server keeps per user
+TOKEN_NAME = "modaic-api"
+
+# (step name, coroutine returning its checkpointed result), in the order they run
+Steps = List[Tuple[str, Callable[[], Awaitable[Dict[str, Any]]]]]
+
+
+def webhook_url() -> str:
+    return f"{settings.api_url}/api/v1/webhooks/gitea/push"
+
+
+class ProvisioningService:
+    """
+    Creates the Gitea side of users and agents in the background.
+
+    The API commits the user or agent row together with a provisioning job and
+    answers straight away. The job runs its Gitea calls one after the other,
+    as each needs what the previous one created: a token needs the account,
+    a repository needs its owner's account and a webhook needs the
+    repository. Every finished step is checkpointed on the job, so a retry
+    after a partial failure only runs the steps that are left. Each step also
+    checks Gitea first, in case an attempt died between the call and its
+    checkpoint. Separate jobs run concurrently on the provisioning workers,
+    for example a new user's token and their first agent's repository.
+    """
+
+    def __init__(self):
+        job_service.register(PROVISION_USER_JOB, self.run_user_job)
+        job_service.register(PROVISION_AGENT_JOB, self.run_agent_job)
+
+    def enqueue_user(self, db: Session, user_id: str) -> Job:
+        """Queue provisioning of a new user in the caller's transaction"""
+        return job_service.enqueue(
+            db, PROVISION_USER_JOB, {"userId": user_id}, user_id=user_id, max_attempts=5
+        )
+
+    def enqueue_agent(self, db: Session, agent_id: str, user_id: str) -> Job:
+        """Queue provisioning of a new agent in the caller's transaction"""
+        return job_service.enqueue(
+            db,
+            PROVISION_AGENT_JOB,
+            {"agentId": agent_id, "userId": user_id},
+            user_id=user_id,
+            max_attempts=5,
+        )
+
+    def get_status(
+        self, db: Session, user_id: str, agent_id: Optional[str] = None
+    ) -> Optional[Job]:
+        """Latest provisioning job of a user, or of one of their agents"""
+        query = db.query(Job).filter(Job.userId == user_id)
+        if agent_id:
+            query = query.filter(
+                Job.kind == PROVISION_AGENT_JOB,
+                Job.payload["agentId"].astext == agent_id,
+            )
+        else:
+            query = query.filter(Job.kind == PROVISION_USER_JOB)
+        return query.order_by(Job.created.desc()).first()
+
+    async def _run_steps(self, job: JobSchema, steps: Steps) -> Dict[str, Any]:
+        """Run the steps in order, skipping those a previous attempt finished"""
+        done: Dict[str, Any] = dict((job.checkpoint or {}).get("steps", {}))
+        if done:
+            logger.info(f"Resuming {job.kind}:{job.jobId} after {sorted(done)}")
+
+        for name, step in steps:
+            if name in done:
+                continue
+            done[name] = await step()
+            await asyncio.to_thread(
+                job_service.save_checkpoint, job.jobId, {"steps": dict(done)}
+            )
+        return {"steps": done}
+
+    def _get_user(self, user_id: str) -> User:
+        db = get_db_session()
+        try:
+            user = db.query(User).filter(User.userId == user_id).first()
+            if not user:
+                raise ValueError(f"User {user_id} no longer exists")
+            db.expunge(user)
+            return user
+        finally:
+            db.close()
+
+    def _get_agent(self, agent_id: str) -> Tuple[Agent, str]:
+        db = get_db_session()
+        try:
+            row = (
+                db.query(Agent, User.username)
+                .join(User, User.userId == Agent.adminId)
+                .filter(Agent.agentId == agent_id)
+                .first()
+            )
+            if not row:
+                raise ValueError(f"Agent {agent_id} no longer exists")
+            db.expunge(row[0])
+            return row[0], row[1]
+        finally:
+            db.close()
+
+    def _update_user(self, user_id: str, values: Dict[str, Any]):
+        db = get_db_session()
+        try:
+            db.query(User).filter(User.userId == user_id).update(values)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def ensure_gitea_user(self, user_id: str) -> Dict[str, Any]:
+        """Create the user's Gitea account unless it already exists"""
+        user = await asyncio.to_thread(self._get_user, user_id)
+        if user.giteaUserId:
+            return {"giteaUserId": user.giteaUserId}
+
+        gitea_user = await async_gitea_client.get_user(user.username)
+        if not gitea_user:
+            try:
+                gitea_user = await async_gitea_client.create_user(
+                    user.username, user.email, user.fullName or ""
+                )
+            except httpx.HTTPStatusError as e:
+                # created concurrently by another provisioning job
+                if e.response.status_code != 422:
+                    raise
+                gitea_user = await async_gitea_client.get_user(user.username)
+                if not gitea_user:
+                    raise
+
+        await asyncio.to_thread(
+            self._update_user, user_id, {"giteaUserId": gitea_user["id"]}
+        )
+        return {"giteaUserId": gitea_user["id"]}
+
+    async def create_token(self, user_id: str) -> Dict[str, Any]:
+        """Create the API token the user's SDK pushes with. Gitea only shows a
+        token's secret once, so one left by an attempt that died before
+        storing it is deleted and replaced."""
+        user = await asyncio.to_thread(self._get_user, user_id)
+        for token in await async_gitea_client.list_access_tokens(user.username):
+            if token.get("name") == TOKEN_NAME:
+                await async_gitea_client.delete_access_token(user.username, token["id"])
+
+        token = await async_gitea_client.create_access_token(user.username, TOKEN_NAME)
+        await asyncio.to_thread(
+            self._update_user,
+            user_id,
+            {"giteaToken": user_service._encrypt_token(token["sha1"])},
+        )
+        # the secret lives on the user row only, never in the checkpoint
+        return {"tokenName": token["name"]}
+
+    async def ensure_repo(self, agent_id: str) -> Dict[str, Any]:
+        """Create the agent's repository unless it already exists"""
+        agent, owner = await asyncio.to_thread(self._get_agent, agent_id)
+        repo = await async_gitea_client.get_repo_info(owner, agent.name)
+        if not repo:
+            repo = await async_gitea_client.create_repo(
+                owner,
+                agent.name,
+                description=agent.description,
+                private=agent.visibility != "public",
+            )
+        return {"repo": repo["full_name"], "defaultBranch": repo.get("default_branch")}
+
+    async def ensure_webhook(self, agent_id: str) -> Dict[str, Any]:
+        """Point the repository's push webhook at this API unless it already is"""
+        agent, owner = await asyncio.to_thread(self._get_agent, agent_id)
+        url = webhook_url()
+        hooks = await async_gitea_client.list_webhooks(owner, agent.name)
+        hook = next(
+            (hook for hook in hooks if (hook.get("config") or {}).get("url") == url),
+            None,
+        )
+        if not hook:
+            hook = await async_gitea_client.setup_webhook(owner, agent.name, url)
+        return {"webhookId": hook["id"]}
+
+    async def run_user_job(self, job: JobSchema) -> Dict[str, Any]:
+        user_id = job.payload["userId"]
+        return await self._run_steps(
+            job,
+            [
+                ("user", lambda: self.ensure_gitea_user(user_id)),
+                ("token", lambda: self.create_token(user_id)),
+            ],
+        )
+
+    async def run_agent_job(self, job: JobSchema) -> Dict[str, Any]:
+        # the owner's own provisioning job may still be running, so make
+        # sure the Gitea account exists before creating the repository
+        agent_id, user_id = job.payload["agentId"], job.payload["userId"]
+        return await self._run_steps(
+            job,
+            [
+                ("user", lambda: self.ensure_gitea_user(user_id)),
+                ("repo", lambda: self.ensure_repo(agent_id)),
+                ("webhook", lambda: self.ensure_webhook(agent_id)),
+            ],
+        )
+
+
+provisioning_service = ProvisioningService()
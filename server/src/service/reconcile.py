@@ -0,0 +1,143 @@
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+from src.objects.index import Agent, JobSchema, User
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.gittea import async_gitea_client
+from src.lib.logger import logger
+from src.service.agent import agent_service
+from src.service.job import job_service
+from src.utils.date import parse_timestamp
+
+RECONCILE_JOB = "gitea_reconcile"
+
+
+def is_stale(repo: Dict[str, Any], last_mirrored: Optional[str]) -> bool:
+    """A repository changed after its agent was last mirrored"""
+    mirrored = parse_timestamp(last_mirrored)
+    updated = parse_timestamp(repo.get("updated_at"))
+    if mirrored is None:
+        return True
+    return updated is not None and updated > mirrored
+
+
+class ReconcileService:
+    """
+    Catches agents up with pushes whose webhooks were lost.
+
+    Walks every Gitea user page by page and every repository of the users
+    that own agents, re-mirroring only agents whose repository was updated
+    after `lastMirrored`. Users on a page are reconciled concurrently, and
+    progress is checkpointed on the job after each page so a retried or
+    reclaimed run picks up where the last one stopped.
+    """
+
+    def __init__(self):
+        self.concurrency = settings.reconcile_concurrency
+        self.page_size = settings.reconcile_page_size
+        job_service.register(RECONCILE_JOB, self.run_reconcile_job)
+
+    def _mirrored_agents(self, username: str) -> Dict[str, Tuple[str, Optional[str]]]:
+        """Agents of a user by name, with when each was last mirrored"""
+        db = get_db_session()
+        try:
+            rows = (
+                db.query(Agent.name, Agent.agentId, Agent.lastMirrored)
+                .join(User, User.userId == Agent.adminId)
+                .filter(User.username == username.lower())
+                .all()
+            )
+            return {name: (agent_id, mirrored) for name, agent_id, mirrored in rows}
+        finally:
+            db.close()
+
+    async def reconcile_user(self, username: str) -> Dict[str, int]:
+        """Re-mirror the stale agents of one user"""
+        counts = {"repos": 0, "remirrored": 0, "failed": 0}
+        agents = await asyncio.to_thread(self._mirrored_agents, username)
+        if not agents:
+            # nothing to reconcile, so do not list their repositories
+            return counts
+
+        async for repo in async_gitea_client.iter_user_repos(
+            username, limit=self.page_size
+        ):
+            counts["repos"] += 1
+            agent = agents.get(repo.get("name"))
+            if not agent or not is_stale(repo, agent[1]):
+                continue
+            try:
+                await agent_service.mirror_agent(
+                    agent[0],
+                    username,
+                    repo["name"],
+                    ref=repo.get("default_branch") or "main",
+                )
+                counts["remirrored"] += 1
+            except Exception as e:
+                logger.error(f"Failed to reconcile {username}/{repo['name']}: {str(e)}")
+                counts["failed"] += 1
+        return counts
+
+    async def run_reconcile_job(self, job: JobSchema) -> Dict[str, Any]:
+        progress = dict(
+            job.checkpoint
+            or {"page": 1, "users": 0, "repos": 0, "remirrored": 0, "failed": 0}
+        )
+        if progress["page"] > 1:
+            logger.info(f"Resuming Gitea reconciliation at page {progress['page']}")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def reconcile(username: str) -> Dict[str, int]:
+            async with semaphore:
+                try:
+                    return await self.reconcile_user(username)
+                except Exception as e:
+                    logger.error(f"Failed to reconcile user {username}: {str(e)}")
+                    return {"failed": 1}
+
+        while True:
+            users = await async_gitea_client.list_users(progress["page"], self.page_size)
+            results = await asyncio.gather(*(reconcile(user["login"]) for user in users))
+            progress["users"] += len(users)
+            for counts in results:
+                for key, value in counts.items():
+                    progress[key] += value
+            progress["page"] += 1
+            # also renews the lease, so a long run is not reclaimed midway
+            await asyncio.to_thread(job_service.save_checkpoint, job.jobId, progress)
+            if len(users) < self.page_size:
+                break
+
+        logger.info(
+            f"Reconciled {progress['users']} Gitea users and {progress['repos']} repos: "
+            f"{progress['remirrored']} re-mirrored, {progress['failed']} failed"
+        )
+        return progress
+
+    def _enqueue_reconcile(self):
+        db = get_db_session()
+        try:
+            job_service.enqueue_once(db, RECONCILE_JOB, {}, include_running=True)
+            db.commit()
+        finally:
+            db.close()
+
+    async def schedule_reconcile(self):
+        await asyncio.to_thread(self._enqueue_reconcile)
+
+    async def run_now(self) -> bool:
+        """Run a reconciliation inline, resuming an unfinished one if any, even
+        one waiting to be retried. Returns False if another worker holds it."""
+        await self.schedule_reconcile()
+        job = await asyncio.to_thread(
+            job_service.claim_next, [RECONCILE_JOB], include_scheduled=True
+        )
+        if not job:
+            logger.info("Gitea reconciliation is already running elsewhere")
+            return False
+        await job_service.run(job)
+        return True
+
+
+reconcile_service = ReconcileService()
@@ -0,0 +1,509 @@
+import asyncio
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.orm import Session
+from src.objects.index import Agent, AgentTag, Job, JobSchema, SimilarAgent
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.logger import logger
+from src.service.job import job_service
+from src.utils.date import from_now, now
+
+REBUILD_JOB = "similar_agents_rebuild"
+REFRESH_JOB = "similar_agents_refresh"
+
+# how far back a process re-reads refreshes when syncing its model
+SYNC_SLACK_SECONDS = 60
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_-]{2,}")
+STOPWORDS = frozenset(
+    "the and for with that this from your you are can its into use using "
+    "agent agents will which when what have has how also more than".split()
+)
+
+
+def _normalize_rows(matrix: sp.csr_matrix) -> sp.csr_matrix:
+    """Scale every row to unit L2 norm so dot products are cosine similarities"""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.diags(1.0 / norms) @ matrix
+
+
+def _idf(matrix: sp.csr_matrix) -> np.ndarray:
+    n_rows = matrix.shape[0]
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    return np.log((1 + n_rows) / (1 + df)) + 1.0
+
+
+def _top_k(
+    scores: sp.spmatrix, row_offset: int, k: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keep the k best non-self entries of every row, without a per-row loop"""
+    scores = scores.tocoo()
+    rows, cols, data = scores.row + row_offset, scores.col, scores.data
+    keep = (rows != cols) & (data > 0)
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+
+    # sort by row, then by descending score; rank is the offset within each row
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    rank = np.arange(rows.size) - np.searchsorted(rows, rows, side="left")
+    keep = rank < k
+    return rows[keep], cols[keep], data[keep]
+
+
+def _tokens(name: str, description: Optional[str]) -> List[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(f"{name} {description}".lower())
+        if token not in STOPWORDS
+    ]
+
+
+class _Model:
+    """
+    What a rebuild fitted: the tag and term vocabularies with their IDF
+    weights, and every public agent's vector. A refresh vectorizes one agent
+    against it and swaps in its row, without reading any other agent.
+
+    `version` is the rebuild job the model was fitted for, and `synced` the
+    time up to which refreshes run by any process have been replayed on it.
+    """
+
+    def __init__(
+        self,
+        agent_ids: np.ndarray,
+        vectors: sp.csr_matrix,
+        tag_vocab: np.ndarray,
+        tag_idf: np.ndarray,
+        term_vocab: np.ndarray,
+        term_idf: np.ndarray,
+    ):
+        self.agent_ids = agent_ids
+        self.vectors = vectors
+        self.rows = {agent_id: i for i, agent_id in enumerate(agent_ids)}
+        self.tag_cols = {tag: i for i, tag in enumerate(tag_vocab)}
+        self.tag_idf = tag_idf
+        self.term_cols = {term: i for i, term in enumerate(term_vocab)}
+        self.term_idf = term_idf
+        # rows changed since the fit, kept apart so the fitted matrix is
+        # never copied
+        self.edited: Dict[str, sp.csr_matrix] = {}
+        self.version: Optional[str] = None
+        self.synced = ""
+
+    def vectorize(
+        self, name: str, description: Optional[str], tags: List[str], tag_weight: float
+    ) -> sp.csr_matrix:
+        """One agent's row. Tags and terms the rebuild did not keep are
+        dropped: they were in too few or too many agents to matter."""
+        tag_cols = np.array(
+            sorted({self.tag_cols[tag] for tag in tags if tag in self.tag_cols}),
+            dtype=np.int64,
+        )
+        tag_data = self.tag_idf[tag_cols]
+
+        counts = Counter(
+            self.term_cols[token]
+            for token in _tokens(name, description)
+            if token in self.term_cols
+        )
+        term_cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        term_data = (
+            1.0 + np.log(np.fromiter(counts.values(), dtype=float, count=len(counts)))
+        ) * self.term_idf[term_cols]
+
+        def unit(data: np.ndarray) -> np.ndarray:
+            norm = np.sqrt((data * data).sum())
+            return data / norm if norm else data
+
+        width = self.vectors.shape[1]
+        cols = np.concatenate([tag_cols, term_cols + len(self.tag_cols)])
+        data = np.concatenate(
+            [
+                np.sqrt(tag_weight) * unit(tag_data),
+                np.sqrt(1 - tag_weight) * unit(term_data),
+            ]
+        )
+        return sp.csr_matrix(
+            (data, (np.zeros(cols.size, dtype=np.int64), cols)), shape=(1, width)
+        )
+
+    def set_row(self, agent_id: str, vector: Optional[sp.csr_matrix]):
+        """Replace an agent's row, adding it if new. None removes it."""
+        index = self.rows.get(agent_id)
+        if index is not None:
+            # zeroed in place, which only touches this row's entries
+            start, end = self.vectors.indptr[index], self.vectors.indptr[index + 1]
+            self.vectors.data[start:end] = 0.0
+        if vector is None:
+            self.edited.pop(agent_id, None)
+        else:
+            self.edited[agent_id] = vector
+
+    def score(self, vector: sp.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+        """Every agent id with its similarity to `vector`"""
+        agent_ids = self.agent_ids
+        scores = np.asarray((self.vectors @ vector.T).todense()).ravel()
+        if self.edited:
+            edited = sp.vstack(list(self.edited.values()), format="csr")
+            agent_ids = np.concatenate(
+                [agent_ids, np.array(list(self.edited), dtype=object)]
+            )
+            scores = np.concatenate(
+                [scores, np.asarray((edited @ vector.T).todense()).ravel()]
+            )
+        return agent_ids, scores
+
+
+class SimilarityService:
+    """
+    Agent-to-agent similarity from tag co-occurrence and description terms.
+
+    Each public agent becomes a sparse row of IDF-weighted tags and TF-IDF
+    description terms. Both blocks are L2-normalised and weighted, so the
+    dot product of two rows is a weighted sum of their tag and description
+    cosine similarities. The top k neighbours of every agent are stored in
+    `similar_agents`.
+
+    A rebuild also keeps what it fitted in memory, so refreshing one agent
+    after an edit only vectorizes that agent and scores it against the
+    cached matrix. Vocabularies and IDF weights stay as fitted until the next
+    rebuild. Each process's copy follows the database: it is refitted when
+    another process finishes a rebuild, and agents refreshed elsewhere are
+    re-read from the refresh jobs before scoring.
+    """
+
+    def __init__(self):
+        self.top_k = settings.similar_agents_top_k
+        self.tag_weight = settings.similar_agents_tag_weight
+        self.chunk_size = 512
+        job_service.register(REBUILD_JOB, self.run_rebuild_job)
+        job_service.register(REFRESH_JOB, self.run_refresh_job)
+        self._model: Optional[_Model] = None
+        self._lock = threading.Lock()
+
+    def _fit(self, db: Session) -> _Model:
+        """Build the combined feature matrix for every public agent"""
+        # sorted in Python so searchsorted agrees with the ordering
+        agents = sorted(
+            db.query(Agent.agentId, Agent.name, Agent.description)
+            .filter(Agent.visibility == "public")
+            .all()
+        )
+        agent_ids = np.array([agent_id for agent_id, _, _ in agents], dtype=object)
+        n_agents = agent_ids.size
+        empty = np.array([], dtype=object)
+        if n_agents == 0:
+            return _Model(agent_ids, sp.csr_matrix((0, 0)), empty, np.zeros(0), empty, np.zeros(0))
+
+        # tag block: agents x tags
+        tag_rows = (
+            db.query(AgentTag.agentId, AgentTag.tag)
+            .join(Agent, Agent.agentId == AgentTag.agentId)
+            .filter(Agent.visibility == "public")
+            .all()
+        )
+        if tag_rows:
+            tag_agents = np.array([agent_id for agent_id, _ in tag_rows], dtype=object)
+            tag_names = np.array([tag.lower() for _, tag in tag_rows], dtype=object)
+            tag_vocab, tag_cols = np.unique(tag_names, return_inverse=True)
+            tags = sp.csr_matrix(
+                (
+                    np.ones(tag_cols.size),
+                    (np.searchsorted(agent_ids, tag_agents), tag_cols),
+                ),
+                shape=(n_agents, tag_vocab.size),
+            )
+            tags.data[:] = 1.0  # duplicate tags count once
+            tag_idf = _idf(tags)
+            tags = _normalize_rows(tags @ sp.diags(tag_idf))
+        else:
+            tag_vocab, tag_idf = empty, np.zeros(0)
+            tags = sp.csr_matrix((n_agents, 0))
+
+        # description block: agents x terms, sublinear TF-IDF
+        documents = [_tokens(name, description) for _, name, description in agents]
+        lengths = np.fromiter((len(doc) for doc in documents), dtype=np.int64)
+        if lengths.sum():
+            tokens = np.fromiter(
+                (token for doc in documents for token in doc),
+                dtype=object,
+                count=int(lengths.sum()),
+            )
+            term_vocab, term_cols = np.unique(tokens, return_inverse=True)
+            terms = sp.csr_matrix(
+                (
+                    np.ones(term_cols.size),
+                    (np.repeat(np.arange(n_agents), lengths), term_cols),
+                ),
+                shape=(n_agents, term_vocab.size),
+            )
+            terms.sum_duplicates()
+            terms.data = 1.0 + np.log(terms.data)
+
+            # terms in a single description cannot make two agents similar,
+            # and terms in most descriptions do not tell them apart
+            df = np.bincount(terms.indices, minlength=terms.shape[1])
+            useful = np.flatnonzero((df > 1) & (df <= max(2, n_agents // 2)))
+            terms = terms[:, useful]
+            term_vocab, term_idf = term_vocab[useful], _idf(terms)
+            terms = _normalize_rows(terms @ sp.diags(term_idf))
+        else:
+            term_vocab, term_idf = empty, np.zeros(0)
+            terms = sp.csr_matrix((n_agents, 0))
+
+        vectors = sp.hstack(
+            [np.sqrt(self.tag_weight) * tags, np.sqrt(1 - self.tag_weight) * terms],
+            format="csr",
+        )
+        return _Model(agent_ids, vectors, tag_vocab, tag_idf, term_vocab, term_idf)
+
+    def rebuild(self, version: Optional[str] = None) -> Dict[str, Any]:
+        """Recompute the whole similar_agents table; `version` is the id of
+        the rebuild job, which other processes compare their model to"""
+        db = get_db_session()
+        try:
+            synced = from_now(-SYNC_SLACK_SECONDS)
+            model = self._fit(db)
+            model.version, model.synced = version, synced
+            agent_ids, vectors = model.agent_ids, model.vectors
+            transposed = vectors.T.tocsc()
+            computed = now()
+
+            db.query(SimilarAgent).delete()
+            pairs = 0
+            for start in range(0, agent_ids.size, self.chunk_size):
+                block = vectors[start : start + self.chunk_size] @ transposed
+                rows, cols, scores = _top_k(block, start, self.top_k)
+                if rows.size == 0:
+                    continue
+                db.execute(
+                    insert(SimilarAgent),
+                    [
+                        {
+                            "agentId": agent_id,
+                            "similarAgentId": similar_id,
+                            "score": float(score),
+                            "computed": computed,
+                        }
+                        for agent_id, similar_id, score in zip(
+                            agent_ids[rows], agent_ids[cols], scores
+                        )
+                    ],
+                )
+                pairs += rows.size
+
+            # readers keep seeing the previous table until this commit
+            db.commit()
+            with self._lock:
+                self._model = model
+            logger.info(f"Rebuilt similar agents: {agent_ids.size} agents, {pairs} pairs")
+            return {"agents": int(agent_ids.size), "pairs": int(pairs)}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _vectorize_agent(self, db: Session, model: _Model, agent_id: str) -> int:
+        """Re-read one agent into the model; returns how many rows it had.
+        Private and deleted agents are removed, they should not be
+        recommended."""
+        agent = (
+            db.query(Agent.name, Agent.description, Agent.visibility)
+            .filter(Agent.agentId == agent_id)
+            .first()
+        )
+        if not agent or agent.visibility != "public":
+            model.set_row(agent_id, None)
+            return 0
+
+        tags = [
+            tag.lower()
+            for (tag,) in db.query(AgentTag.tag).filter(AgentTag.agentId == agent_id)
+        ]
+        model.set_row(
+            agent_id,
+            model.vectorize(agent.name, agent.description, tags, self.tag_weight),
+        )
+        return 1
+
+    def _current_model(self, db: Session) -> _Model:
+        """This process's model, brought up to date with the database"""
+        version = (
+            db.query(Job.jobId)
+            .filter(Job.kind == REBUILD_JOB, Job.status == "succeeded")
+            .order_by(Job.finishedAt.desc())
+            .limit(1)
+            .scalar()
+        )
+        with self._lock:
+            model = self._model
+        if model is None or model.version != version:
+            # fitting reads every public agent, so it does not hold the lock
+            synced = from_now(-SYNC_SLACK_SECONDS)
+            model = self._fit(db)
+            model.version, model.synced = version, synced
+            with self._lock:
+                self._model = model
+
+        # replay refreshes other processes ran since the last sync; the slack
+        # covers jobs stamped finished just before that and committed after
+        synced = from_now(-SYNC_SLACK_SECONDS)
+        changed = {
+            payload["agentId"]
+            for (payload,) in db.query(Job.payload).filter(
+                Job.kind == REFRESH_JOB,
+                Job.status == "succeeded",
+                Job.finishedAt >= model.synced,
+            )
+        }
+        with self._lock:
+            for agent_id in changed:
+                self._vectorize_agent(db, model, agent_id)
+            model.synced = synced
+        return model
+
+    def refresh_agent(self, agent_id: str) -> Dict[str, Any]:
+        """
+        Recompute one agent's neighbours after its tags or description change.
+
+        The agent's own list is replaced. Existing reverse edges are rescored or
+        dropped, and the agent is added to other lists it now ranks in, which
+        are then trimmed back to k.
+        """
+        db = get_db_session()
+        try:
+            model = self._current_model(db)
+            db.query(SimilarAgent).filter(
+                (SimilarAgent.agentId == agent_id)
+                | (SimilarAgent.similarAgentId == agent_id)
+            ).delete(synchronize_session=False)
+
+            with self._lock:
+                if not self._vectorize_agent(db, model, agent_id):
+                    db.commit()
+                    return {"agentId": agent_id, "pairs": 0}
+                agent_ids, scores = model.score(model.edited[agent_id])
+
+            scores[agent_ids == agent_id] = 0.0
+            candidates = np.flatnonzero(scores > 0)
+            computed = now()
+
+            # own list
+            best = candidates[np.argsort(-scores[candidates])[: self.top_k]]
+            rows = [
+                {
+                    "agentId": agent_id,
+                    "similarAgentId": agent_ids[i],
+                    "score": float(scores[i]),
+                    "computed": computed,
+                }
+                for i in best
+            ]
+
+            # reverse edges where this agent beats the current k-th neighbour;
+            # agents it scores low against cannot rank in their lists anyway
+            candidates = candidates[np.argsort(-scores[candidates])[: self.top_k * 10]]
+            candidate_ids = list(agent_ids[candidates])
+            thresholds = dict(
+                db.query(SimilarAgent.agentId, func.min(SimilarAgent.score))
+                .filter(SimilarAgent.agentId.in_(candidate_ids))
+                .group_by(SimilarAgent.agentId)
+                .having(func.count() >= self.top_k)
+                .all()
+            )
+            ranked_in = []
+            for i in candidates:
+                other_id = agent_ids[i]
+                if scores[i] > thresholds.get(other_id, 0.0):
+                    ranked_in.append(other_id)
+                    rows.append(
+                        {
+                            "agentId": other_id,
+                            "similarAgentId": agent_id,
+                            "score": float(scores[i]),
+                            "computed": computed,
+                        }
+                    )
+
+            if rows:
+                db.execute(insert(SimilarAgent), rows)
+            if ranked_in:
+                self._trim(db, ranked_in)
+            db.commit()
+            return {"agentId": agent_id, "pairs": len(rows)}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _trim(self, db: Session, agent_ids: List[str]):
+        """Drop all but the k best neighbours of the given agents"""
+        ranked = (
+            select(
+                SimilarAgent.agentId,
+                SimilarAgent.similarAgentId,
+                func.row_number()
+                .over(
+                    partition_by=SimilarAgent.agentId,
+                    order_by=SimilarAgent.score.desc(),
+                )
+                .label("rank"),
+            )
+            .where(SimilarAgent.agentId.in_(agent_ids))
+            .subquery()
+        )
+        db.execute(
+            delete(SimilarAgent).where(
+                tuple_(SimilarAgent.agentId, SimilarAgent.similarAgentId).in_(
+                    select(ranked.c.agentId, ranked.c.similarAgentId).where(
+                        ranked.c.rank > self.top_k
+                    )
+                )
+            )
+        )
+
+    def enqueue_refresh(self, db: Session, agent_id: str):
+        """Queue a refresh in the caller's transaction"""
+        job_service.enqueue_once(db, REFRESH_JOB, {"agentId": agent_id})
+
+    async def schedule_rebuild(self):
+        await asyncio.to_thread(self._enqueue_rebuild)
+
+    def _enqueue_rebuild(self):
+        db = get_db_session()
+        try:
+            job_service.enqueue_once(db, REBUILD_JOB, {}, max_attempts=1)
+            db.commit()
+        finally:
+            db.close()
+
+    async def run_rebuild_job(self, job: JobSchema) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.rebuild, job.jobId)
+
+    async def run_refresh_job(self, job: JobSchema) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.refresh_agent, job.payload["agentId"])
+
+    def get_similar(
+        self, db: Session, agent_id: str, limit: int
+    ) -> List[Tuple[Agent, float]]:
+        """Read precomputed neighbours, best first"""
+        return (
+            db.query(Agent, SimilarAgent.score)
+            .join(SimilarAgent, SimilarAgent.similarAgentId == Agent.agentId)
+            .filter(SimilarAgent.agentId == agent_id, Agent.visibility == "public")
+            .order_by(SimilarAgent.score.desc())
+            .limit(limit)
+            .all()
+        )
+
+
+similarity_service = SimilarityService()
@@ -0,0 +1,119 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from src.objects.index import Job, JobSchema
+from src.core.config import settings
+from src.lib.logger import logger
+from src.lib.s3 import s3_client
+from src.service.job import job_service
+
+TEARDOWN_JOB = "s3_teardown"
+BATCH_SIZE = 1000  # the most DeleteObjects accepts
+
+
+class TeardownService:
+    """
+    Deletes everything under S3 prefixes of deleted agents and users.
+
+    Listing runs ahead while batches of 1000 keys are deleted on a bounded
+    thread pool. After every page the job checkpoints the prefix it is on,
+    the last key up to which every batch has finished, and its counts, so a
+    crashed teardown resumes from there.
+    """
+
+    def __init__(self):
+        self.concurrency = settings.s3_teardown_concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        job_service.register(TEARDOWN_JOB, self.run_teardown_job)
+
+    def agent_prefix(self, agent_id: str) -> str:
+        return f"agents/{agent_id}/"
+
+    def enqueue(self, db: Session, prefixes: List[str]) -> Optional[Job]:
+        """Queue deletion of the prefixes in the caller's transaction"""
+        if not prefixes:
+            return None
+        # no userId: the job must outlive the user being deleted
+        return job_service.enqueue(
+            db, TEARDOWN_JOB, {"prefixes": prefixes}, max_attempts=10
+        )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="s3-teardown"
+            )
+        return self._executor
+
+    async def run_teardown_job(self, job: JobSchema) -> Dict[str, Any]:
+        prefixes = job.payload["prefixes"]
+        progress = dict(
+            job.checkpoint
+            or {"prefixIndex": 0, "startAfter": None, "deleted": 0, "failed": 0}
+        )
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+
+        while progress["prefixIndex"] < len(prefixes):
+            prefix = prefixes[progress["prefixIndex"]]
+            # batches in listing order, with the last key of each
+            pending: Deque[Tuple[str, int, asyncio.Future]] = deque()
+            start_after = progress["startAfter"]
+
+            def settle(wait_all: bool = False):
+                # advance the checkpoint over the finished head of the queue
+                while pending and (wait_all or pending[0][2].done()):
+                    last_key, size, future = pending[0]
+                    if not future.done():
+                        return
+                    failed = len(future.result())
+                    progress["deleted"] += size - failed
+                    progress["failed"] += failed
+                    progress["startAfter"] = last_key
+                    pending.popleft()
+
+            while True:
+                keys = await asyncio.to_thread(
+                    s3_client.list_keys, prefix, start_after, BATCH_SIZE
+                )
+                if not keys:
+                    break
+                if len(pending) >= self.concurrency:
+                    await asyncio.wait(
+                        [pending[0][2]], return_when=asyncio.FIRST_COMPLETED
+                    )
+                deletion = loop.run_in_executor(executor, s3_client.delete_keys, keys)
+                pending.append((keys[-1], len(keys), deletion))
+                # list on from the last key so listing overlaps deletion
+                start_after = keys[-1]
+                settle()
+                await asyncio.to_thread(job_service.save_checkpoint, job.jobId, progress)
+                if len(keys) < BATCH_SIZE:
+                    break
+
+            if pending:
+                await asyncio.gather(*(future for _, _, future in pending))
+                settle(wait_all=True)
+            logger.info(f"Tore down {prefix}: {progress['deleted']} deleted so far")
+            progress["prefixIndex"] += 1
+            progress["startAfter"] = None
+            await asyncio.to_thread(job_service.save_checkpoint, job.jobId, progress)
+
+        if progress["failed"]:
+            # failed keys were skipped over; retry with a fresh listing, which
+            # only finds what is left
+            failed = progress["failed"]
+            progress.update({"prefixIndex": 0, "startAfter": None, "failed": 0})
+            await asyncio.to_thread(job_service.save_checkpoint, job.jobId, progress)
+            raise Exception(f"{failed} object(s) could not be deleted")
+
+        logger.info(
+            f"Teardown of {len(prefixes)} prefix(es) finished: "
+            f"{progress['deleted']} deleted, {progress['failed']} failed"
+        )
+        return {"prefixes": prefixes, "deleted": progress["deleted"]}
+
+
+teardown_service = TeardownService()
@@ -0,0 +1,172 @@
+import asyncio
+from typing import Any, Dict, List
+from fastapi import HTTPException
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+from src.objects.index import Agent, Blob, ImageKey, JobSchema, User
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.logger import logger
+from src.lib.s3 import s3_client
+from src.service.job import job_service
+
+USAGE_RECONCILE_JOB = "storage_reconcile"
+AGENTS_PREFIX = "agents/"
+
+
+class UsageService:
+    """
+    Storage usage counters on agents and users.
+
+    An agent is charged the size of every image it references, whether or
+    not the blob is shared, plus whatever lies under its own S3 prefix. The
+    counters are updated in the same transaction as the rows that change
+    them, so quota checks and dashboards never touch S3. A periodic job
+    lists the agent prefixes and resets every counter that has drifted.
+    """
+
+    def __init__(self):
+        job_service.register(USAGE_RECONCILE_JOB, self.run_reconcile_job)
+
+    def add(self, db: Session, agent_id: str, delta: int):
+        """Charge `delta` bytes to an agent and its owner, in the caller's transaction"""
+        if not delta:
+            return
+        db.query(Agent).filter(Agent.agentId == agent_id).update(
+            {
+                "storageBytes": func.greatest(Agent.storageBytes + delta, 0),
+                # a usage change is not an edit of the agent
+                "updated": Agent.updated,
+            },
+            synchronize_session=False,
+        )
+        owner_id = select(Agent.adminId).where(Agent.agentId == agent_id).scalar_subquery()
+        db.query(User).filter(User.userId == owner_id).update(
+            {"storageBytes": func.greatest(User.storageBytes + delta, 0)},
+            synchronize_session=False,
+        )
+
+    def remove_agent(self, db: Session, agent_id: str):
+        """Uncharge the owner of an agent about to be deleted"""
+        storage_bytes = (
+            db.query(Agent.storageBytes).filter(Agent.agentId == agent_id).scalar()
+        )
+        if storage_bytes:
+            self.add(db, agent_id, -storage_bytes)
+
+    def check_quota(self, db: Session, agent_id: str, size: int):
+        """Raise 403 if storing `size` more bytes would put the agent's owner over quota"""
+        if settings.storage_quota_bytes is None:
+            return
+        used = (
+            db.query(User.storageBytes)
+            .join(Agent, Agent.adminId == User.userId)
+            .filter(Agent.agentId == agent_id)
+            .scalar()
+        )
+        if used is not None and used + size > settings.storage_quota_bytes:
+            raise HTTPException(status_code=403, detail="Storage quota exceeded")
+
+    def get_usage(self, db: Session, user_id: str) -> Dict[str, Any]:
+        used = db.query(User.storageBytes).filter(User.userId == user_id).scalar()
+        agents = (
+            db.query(Agent.agentId, Agent.name, Agent.storageBytes)
+            .filter(Agent.adminId == user_id)
+            .order_by(Agent.storageBytes.desc())
+            .all()
+        )
+        return {
+            "storageBytes": used or 0,
+            "quotaBytes": settings.storage_quota_bytes,
+            "agents": [
+                {"agentId": agent_id, "name": name, "storageBytes": storage_bytes}
+                for agent_id, name, storage_bytes in agents
+            ],
+        }
+
+    def _enqueue_reconcile(self):
+        db = get_db_session()
+        try:
+            job_service.enqueue_once(db, USAGE_RECONCILE_JOB, {}, include_running=True)
+            db.commit()
+        finally:
+            db.close()
+
+    async def schedule_reconcile(self):
+        await asyncio.to_thread(self._enqueue_reconcile)
+
+    def _apply(self, listed: Dict[str, int]) -> int:
+        """Reset drifted agent counters to their images plus the bytes listed
+        under their prefix, then every user to the sum of their agents."""
+        db = get_db_session()
+        try:
+            expected = dict(listed)
+            image_bytes = (
+                db.query(ImageKey.agentId, func.sum(Blob.size))
+                .join(Blob, Blob.blobHash == ImageKey.blobHash)
+                .group_by(ImageKey.agentId)
+            )
+            for agent_id, size in image_bytes:
+                expected[agent_id] = expected.get(agent_id, 0) + int(size)
+
+            drifted: List[Dict[str, Any]] = []
+            for agent_id, storage_bytes in db.query(
+                Agent.agentId, Agent.storageBytes
+            ).yield_per(1000):
+                actual = expected.get(agent_id, 0)
+                if storage_bytes != actual:
+                    drifted.append({"b_agentId": agent_id, "b_storageBytes": actual})
+
+            if drifted:
+                # one executemany, on the connection to keep the ORM out of it
+                db.connection().execute(
+                    update(Agent.__table__)
+                    .where(Agent.agentId == bindparam("b_agentId"))
+                    .values(
+                        storageBytes=bindparam("b_storageBytes"),
+                        updated=Agent.updated,
+                    ),
+                    drifted,
+                )
+
+            owned = (
+                select(func.coalesce(func.sum(Agent.storageBytes), 0))
+                .where(Agent.adminId == User.userId)
+                .scalar_subquery()
+            )
+            db.query(User).filter(User.storageBytes != owned).update(
+                {"storageBytes": owned}, synchronize_session=False
+            )
+            db.commit()
+            return len(drifted)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def run_reconcile_job(self, job: JobSchema) -> Dict[str, Any]:
+        # bytes per agent id, only for agents that have objects of their own
+        progress = dict(job.checkpoint or {"startAfter": None, "objects": 0, "listed": {}})
+        listed: Dict[str, int] = progress["listed"]
+
+        while True:
+            objects = await asyncio.to_thread(
+                s3_client.list_objects, AGENTS_PREFIX, progress["startAfter"]
+            )
+            if not objects:
+                break
+            for key, size in objects:
+                agent_id = key[len(AGENTS_PREFIX) :].split("/", 1)[0]
+                listed[agent_id] = listed.get(agent_id, 0) + size
+            progress["startAfter"] = objects[-1][0]
+            progress["objects"] += len(objects)
+            await asyncio.to_thread(job_service.save_checkpoint, job.jobId, progress)
+
+        drifted = await asyncio.to_thread(self._apply, listed)
+        if drifted:
+            logger.info(f"Corrected storage usage of {drifted} agent(s)")
+        return {"objects": progress["objects"], "drifted": drifted}
+
+
+usage_service = UsageService()
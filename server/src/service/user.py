@@ -1,24 +1,107 @@
-from src.objects.index import UserSchema, CreateUserRequest
+from src.objects.index import UserSchema, CreateUserRequest, PublicUserSchema, User
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.cache import SingleFlight, TTLCache
 from src.lib.gittea import gitea_client
 from src.lib.logger import logger
 from src.utils.date import now
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet
+from sqlalchemy.orm import Session
 import secrets
-from typing import Union
+import threading
+import time
+from typing import Optional, Set, Tuple, Union
+
+# ("userId", id) or ("username", name)
+ProfileKey = Tuple[str, str]
 
 
 class UserService:
     def __init__(self):
-        pass
+        # serialized PublicUserSchema and the time it stops being fresh, kept
+        # around past that so a stale hit answers at once while it refreshes
+        self.profiles = TTLCache(
+            maxsize=settings.profile_cache_size,
+            ttl=settings.profile_cache_ttl + settings.profile_cache_stale,
+        )
+        self._loads = SingleFlight()
+        self._refresher = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="profile-refresh"
+        )
+        self._refreshing: Set[ProfileKey] = set()
+        self._lock = threading.Lock()
+        # bumped by every invalidation, so loads that read the row before it
+        # changed do not cache what they read
+        self._generation = 0
 
     def _generate_api_key(self) -> str:
         """Generate secure API key for SDK access"""
         return f"modaic_{secrets.token_urlsafe(32)}"
 
     def _encrypt_token(self, token: str) -> str:
-        """Encrypt Gitea token for storage - placeholder implementation"""
-        # TODO: Implement proper encryption using your preferred method
-        # For now, just storing as-is (not secure for production)
-        return token
+        """Encrypt Gitea token for storage with the configured Fernet key"""
+        if not settings.gittea_token_key:
+            raise ValueError("gittea_token_key is not set, refusing to store a Gitea token")
+        return Fernet(settings.gittea_token_key).encrypt(token.encode()).decode()
+
+    def _decrypt_token(self, encrypted: str) -> str:
+        """Decrypt a Gitea token stored by _encrypt_token"""
+        return Fernet(settings.gittea_token_key).decrypt(encrypted.encode()).decode()
+
+    def _load_profile(self, db: Session, key: ProfileKey) -> Optional[bytes]:
+        generation = self._generation
+        field, value = key
+        column = User.userId if field == "userId" else User.username
+        user = db.query(User).filter(column == value).first()
+        if not user:
+            return None
+
+        content = PublicUserSchema.model_validate(user).model_dump_json().encode("utf-8")
+        entry = (content, time.monotonic() + settings.profile_cache_ttl)
+        with self._lock:
+            if generation == self._generation:
+                self.profiles.set(("userId", user.userId), entry)
+                self.profiles.set(("username", user.username), entry)
+        return content
+
+    def _refresh_profile(self, key: ProfileKey):
+        db = get_db_session()
+        try:
+            if self._load_profile(db, key) is None:
+                self.profiles.delete(key)
+        except Exception as e:
+            logger.warning(f"Failed to refresh profile {key}: {str(e)}")
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_profile(self, db: Session, key: ProfileKey) -> Optional[bytes]:
+        """PublicUserSchema JSON of a user, or None if there is no such user.
+        A stale entry is returned as is and refreshed in the background."""
+        entry = self.profiles.get(key)
+        if entry is None:
+            # concurrent misses for the same profile share one query
+            return self._loads.do(key, lambda: self._load_profile(db, key))
+
+        content, fresh_until = entry
+        if fresh_until < time.monotonic():
+            with self._lock:
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            if refresh:
+                self._refresher.submit(self._refresh_profile, key)
+        return content
+
+    def invalidate_profile(self, user_id: str, *usernames: str):
+        """Forget a changed user's profile; call after the change is committed.
+        Only this process's cache is cleared, the others age out."""
+        with self._lock:
+            self._generation += 1
+            self.profiles.delete(("userId", user_id))
+            for username in usernames:
+                self.profiles.delete(("username", username))
 
 
 user_service = UserService()
@@ -0,0 +1,314 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert
+from src.objects.index import WebhookDelivery, WebhookDeliverySchema
+from src.core.config import settings
+from src.db.pg import get_db_session
+from src.lib.gittea import count_gitea_calls
+from src.lib.logger import logger
+from src.lib.worker import backoff_delay
+from src.service.agent import agent_service
+from src.utils.date import now, from_now
+
+
+class WebhookService:
+    """
+    Durable inbox for Gitea webhooks.
+
+    Verified deliveries are stored keyed by their X-Gitea-Delivery id, which
+    makes redeliveries no-ops, and acknowledged straight away. Workers claim
+    them with `SELECT ... FOR UPDATE SKIP LOCKED`, retry failures with
+    backoff, and move a delivery to `dead` after its last attempt.
+    """
+
+    def __init__(self):
+        self.max_attempts = settings.webhook_max_attempts
+
+    def record_delivery(
+        self,
+        delivery_id: str,
+        event: str,
+        payload: Dict[str, Any],
+        repo_key: Optional[str] = None,
+        ref: Optional[str] = None,
+    ) -> bool:
+        """Store a delivery. Returns False if it was already received."""
+        db = get_db_session()
+        try:
+            result = db.execute(
+                insert(WebhookDelivery)
+                .values(
+                    deliveryId=delivery_id,
+                    event=event,
+                    payload=payload,
+                    repoKey=repo_key,
+                    ref=ref,
+                    status="pending",
+                    attempts=0,
+                    nextAttemptAt=now(),
+                    created=now(),
+                    updated=now(),
+                )
+                .on_conflict_do_nothing(index_elements=["deliveryId"])
+            )
+            db.commit()
+            return result.rowcount == 1
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def claim_next(self) -> Optional[List[WebhookDeliverySchema]]:
+        """
+        Claim the oldest due delivery. A push is only due once it has waited
+        out the coalescing window, and is claimed together with every other
+        pending push for the same repository so a burst is mirrored once.
+        """
+        db = get_db_session()
+        try:
+            timestamp = now()
+            settled = from_now(-settings.webhook_coalesce_window)
+            busy = aliased(WebhookDelivery)
+            repo_busy = (
+                db.query(busy.deliveryId)
+                .filter(
+                    busy.repoKey == WebhookDelivery.repoKey,
+                    busy.status == "processing",
+                    busy.leaseExpires > timestamp,
+                )
+                .exists()
+            )
+            delivery = (
+                db.query(WebhookDelivery)
+                .filter(
+                    or_(
+                        and_(
+                            WebhookDelivery.status == "pending",
+                            WebhookDelivery.nextAttemptAt <= timestamp,
+                            or_(
+                                WebhookDelivery.event != "push",
+                                WebhookDelivery.created <= settled,
+                            ),
+                        ),
+                        # a worker died while processing it
+                        and_(
+                            WebhookDelivery.status == "processing",
+                            WebhookDelivery.leaseExpires <= timestamp,
+                        ),
+                    ),
+                    # skip repositories already being mirrored, see the lock below
+                    or_(WebhookDelivery.repoKey.is_(None), ~repo_busy),
+                )
+                .order_by(WebhookDelivery.nextAttemptAt)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not delivery:
+                db.rollback()
+                return None
+
+            if delivery.repoKey:
+                # the check above cannot see claims not committed yet, so
+                # claims of one repository take turns on an advisory lock,
+                # held until commit, and check again once they hold it
+                locked = db.execute(
+                    select(func.pg_try_advisory_xact_lock(func.hashtext(delivery.repoKey)))
+                ).scalar()
+                if not locked or (
+                    db.query(WebhookDelivery.deliveryId)
+                    .filter(
+                        WebhookDelivery.repoKey == delivery.repoKey,
+                        WebhookDelivery.status == "processing",
+                        WebhookDelivery.leaseExpires > timestamp,
+                    )
+                    .first()
+                ):
+                    db.rollback()
+                    return None
+
+            batch = [delivery]
+            if delivery.event == "push" and delivery.repoKey:
+                batch += (
+                    db.query(WebhookDelivery)
+                    .filter(
+                        WebhookDelivery.repoKey == delivery.repoKey,
+                        WebhookDelivery.event == "push",
+                        WebhookDelivery.status == "pending",
+                        WebhookDelivery.deliveryId != delivery.deliveryId,
+                    )
+                    .with_for_update(skip_locked=True)
+                    .all()
+                )
+
+            lease = from_now(settings.job_lease_seconds)
+            for claimed in batch:
+                claimed.status = "processing"
+                claimed.attempts += 1
+                claimed.leaseExpires = lease
+            db.commit()
+            return sorted(
+                (WebhookDeliverySchema.model_validate(claimed) for claimed in batch),
+                key=lambda claimed: claimed.created,
+            )
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _update(self, delivery_id: str, values: Dict[str, Any]):
+        db = get_db_session()
+        try:
+            db.query(WebhookDelivery).filter(
+                WebhookDelivery.deliveryId == delivery_id
+            ).update(values)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def mark_done(self, delivery_id: str, coalesced_into: Optional[str] = None):
+        self._update(
+            delivery_id,
+            {
+                "status": "done",
+                "lastError": None,
+                "leaseExpires": None,
+                "processedAt": now(),
+                "coalescedInto": coalesced_into,
+            },
+        )
+
+    def mark_failed(self, delivery: WebhookDeliverySchema, error: str):
+        if delivery.attempts >= self.max_attempts:
+            logger.error(
+                f"Webhook delivery {delivery.deliveryId} dead after {delivery.attempts} attempts"
+            )
+            values = {"status": "dead", "processedAt": now()}
+        else:
+            values = {
+                "status": "pending",
+                "nextAttemptAt": from_now(backoff_delay(delivery.attempts)),
+            }
+        values.update({"lastError": error[:2000], "leaseExpires": None})
+        self._update(delivery.deliveryId, values)
+
+    async def process(self, batch: List[WebhookDeliverySchema]):
+        """Handle a claimed batch of deliveries and record the outcome"""
+        with count_gitea_calls() as gitea_calls:
+            try:
+                if batch[0].event == "push":
+                    heads = await self.process_push_events(batch)
+                elif batch[0].event == "repository":
+                    await self.process_repository_event(batch[0].payload)
+                    heads = {}
+                else:
+                    logger.warning(f"Ignoring unknown webhook event {batch[0].event}")
+                    heads = {}
+            except Exception as e:
+                logger.error(f"Webhook delivery {batch[-1].deliveryId} failed: {str(e)}")
+                for delivery in batch:
+                    await asyncio.to_thread(self.mark_failed, delivery, str(e))
+                return
+
+        for delivery in batch:
+            head = heads.get(delivery.ref, delivery.deliveryId)
+            coalesced_into = head if head != delivery.deliveryId else None
+            await asyncio.to_thread(self.mark_done, delivery.deliveryId, coalesced_into)
+
+        if batch[0].event == "push":
+            logger.info(
+                f"Mirrored {len(batch)} push(es) to {batch[0].repoKey} with "
+                f"{gitea_calls[0]} Gitea call(s), {gitea_calls[0] / len(batch):.2f} per push"
+            )
+
+    async def process_push_events(
+        self, batch: List[WebhookDeliverySchema]
+    ) -> Dict[Optional[str], str]:
+        """
+        Mirror a burst of pushes to one repository. Pushes to the same ref are
+        merged: the commits of every push are replayed in order against the
+        latest head. Returns the delivery id whose head was mirrored per ref.
+        """
+        by_ref: Dict[Optional[str], List[WebhookDeliverySchema]] = {}
+        for delivery in batch:
+            by_ref.setdefault(delivery.ref, []).append(delivery)
+
+        heads = {}
+        for ref, deliveries in by_ref.items():
+            latest = deliveries[-1]
+            merged = dict(latest.payload)
+            merged["commits"] = [
+                commit
+                for delivery in deliveries
+                for commit in delivery.payload.get("commits") or []
+            ]
+            merged["total_commits"] = sum(
+                delivery.payload.get(
+                    "total_commits", len(delivery.payload.get("commits") or [])
+                )
+                for delivery in deliveries
+            )
+            await self.process_push_event(merged)
+            heads[ref] = latest.deliveryId
+        return heads
+
+    async def process_push_event(self, webhook_data: Dict[str, Any]):
+        """Update agent mirror and metadata"""
+        repo_info = webhook_data.get("repository") or {}
+        repo_owner = (repo_info.get("owner") or {}).get("login")
+        repo_name = repo_info.get("name")
+
+        await agent_service.update_agent_from_push(repo_owner, repo_name, webhook_data)
+        logger.info(f"Successfully processed push event for {repo_owner}/{repo_name}")
+
+    async def process_repository_event(self, webhook_data: Dict[str, Any]):
+        """Handle repository creation and deletion"""
+        action = webhook_data.get("action")
+        repo_info = webhook_data.get("repository") or {}
+
+        if action == "created":
+            logger.info(f"New repository created: {repo_info.get('full_name')}")
+
+        elif action == "deleted":
+            repo_name = repo_info.get("name")
+            repo_owner = (repo_info.get("owner") or {}).get("login")
+
+            if repo_name and repo_owner:
+                await agent_service.delete_agent_mirror(repo_owner, repo_name)
+                logger.info(f"Repository deleted: {repo_owner}/{repo_name}")
+
+    def purge_processed(self) -> int:
+        """Drop processed deliveries past retention. Dead deliveries are kept
+        for inspection; redeliveries older than retention are not deduplicated."""
+        db = get_db_session()
+        try:
+            cutoff = from_now(-settings.webhook_retention_days * 24 * 60 * 60)
+            deleted = (
+                db.query(WebhookDelivery)
+                .filter(
+                    WebhookDelivery.status == "done",
+                    WebhookDelivery.created < cutoff,
+                )
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            if deleted:
+                logger.info(f"Purged {deleted} processed webhook deliveries")
+            return deleted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def schedule_purge(self):
+        await asyncio.to_thread(self.purge_processed)
+
+
+webhook_service = WebhookService()
@@ -0,0 +1,80 @@
+from typing import List, Union
+from src.core.config import settings
+from src.lib.worker import PeriodicTask, WorkerPool
+from src.service.job import job_service
+from src.service.blob import BLOB_GC_JOB, blob_service
+from src.service.campaign import CAMPAIGN_JOB
+from src.service.email import email_service
+from src.service.fork import FORK_JOB
+from src.service.image import DERIVATIVES_JOB
+from src.service.provisioning import PROVISION_AGENT_JOB, PROVISION_USER_JOB
+from src.service.reconcile import RECONCILE_JOB, reconcile_service
+from src.service.teardown import TEARDOWN_JOB
+from src.service.similarity import REBUILD_JOB, REFRESH_JOB, similarity_service
+from src.service.usage import USAGE_RECONCILE_JOB, usage_service
+from src.service.webhook import webhook_service
+
+
+def create_worker_pools() -> List[Union[WorkerPool, PeriodicTask]]:
+    """Build every worker pool and periodic task this deployment runs"""
+    return [
+        WorkerPool(
+            "webhook-worker",
+            claim=webhook_service.claim_next,
+            process=webhook_service.process,
+            concurrency=settings.webhook_worker_concurrency,
+            poll_interval=settings.job_poll_interval,
+        ),
+        PeriodicTask(
+            "webhook-inbox-purge", webhook_service.schedule_purge, 24 * 60 * 60
+        ),
+        # the rate limit is per process, shared by these workers
+        WorkerPool(
+            "email-worker",
+            claim=email_service.claim_batch,
+            process=email_service.process,
+            concurrency=settings.email_worker_concurrency,
+            poll_interval=settings.job_poll_interval,
+        ),
+        PeriodicTask("email-outbox-purge", email_service.schedule_purge, 24 * 60 * 60),
+        # a campaign only queues rows for the email workers, one at a time
+        job_service.create_pool("campaign-worker", [CAMPAIGN_JOB], 1),
+        # forks copy whole repositories, so keep them off Gitea's back
+        job_service.create_pool(
+            "fork-worker", [FORK_JOB], settings.fork_worker_concurrency
+        ),
+        job_service.create_pool(
+            "provisioning-worker",
+            [PROVISION_USER_JOB, PROVISION_AGENT_JOB],
+            settings.provisioning_worker_concurrency,
+        ),
+        # resizing itself runs in the image service's process pool
+        job_service.create_pool(
+            "image-worker", [DERIVATIVES_JOB], settings.image_worker_concurrency
+        ),
+        # a teardown deletes on its own thread pool, so few at a time
+        job_service.create_pool("teardown-worker", [TEARDOWN_JOB], 2),
+        # collection batches its own deletes, one run at a time
+        job_service.create_pool("blob-gc-worker", [BLOB_GC_JOB], 1),
+        PeriodicTask("blob-gc", blob_service.schedule_gc, settings.blob_gc_interval),
+        job_service.create_pool("usage-worker", [USAGE_RECONCILE_JOB], 1),
+        PeriodicTask(
+            "storage-reconcile",
+            usage_service.schedule_reconcile,
+            settings.storage_reconcile_interval,
+        ),
+        # reconciliation bounds its own concurrency, one run at a time
+        job_service.create_pool("reconcile-worker", [RECONCILE_JOB], 1),
+        PeriodicTask(
+            "gitea-reconcile",
+            reconcile_service.schedule_reconcile,
+            settings.reconcile_interval,
+        ),
+        # similarity jobs are CPU bound, one at a time is plenty
+        job_service.create_pool("similarity-worker", [REBUILD_JOB, REFRESH_JOB], 1),
+        PeriodicTask(
+            "similar-agents-rebuild",
+            similarity_service.schedule_rebuild,
+            settings.similar_agents_rebuild_interval,
+        ),
+    ]
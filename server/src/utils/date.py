@@ -1,6 +1,25 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 from pytz import UTC
 
 
 def now():
-    return datetime.now(UTC).isoformat().replace("+00:00", "Z")
+    # always with microseconds, so the strings compare in time order
+    return datetime.now(UTC).isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+def from_now(seconds: float):
+    """ISO timestamp `seconds` from now, comparable with `now()` strings"""
+    moment = datetime.now(UTC) + timedelta(seconds=seconds)
+    return moment.isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO 8601 timestamp ('Z' or offset suffix) to an aware datetime"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=UTC)
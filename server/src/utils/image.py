@@ -0,0 +1,89 @@
+import io
+import mmap
+import posixpath
+from typing import Any, Dict, List, Tuple
+from src.core.config import settings
+
+# widths of the resized variants, never wider than the original
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+# preferred first, so <picture> sources can be emitted in this order
+DERIVATIVE_FORMATS = {"avif": "image/avif", "webp": "image/webp"}
+
+
+def cloudfront_url(key: str) -> str:
+    return f"https://{settings.cloudfront_domain}/{key}"
+
+
+def derivative_widths(width: int) -> List[int]:
+    return sorted({min(target, width) for target in DERIVATIVE_WIDTHS})
+
+
+def derivative_prefix(image_key: str) -> str:
+    """blobs/ab/{hash}.png -> blobs/ab/derived/{hash}/"""
+    directory, name = posixpath.split(posixpath.splitext(image_key)[0])
+    return f"{directory}/derived/{name}/"
+
+
+def derivative_key(image_key: str, width: int, image_format: str) -> str:
+    """blobs/ab/{hash}.png -> blobs/ab/derived/{hash}/{width}w.{format}"""
+    return f"{derivative_prefix(image_key)}{width}w.{image_format}"
+
+
+def srcset(image_key: str, variants: Dict[str, Any]) -> Dict[str, str]:
+    """A srcset per variant content type, for <picture> <source> elements"""
+    return {
+        DERIVATIVE_FORMATS[image_format]: ", ".join(
+            f"{cloudfront_url(derivative_key(image_key, width, image_format))} {width}w"
+            for width in variants["widths"]
+        )
+        for image_format in DERIVATIVE_FORMATS
+        if image_format in variants["formats"]
+    }
+
+
+def render_derivatives(path: str) -> Tuple[Dict[str, Any], List[Tuple[int, str, bytes]]]:
+    """
+    Resize the image at `path` to every derivative width and encode it in
+    every supported format. CPU bound, meant to run in a worker process, which
+    memory-maps the file rather than having its bytes pickled over. Returns
+    the variants description stored on the ImageKey and the encoded
+    (width, format, bytes).
+    """
+    from PIL import Image, ImageOps, features
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        image = Image.open(data)
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        # decodes the whole image, so the mapping can go
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    formats = []
+    for image_format in DERIVATIVE_FORMATS:
+        try:
+            if features.check(image_format):
+                formats.append(image_format)
+        except ValueError:
+            # older Pillow does not know the feature at all
+            pass
+
+    outputs = []
+    widths = derivative_widths(image.width)
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            buffer = io.BytesIO()
+            if image_format == "webp":
+                resized.save(buffer, "WEBP", quality=80, method=4)
+            else:
+                resized.save(buffer, "AVIF", quality=60)
+            outputs.append((width, image_format, buffer.getvalue()))
+
+    variants = {
+        "width": image.width,
+        "height": image.height,
+        "widths": widths,
+        "formats": formats,
+    }
+    return variants, outputs
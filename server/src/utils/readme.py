@@ -0,0 +1,99 @@
+import hashlib
+import posixpath
+import re
+from typing import Dict, List, Optional
+import markdown
+import nh3
+from src.core.config import settings
+
+# bump when rendering or sanitising changes, so stored HTML is re-rendered
+RENDERER_VERSION = "2"
+
+ALLOWED_TAGS = {
+    "a", "blockquote", "br", "code", "del", "details", "div", "em", "h1", "h2",
+    "h3", "h4", "h5", "h6", "hr", "img", "kbd", "li", "ol", "p", "pre", "span",
+    "strong", "sub", "summary", "sup", "table", "tbody", "td", "th", "thead",
+    "tr", "ul",
+}
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "img": {"src", "alt", "title", "width", "height"},
+    "code": {"class"},
+    "td": {"align"},
+    "th": {"align"},
+}
+S3_URL_PATTERN = re.compile(
+    r"^https?://(?:(?P<bucket>[^./]+)\.s3[.-][^/]*amazonaws\.com/(?P<key>.+)"
+    r"|s3[.-][^/]*amazonaws\.com/(?P<path_bucket>[^/]+)/(?P<path_key>.+))$"
+)
+
+
+def readme_hash(source: str, images: Optional[Dict[str, str]] = None) -> str:
+    """Hash of a README as rendered: source, renderer version, image domain
+    and the images relative paths resolve to"""
+    digest = hashlib.sha256()
+    resolved = "\n".join(f"{name}={key}" for name, key in sorted((images or {}).items()))
+    for part in (RENDERER_VERSION, settings.cloudfront_domain, resolved, source):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def image_names(image_keys: List[str]) -> Dict[str, str]:
+    """File name -> object key of an agent's uploaded images, as relative
+    README paths name them"""
+    return {posixpath.basename(key): key for key in image_keys}
+
+
+def image_url(
+    src: str, agent_id: str, images: Optional[Dict[str, str]] = None
+) -> Optional[str]:
+    """
+    Serve README images from CloudFront. Direct bucket URLs are moved to the
+    CloudFront domain, and repository-relative paths point at the agent's
+    uploaded images, found by file name in `images`. Other absolute URLs are
+    kept.
+    """
+    match = S3_URL_PATTERN.match(src)
+    if match:
+        bucket = match.group("bucket") or match.group("path_bucket")
+        key = match.group("key") or match.group("path_key")
+        if bucket == settings.s3_bucket_name:
+            return f"https://{settings.cloudfront_domain}/{key}"
+        return src
+    if re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:|^//", src):
+        return src
+
+    path = posixpath.normpath(src.split("#", 1)[0].split("?", 1)[0]).lstrip("/")
+    if path.startswith("..") or path in ("", "."):
+        return None
+    key = (images or {}).get(posixpath.basename(path))
+    if key:
+        return f"https://{settings.cloudfront_domain}/{key}"
+    # images uploaded before blobs, or not uploaded at all
+    if path.startswith("images/"):
+        path = path[len("images/") :]
+    return f"https://{settings.cloudfront_domain}/agents/{agent_id}/images/{path}"
+
+
+def render_readme(
+    source: str, agent_id: str, images: Optional[Dict[str, str]] = None
+) -> str:
+    """Render README markdown to sanitised HTML"""
+    html = markdown.markdown(
+        source, extensions=["fenced_code", "tables", "sane_lists"]
+    )
+
+    def rewrite(element: str, attribute: str, value: str) -> Optional[str]:
+        if element == "img" and attribute == "src":
+            return image_url(value, agent_id, images)
+        return value
+
+    return nh3.clean(
+        html,
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        attribute_filter=rewrite,
+        url_schemes={"http", "https", "mailto"},
+        link_rel="noopener noreferrer nofollow",
+    )
@@ -1,18 +1,26 @@
 import re
-import uuid
+from sqlalchemy.exc import IntegrityError
 from src.objects.index import User
 from sqlalchemy.orm import Session
 
+# how many usernames to try when concurrent sign-ups keep taking them
+USERNAME_ATTEMPTS = 5
+
 
 def generate_username(email: str, db: Session) -> str:
     """
-    Generate a guaranteed unique username from an email address.
+    Generate a unique username from an email address.
+
+    The base name and its numbered variants already taken are fetched in one
+    indexed prefix scan, and the first free one is returned. A concurrent
+    sign-up can still take it before the caller inserts, so retry on
+    `is_username_conflict`.
 
     Args:
         email: User's email address
 
     Returns:
-        A unique username string
+        A username string, unique when this was called
 
     Raises:
         ValueError: If email is invalid or empty
@@ -30,22 +38,32 @@ def generate_username(email: str, db: Session) -> str:
     # clean the username: remove non-alphanumeric characters except underscores
     base_username = re.sub(r"[^a-z0-9_]", "", base_username)
 
-    # ensure minimum length
-    if len(base_username) < 3:
-        base_username = f"{base_username}"
-
-    # check if base username is available
-    if not db.query(User).filter(User.username == base_username).first():
+    # the base and every base<digits>; "_" is a LIKE wildcard, so escape it
+    prefix = base_username.replace("_", "\\_")
+    taken = [
+        username
+        for (username,) in db.query(User.username).filter(
+            User.username.like(f"{prefix}%", escape="\\"),
+            User.username.op("~")(f"^{base_username}[0-9]*$"),
+        )
+    ]
+    if base_username not in taken:
         return base_username
 
-    # if base username exists, try with incrementing numbers
+    # only canonical suffixes can collide, "bob007" never blocks "bob7"
+    suffixes = set()
+    for username in taken:
+        suffix = username[len(base_username) :]
+        if suffix and suffix[0] != "0":
+            suffixes.add(int(suffix))
+
+    # one of the first len(suffixes) + 1 numbers is always free
     counter = 1
-    while counter <= 999:
-        candidate = f"{base_username}{counter}"
-        if not db.query(User).filter(User.username == candidate).first():
-            return candidate
+    while counter in suffixes:
         counter += 1
+    return f"{base_username}{counter}"
+
 
-    # if all numbered variants are taken, use UUID suffix for guaranteed uniqueness
-    unique_suffix = str(uuid.uuid4())[:8]
-    return f"{base_username}_{unique_suffix}"
+def is_username_conflict(error: IntegrityError) -> bool:
+    """Whether an insert failed because its username was taken meanwhile"""
+    return "(username)" in str(error.orig)
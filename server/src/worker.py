@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import signal
+from dotenv import load_dotenv
+from src.db.pg import Base, engine
+from src.db.index import test_postgres_connection
+from src.lib.gittea import async_gitea_client
+from src.lib.logger import logger
+from src.service.campaign import CAMPAIGNS, campaign_service
+from src.service.email import email_service
+from src.service.reconcile import reconcile_service
+from src.service.worker import create_worker_pools
+
+load_dotenv()
+
+
+def setup_database():
+    if not test_postgres_connection():
+        raise Exception("Failed to connect to PostgreSQL")
+    Base.metadata.create_all(engine)
+
+
+async def run_workers():
+    """Run every worker pool until SIGTERM/SIGINT, then drain them"""
+    setup_database()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    pools = create_worker_pools()
+    for pool in pools:
+        pool.start()
+    logger.info("SUCCESS: WORKERS STARTED")
+
+    await stopping.wait()
+    logger.info("Shutdown requested, draining workers...")
+    await asyncio.gather(*(pool.stop() for pool in pools))
+    await email_service.async_pool.close()
+    await async_gitea_client.aclose()
+    engine.dispose()
+    logger.info("Workers stopped")
+
+
+async def run_reconcile():
+    """Reconcile Gitea with PostgreSQL once, in the foreground"""
+    setup_database()
+    try:
+        await reconcile_service.run_now()
+    finally:
+        await async_gitea_client.aclose()
+        engine.dispose()
+
+
+async def run_campaign(campaign: str):
+    """Queue an email campaign to every user once, in the foreground"""
+    setup_database()
+    try:
+        await campaign_service.run_now(campaign)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background workers")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=["run", "reconcile", "campaign"],
+        help="run all workers (default), reconcile Gitea once, or queue a campaign",
+    )
+    parser.add_argument(
+        "campaign", nargs="?", choices=sorted(CAMPAIGNS), help="campaign to queue"
+    )
+    args = parser.parse_args()
+
+    if args.command == "reconcile":
+        asyncio.run(run_reconcile())
+    elif args.command == "campaign":
+        if not args.campaign:
+            parser.error("campaign needs the name of a campaign")
+        asyncio.run(run_campaign(args.campaign))
+    else:
+        asyncio.run(run_workers())
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import pytest
+from moto import mock_aws
+
+# settings and S3 clients are built when src is imported, so both the
+# environment and the S3 mock must be in place before any test module loads
+TEST_ENVIRONMENT = {
+    "ENVIRONMENT": "test",
+    "STYTCH_PROJECT_ID": "test",
+    "STYTCH_SECRET": "test",
+    "STYTCH_PROJECT_DOMAIN": "test",
+    "GMAIL_APP_PASSWORD": "test",
+    "NEXT_URL": "http://localhost:3000",
+    "S3_BUCKET_NAME": "modaic-test",
+    "S3_PART_SIZE": str(5 * 1024 * 1024),
+    "CLOUDFRONT_DOMAIN": "cdn.test",
+    "GITTEA_URL": "http://localhost:3001",
+    "GITTEA_ADMIN_TOKEN": "test",
+    "GITTEA_WEBHOOK_SECRET": "test",
+    "POSTGRES_DATABASE": "modaic_test",
+    "POSTGRES_CONNECTION_URL": os.getenv(
+        "TEST_POSTGRES_URL", "postgresql://postgres@localhost:5432/modaic_test"
+    ),
+    "CACHE_DIR": tempfile.mkdtemp(prefix="modaic-test-"),
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "AWS_DEFAULT_REGION": "us-east-1",
+}
+
+_aws = mock_aws()
+
+
+def pytest_configure(config):
+    os.environ.update(TEST_ENVIRONMENT)
+    _aws.start()
+
+
+def pytest_unconfigure(config):
+    _aws.stop()
+
+
+@pytest.fixture
+def s3():
+    """An empty bucket, and the client the app uses to reach it"""
+    from src.lib.s3 import s3_client
+
+    s3_client.bucket.create()
+    yield s3_client
+    s3_client.bucket.objects.all().delete()
+    for upload in s3_client.bucket.multipart_uploads.all():
+        upload.abort()
+    s3_client.bucket.delete()
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """The app's engine on a test database, skipping if none is reachable"""
+    from sqlalchemy.exc import OperationalError
+    from src.db.pg import Base, engine
+    import src.objects.index  # noqa: F401, registers every model
+
+    try:
+        engine.connect().close()
+    except OperationalError:
+        pytest.skip("no test database, set TEST_POSTGRES_URL")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    from src.db.pg import get_db_session
+
+    session = get_db_session()
+    yield session
+    session.rollback()
+    session.close()
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import os
+from src.core.config import settings
+from src.objects.index import Blob, Job
+from src.service.blob import BLOB_GC_JOB, STAGING_PREFIX, blob_service
+from src.service.job import job_service
+from src.utils.date import from_now
+from src.utils.image import derivative_key
+
+
+async def chunks(data: bytes):
+    yield data
+
+
+def store(db, data: bytes):
+    """Upload bytes the way the image route does, returning the blob and
+    whether its bytes were new"""
+
+    async def upload():
+        staged_key, digest, size = await blob_service.stage(
+            chunks(data), "image/png", len(data)
+        )
+        try:
+            return await blob_service.store_staged(
+                db, staged_key, digest, size, "image/png"
+            )
+        finally:
+            blob_service.discard(staged_key)
+
+    blob, new = asyncio.run(upload())
+    db.commit()
+    return blob, new
+
+
+def test_same_bytes_are_stored_once(s3, db):
+    data = os.urandom(2048)
+
+    first, first_new = store(db, data)
+    second, second_new = store(db, data)
+
+    assert first_new and not second_new
+    assert first.blobHash == second.blobHash == hashlib.sha256(data).hexdigest()
+    assert s3.list_keys("blobs/") == [first.blobKey]
+    assert s3.list_keys(STAGING_PREFIX) == []
+
+
+def test_gc_collects_only_old_unreferenced_blobs(s3, db):
+    # (hash, key) pairs, as the garbage's row is gone afterwards
+    garbage, referenced, recent = [
+        (blob.blobHash, blob.blobKey)
+        for blob, _ in (store(db, os.urandom(2048)) for _ in range(3))
+    ]
+    blob_service.acquire(db, referenced[0])
+    s3.put_bytes(derivative_key(garbage[1], 320, "webp"), b"variant", "image/webp")
+
+    expired = from_now(-settings.blob_gc_grace - 60)
+    db.query(Blob).filter(Blob.blobHash.in_([garbage[0], referenced[0]])).update(
+        {"updated": expired}, synchronize_session=False
+    )
+    job = job_service.enqueue(db, BLOB_GC_JOB, {})
+    db.commit()
+
+    # any collection left queued by an earlier run goes first
+    while True:
+        claimed = job_service.claim_next([BLOB_GC_JOB])
+        if not claimed:
+            break
+        asyncio.run(job_service.run(claimed))
+
+    remaining = {
+        blob_hash
+        for (blob_hash,) in db.query(Blob.blobHash).filter(
+            Blob.blobHash.in_([garbage[0], referenced[0], recent[0]])
+        )
+    }
+    assert remaining == {referenced[0], recent[0]}
+    assert sorted(s3.list_keys("blobs/")) == sorted([referenced[1], recent[1]])
+    assert db.query(Job.status).filter(Job.jobId == job.jobId).scalar() == "succeeded"
@@ -0,0 +1,68 @@
+import asyncio
+import hashlib
+import os
+import pytest
+from fastapi import HTTPException
+
+PART_SIZE = 5 * 1024 * 1024
+
+
+async def chunks(data: bytes, fail_after: int = None):
+    for start in range(0, len(data), 1024 * 1024):
+        if fail_after is not None and start >= fail_after:
+            raise RuntimeError("client went away")
+        yield data[start : start + 1024 * 1024]
+
+
+def read(s3, key: str) -> bytes:
+    return s3.client.get_object(Bucket=s3.bucket_name, Key=key)["Body"].read()
+
+
+def open_uploads(s3):
+    return s3.client.list_multipart_uploads(Bucket=s3.bucket_name).get("Uploads", [])
+
+
+def test_small_stream_is_one_put(s3):
+    data = os.urandom(1000)
+
+    asyncio.run(s3.upload_stream(chunks(data), "small", "image/png"))
+
+    assert read(s3, "small") == data
+    assert open_uploads(s3) == []
+
+
+def test_large_stream_completes_multipart_upload(s3):
+    data = os.urandom(2 * PART_SIZE + 123)
+    hasher = hashlib.sha256()
+
+    url = asyncio.run(
+        s3.upload_stream(chunks(data), "large", "image/png", on_chunk=hasher.update)
+    )
+
+    assert url == s3.url("large")
+    assert read(s3, "large") == data
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert open_uploads(s3) == []
+
+
+def test_oversized_stream_aborts_multipart_upload(s3):
+    data = os.urandom(2 * PART_SIZE)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(
+            s3.upload_stream(chunks(data), "oversized", max_bytes=PART_SIZE + 10)
+        )
+
+    assert error.value.status_code == 413
+    assert s3.get_file_size("oversized") is None
+    assert open_uploads(s3) == []
+
+
+def test_failed_stream_aborts_multipart_upload(s3):
+    data = os.urandom(2 * PART_SIZE)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(s3.upload_stream(chunks(data, fail_after=PART_SIZE + 1), "failed"))
+
+    assert s3.get_file_size("failed") is None
+    assert open_uploads(s3) == []